@@ -88,6 +88,49 @@ class Attention(nn.Module):
         x = self.proj_drop(x)
         return x
 
+    def forward_template(self, x):
+        """
+        x is the template feature only. Template tokens never attend to search tokens,
+        so their keys/values can be computed once and reused by `forward_search`.
+        :return: attended template feature, stacked (k, v) of shape
+            (2, B, heads, num_t, C // heads)
+        """
+        B, N, C = x.shape
+        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads)
+        qkv = qkv.permute(2, 0, 3, 1, 4)
+        q, k, v = qkv.unbind(0)
+
+        attn = (q @ k.transpose(-2, -1)) * self.scale
+        attn = attn.softmax(dim=-1)
+        attn = self.attn_drop(attn)
+        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x, torch.stack([k, v], dim=0)
+
+    def forward_search(self, x, kv_t):
+        """
+        x is the search feature only, kv_t is the cached (k, v) of the template from
+        `forward_template`.
+        """
+        B, N, C = x.shape
+        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads)
+        qkv = qkv.permute(2, 0, 3, 1, 4)
+        q_s, k_s, v_s = qkv.unbind(0)
+        k_t, v_t = kv_t.unbind(0)
+        k = torch.cat([k_t, k_s], dim=2)
+        v = torch.cat([v_t, v_s], dim=2)
+
+        attn = (q_s @ k.transpose(-2, -1)) * self.scale
+        attn = attn.softmax(dim=-1)
+        attn = self.attn_drop(attn)
+        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
+
 class LayerScale(nn.Module):
     def __init__(self, dim, init_values=1e-5, inplace=False):
         super().__init__()
@@ -119,6 +162,17 @@ class Block(nn.Module):
         x = x + self.drop_path2(self.mlp(self.norm2(x)))
         return x
 
+    def forward_template(self, x):
+        x_attn, kv = self.attn.forward_template(self.norm1(x))
+        x = x + self.drop_path1(x_attn)
+        x = x + self.drop_path2(self.mlp(self.norm2(x)))
+        return x, kv
+
+    def forward_search(self, x, kv_t):
+        x = x + self.drop_path1(self.attn.forward_search(self.norm1(x), kv_t))
+        x = x + self.drop_path2(self.mlp(self.norm2(x)))
+        return x
+
 
 class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
     """ Vision Transformer with support for global average pooling
@@ -193,6 +247,41 @@ class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
 
         return x_t_2d, x_s_2d
 
+    def forward_template(self, x_t):
+        """
+        :param x_t: (batch, c, 128, 128)
+        :return: per-block template keys/values, (batch, depth, 2, heads, num_t, head_dim)
+        """
+        x_t = self.patch_embed(x_t)
+        x_t = x_t + self.pos_embed_t
+        x_t = self.pos_drop(x_t)
+
+        kv_t = []
+        for blk in self.blocks:
+            x_t, kv = blk.forward_template(x_t)
+            kv_t.append(kv)
+
+        # (depth, 2, B, heads, num_t, head_dim) -> (B, depth, 2, heads, num_t, head_dim)
+        return torch.stack(kv_t, dim=0).permute(2, 0, 1, 3, 4, 5).contiguous()
+
+    def forward_search(self, x_s, kv_t):
+        """
+        :param x_s: (batch, c, 256, 256)
+        :param kv_t: template keys/values from `forward_template`, one entry per search image
+        :return: (batch, C, H_s, W_s)
+        """
+        x_s = self.patch_embed(x_s)
+        B, C = x_s.size(0), x_s.size(-1)
+        H_s = W_s = int(math.sqrt(x_s.size(1)+0.1))
+
+        x_s = x_s + self.pos_embed_s
+        x_s = self.pos_drop(x_s)
+
+        for i, blk in enumerate(self.blocks):
+            x_s = blk.forward_search(x_s, kv_t[:, i].transpose(0, 1))
+
+        return x_s.transpose(1, 2).reshape(B, C, H_s, W_s)
+
 
 def get_mixformer_vit(config):
     img_size_s = config.DATA.SEARCH.SIZE
@@ -249,6 +338,19 @@ class MixFormer(nn.Module):
         # Forward the corner head
         return self.forward_box_head(search)
 
+    def forward_template(self, template):
+        # template: (b, c, h, w), returns the per-block template cache consumed by `forward_search`
+        if template.dim() == 5:
+            template = template.squeeze(0)
+        return self.backbone.forward_template(template)
+
+    def forward_search(self, search, template_kv):
+        # search: (b, c, h, w), template_kv: (b, ...) from `forward_template`
+        if search.dim() == 5:
+            search = search.squeeze(0)
+        search = self.backbone.forward_search(search, template_kv)
+        return self.forward_box_head(search)
+
     def set_online(self, template, online_template):
         if template.dim() == 5:
             template = template.squeeze(0)
@@ -92,7 +92,7 @@ class Exp(MyExp):
         return train_loader
 
     def get_eval_loader(self, batch_size, is_distributed, testdev=False, return_origin_img=False):
-        from yolox.data import MOTDataset, ValTransform
+        from yolox.data import MOTDataset, ValTransform, VideoSampler
 
         valdataset = MOTDataset(
             data_dir=os.path.join(get_yolox_datadir(), "DanceTrack"),
@@ -108,9 +108,8 @@ class Exp(MyExp):
 
         if is_distributed:
             batch_size = batch_size // dist.get_world_size()
-            sampler = torch.utils.data.distributed.DistributedSampler(
-                valdataset, shuffle=False
-            )
+            # whole videos per rank, the trackers need all the frames of a video in order
+            sampler = VideoSampler(valdataset.video_ids())
         else:
             sampler = torch.utils.data.SequentialSampler(valdataset)
 
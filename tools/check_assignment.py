@@ -0,0 +1,108 @@
+from loguru import logger
+
+import lap
+import numpy as np
+
+from yolox.tracking_utils.assignment import LinearAssignment
+
+import argparse
+import sys
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("LinearAssignment parity with lapjv")
+    parser.add_argument("--trials", type=int, default=2000, help='random problems per kind')
+    parser.add_argument(
+        "--max_size", type=int, default=200, help='max number of tracks & detections'
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--min_pairs", type=int, default=0,
+        help='LinearAssignment.min_pairs, 0 to split every problem into components',
+    )
+    return parser
+
+
+def random_costs(rng, m, n, kind):
+    """
+    :param kind: "uniform", dense costs of a unique optimum, "ties", costs on a coarse grid
+        including the threshold itself, or "boxes", 1 - IoU of jittered boxes, mostly 1
+    """
+    if kind == "uniform":
+        return rng.uniform(0., 1., size=(m, n))
+    if kind == "ties":
+        return rng.randint(0, 5, size=(m, n)) / 4.
+    size = rng.uniform(20, 80, size=(m, 2))
+    tl = rng.uniform(0, 20 * np.sqrt(max(m, n)) * 10, size=(m, 2))
+    tracks = np.concatenate((tl, tl + size), axis=1)
+    pick = rng.randint(0, m, size=n)
+    dets = tracks[pick] + rng.normal(0, 8, size=(n, 4))
+    lt = np.maximum(tracks[:, None, :2], dets[None, :, :2])
+    rb = np.minimum(tracks[:, None, 2:], dets[None, :, 2:])
+    inter = np.prod(np.clip(rb - lt, 0, None), axis=2)
+    area_t = np.prod(tracks[:, 2:] - tracks[:, :2], axis=1)
+    area_d = np.prod(np.clip(dets[:, 2:] - dets[:, :2], 0, None), axis=1)
+    return 1 - inter / (area_t[:, None] + area_d[None] - inter)
+
+
+def gain(cost_matrix, x, thresh):
+    """cost saved by the matching over leaving every track unmatched"""
+    rows = np.nonzero(x >= 0)[0]
+    return float(np.sum(thresh - cost_matrix[rows, x[rows]]))
+
+
+def check(cost_matrix, thresh, solver, exact):
+    """
+    :param exact: whether the matching must be the one of lapjv, else only its cost, for
+        problems with ties
+    :rtype str | None, the mismatch
+    """
+    _, x_ref, y_ref = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
+    x, y = solver(cost_matrix, thresh)
+    rows = np.nonzero(x >= 0)[0]
+    if not np.array_equal(y[x[rows]], rows) or (y >= 0).sum() != len(rows):
+        return "inconsistent x & y"
+    if np.any(cost_matrix[rows, x[rows]] > thresh):
+        return "match above the threshold"
+    if exact and not (np.array_equal(x, x_ref) and np.array_equal(y, y_ref)):
+        return "different matching"
+    if not np.isclose(gain(cost_matrix, x, thresh), gain(cost_matrix, x_ref, thresh)):
+        return "different cost"
+    return None
+
+
+@logger.catch
+def main():
+    args = make_parser().parse_args()
+    logger.info("args value: {}".format(args))
+    rng = np.random.RandomState(args.seed)
+    failures = 0
+    for kind in ("uniform", "ties", "boxes"):
+        solver = LinearAssignment()
+        solver.min_pairs = args.min_pairs
+        mismatches = 0
+        for trial in range(args.trials):
+            # square & rectangular, down to a single track or detection
+            m, n = rng.randint(1, args.max_size + 1, size=2)
+            thresh = float(rng.choice([0.25, 0.5, 0.8])) if kind != "boxes" else 0.8
+            cost_matrix = random_costs(rng, m, n, kind)
+            # the same solver sees the problem again slightly moved, like the next frame
+            for repeat in range(2):
+                error = check(cost_matrix, thresh, solver, exact=kind == "uniform")
+                if error is not None:
+                    mismatches += 1
+                    logger.error("{} {}x{} thresh {} call {}: {}".format(
+                        kind, m, n, thresh, repeat, error
+                    ))
+                if kind != "ties":
+                    # not clipped, equal costs at the bounds would be ties
+                    cost_matrix = cost_matrix + rng.normal(0, 0.01, size=(m, n))
+        logger.info("{}: {} problems, {} mismatches, {}".format(
+            kind, 2 * args.trials, mismatches, solver.summary()
+        ))
+        failures += mismatches
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
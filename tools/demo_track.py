@@ -56,6 +56,10 @@ def make_parser():
     parser.add_argument("--nms", default=None, type=float, help="test nms threshold")
     parser.add_argument("--tsize", default=None, type=int, help="test img size")
     parser.add_argument("--fps", default=30, type=int, help="frame rate (fps)")
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=1,
+        help="consecutive frames detected as one batch before they are tracked one at a time",
+    )
     parser.add_argument(
         "--fp16",
         dest="fp16",
@@ -145,21 +149,31 @@ class Predictor(object):
         self.std = (0.229, 0.224, 0.225)
 
     def inference(self, img, timer):
-        img_info = {"id": 0}
-        if isinstance(img, str):
-            img_info["file_name"] = osp.basename(img)
-            img = cv2.imread(img)
-        else:
-            img_info["file_name"] = None
-
-        height, width = img.shape[:2]
-        img_info["height"] = height
-        img_info["width"] = width
-        img_info["raw_img"] = img
-
-        img, ratio = preproc(img, self.test_size, self.rgb_means, self.std)
-        img_info["ratio"] = ratio
-        img = torch.from_numpy(img).unsqueeze(0).float().to(self.device)
+        outputs, img_infos = self.inference_batch([img], timer)
+        return outputs, img_infos[0]
+
+    def inference_batch(self, imgs, timer):
+        """detect consecutive frames of a video as one batch, one output & info per frame"""
+        img_infos = []
+        batch = []
+        for img in imgs:
+            img_info = {"id": 0}
+            if isinstance(img, str):
+                img_info["file_name"] = osp.basename(img)
+                img = cv2.imread(img)
+            else:
+                img_info["file_name"] = None
+
+            height, width = img.shape[:2]
+            img_info["height"] = height
+            img_info["width"] = width
+            img_info["raw_img"] = img
+
+            img, ratio = preproc(img, self.test_size, self.rgb_means, self.std)
+            img_info["ratio"] = ratio
+            img_infos.append(img_info)
+            batch.append(torch.from_numpy(img))
+        img = torch.stack(batch).float().to(self.device)
         if self.fp16:
             img = img.half()  # to FP16
 
@@ -172,7 +186,22 @@ class Predictor(object):
                 outputs, self.num_classes, self.confthre, self.nmsthre
             )
             #logger.info("Infer time: {:.4f}s".format(time.time() - t0))
-        return outputs, img_info
+        return outputs, img_infos
+
+
+def read_windows(cap, size):
+    """consecutive frames of a capture, `size` at a time, the last window may be smaller"""
+    while True:
+        window = []
+        while len(window) < size:
+            ret_val, frame = cap.read()
+            if not ret_val:
+                break
+            window.append(frame)
+        if len(window) > 0:
+            yield window
+        if len(window) < size:
+            return
 
 
 def image_demo(predictor, vis_folder, current_time, args):
@@ -185,45 +214,60 @@ def image_demo(predictor, vis_folder, current_time, args):
     timer = Timer()
     results = []
 
-    for frame_id, img_path in enumerate(files, 1):
-        outputs, img_info = predictor.inference(img_path, timer)
-        if outputs[0] is not None:
-            online_targets = tracker.update(outputs[0], [img_info['height'], img_info['width']], exp.test_size)
-            online_tlwhs = []
-            online_ids = []
-            online_scores = []
-            for t in online_targets:
-                tlwh = t.tlwh
-                tid = t.track_id
-                vertical = tlwh[2] / tlwh[3] > args.aspect_ratio_thresh
-                if tlwh[2] * tlwh[3] > args.min_box_area and not vertical:
-                    online_tlwhs.append(tlwh)
-                    online_ids.append(tid)
-                    online_scores.append(t.score)
-                    # save results
-                    results.append(
-                        f"{frame_id},{tid},{tlwh[0]:.2f},{tlwh[1]:.2f},{tlwh[2]:.2f},{tlwh[3]:.2f},{t.score:.2f},-1,-1,-1\n"
-                    )
-            timer.toc()
-            online_im = plot_tracking(
-                img_info['raw_img'], online_tlwhs, online_ids, frame_id=frame_id, fps=1. / timer.average_time
-            )
-        else:
-            timer.toc()
-            online_im = img_info['raw_img']
+    stop = False
+    for start in range(0, len(files), args.batch_size):
+        window = files[start:start + args.batch_size]
+        outputs, img_infos = predictor.inference_batch(window, timer)
+        frames = enumerate(zip(window, outputs, img_infos), start + 1)
+        for frame_id, (img_path, output, img_info) in frames:
+            if output is not None:
+                online_targets = tracker.update(
+                    output, [img_info['height'], img_info['width']], exp.test_size
+                )
+                online_tlwhs = []
+                online_ids = []
+                online_scores = []
+                for t in online_targets:
+                    tlwh = t.tlwh
+                    tid = t.track_id
+                    vertical = tlwh[2] / tlwh[3] > args.aspect_ratio_thresh
+                    if tlwh[2] * tlwh[3] > args.min_box_area and not vertical:
+                        online_tlwhs.append(tlwh)
+                        online_ids.append(tid)
+                        online_scores.append(t.score)
+                        # save results
+                        results.append(
+                            f"{frame_id},{tid},{tlwh[0]:.2f},{tlwh[1]:.2f},{tlwh[2]:.2f},"
+                            f"{tlwh[3]:.2f},{t.score:.2f},-1,-1,-1\n"
+                        )
+                timer.toc()
+                online_im = plot_tracking(
+                    img_info['raw_img'], online_tlwhs, online_ids, frame_id=frame_id,
+                    fps=1. / timer.average_time,
+                )
+            else:
+                timer.toc()
+                online_im = img_info['raw_img']
+            # the next frame of the window is timed from here, the batch is only detected once
+            timer.tic()
 
-        # result_image = predictor.visual(outputs[0], img_info, predictor.confthre)
-        if args.save_result:
-            timestamp = time.strftime("%Y_%m_%d_%H_%M_%S", current_time)
-            save_folder = osp.join(vis_folder, timestamp)
-            os.makedirs(save_folder, exist_ok=True)
-            cv2.imwrite(osp.join(save_folder, osp.basename(img_path)), online_im)
+            # result_image = predictor.visual(outputs[0], img_info, predictor.confthre)
+            if args.save_result:
+                timestamp = time.strftime("%Y_%m_%d_%H_%M_%S", current_time)
+                save_folder = osp.join(vis_folder, timestamp)
+                os.makedirs(save_folder, exist_ok=True)
+                cv2.imwrite(osp.join(save_folder, osp.basename(img_path)), online_im)
 
-        if frame_id % 20 == 0:
-            logger.info('Processing frame {} ({:.2f} fps)'.format(frame_id, 1. / max(1e-5, timer.average_time)))
+            if frame_id % 20 == 0:
+                logger.info('Processing frame {} ({:.2f} fps)'.format(
+                    frame_id, 1. / max(1e-5, timer.average_time)
+                ))
 
-        ch = cv2.waitKey(0)
-        if ch == 27 or ch == ord("q") or ch == ord("Q"):
+            ch = cv2.waitKey(0)
+            if ch == 27 or ch == ord("q") or ch == ord("Q"):
+                stop = True
+                break
+        if stop:
             break
 
     if args.save_result:
@@ -253,14 +297,19 @@ def imageflow_demo(predictor, vis_folder, current_time, args):
     timer = Timer()
     frame_id = 0
     results = []
-    while True:
-        if frame_id % 20 == 0:
-            logger.info('Processing frame {} ({:.2f} fps)'.format(frame_id, 1. / max(1e-5, timer.average_time)))
-        ret_val, frame = cap.read()
-        if ret_val:
-            outputs, img_info = predictor.inference(frame, timer)
-            if outputs[0] is not None:
-                online_targets = tracker.update(outputs[0], [img_info['height'], img_info['width']], exp.test_size)
+    stop = False
+    # frames are read `args.batch_size` at a time and detected as one batch
+    for window in read_windows(cap, args.batch_size):
+        outputs, img_infos = predictor.inference_batch(window, timer)
+        for output, img_info in zip(outputs, img_infos):
+            if frame_id % 20 == 0:
+                logger.info('Processing frame {} ({:.2f} fps)'.format(
+                    frame_id, 1. / max(1e-5, timer.average_time)
+                ))
+            if output is not None:
+                online_targets = tracker.update(
+                    output, [img_info['height'], img_info['width']], exp.test_size
+                )
                 online_tlwhs = []
                 online_ids = []
                 online_scores = []
@@ -273,23 +322,28 @@ def imageflow_demo(predictor, vis_folder, current_time, args):
                         online_ids.append(tid)
                         online_scores.append(t.score)
                         results.append(
-                            f"{frame_id},{tid},{tlwh[0]:.2f},{tlwh[1]:.2f},{tlwh[2]:.2f},{tlwh[3]:.2f},{t.score:.2f},-1,-1,-1\n"
+                            f"{frame_id},{tid},{tlwh[0]:.2f},{tlwh[1]:.2f},{tlwh[2]:.2f},"
+                            f"{tlwh[3]:.2f},{t.score:.2f},-1,-1,-1\n"
                         )
                 timer.toc()
                 online_im = plot_tracking(
-                    img_info['raw_img'], online_tlwhs, online_ids, frame_id=frame_id + 1, fps=1. / timer.average_time
+                    img_info['raw_img'], online_tlwhs, online_ids, frame_id=frame_id + 1,
+                    fps=1. / timer.average_time,
                 )
             else:
                 timer.toc()
                 online_im = img_info['raw_img']
+            # the next frame of the window is timed from here, the batch is only detected once
+            timer.tic()
             if args.save_result:
                 vid_writer.write(online_im)
             ch = cv2.waitKey(1)
             if ch == 27 or ch == ord("q") or ch == ord("Q"):
+                stop = True
                 break
-        else:
+            frame_id += 1
+        if stop:
             break
-        frame_id += 1
 
     if args.save_result:
         res_file = osp.join(vis_folder, f"{timestamp}.txt")
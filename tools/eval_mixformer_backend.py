@@ -0,0 +1,169 @@
+from loguru import logger
+
+import numpy as np
+import torch
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../MixViT'))
+import MixViT.lib.train.admin.settings as ws_settings
+from MixViT.lib.train.base_functions import update_settings
+from yolox.exp import get_exp
+from yolox.tracking_utils.heatmap import gather_similarity, heatmap_scores
+from yolox.tracking_utils.mixformer_backend import build_network
+from yolox.tracking_utils.roi_crop import ROICropper
+from yolox.utils import configure_cpu
+
+import argparse
+import importlib
+import time
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("MixFormer backend agreement")
+    parser.add_argument(
+        "-f", "--exp_file", default=None, type=str, help="exp file, its val set is sampled"
+    )
+    parser.add_argument("--script", type=str, default='mixformer_deit')
+    parser.add_argument("--config", type=str, default='track')
+    parser.add_argument(
+        "--backend", type=str, default="int8", choices=["onnx", "int8"],
+        help='backend compared with pytorch fp32',
+    )
+    parser.add_argument(
+        "--onnx_model", type=str, default="mixformer.onnx",
+        help='joint MixFormer graph from tools/export_mixformer_onnx.py',
+    )
+    parser.add_argument(
+        "--cpu_threads", type=int, default=None,
+        help='intra-op threads, one per physical core by default',
+    )
+    parser.add_argument(
+        "--num_pairs", type=int, default=512, help='number of template/search pairs'
+    )
+    parser.add_argument(
+        "--gap", type=int, default=1, help='frames between the template and the search region'
+    )
+    parser.add_argument("--radius", type=int, default=0, help='radius for computing similarity')
+    parser.add_argument("-b", "--batch-size", type=int, default=16, help='pairs per forward')
+    return parser
+
+
+def sample_pairs(dataset, num_pairs, gap):
+    """
+    Pick ground truth tracks visible in frames t and t + gap of the same video, spread
+    evenly over the dataset.
+    :rtype list of (index of frame t, index of frame t + gap, track id)
+    """
+    pairs = []
+    for index in range(len(dataset) - gap):
+        _, info, _ = dataset.annotations[index]
+        _, info_next, _ = dataset.annotations[index + gap]
+        # same video & consecutive frames
+        if info[3] != info_next[3] or info_next[2] - info[2] != gap:
+            continue
+        ids = np.intersect1d(dataset.load_anno(index)[:, 5], dataset.load_anno(index + gap)[:, 5])
+        pairs.extend((index, index + gap, track_id) for track_id in ids)
+    step = max(len(pairs) // num_pairs, 1)
+    return pairs[::step][:num_pairs]
+
+
+def load_box(dataset, index, track_id):
+    """tlwh of a ground truth track"""
+    res = dataset.load_anno(index)
+    x1, y1, x2, y2 = res[res[:, 5] == track_id][0, :4]
+    return np.array([x1, y1, x2 - x1, y2 - y1])
+
+
+@logger.catch
+def main():
+    args = make_parser().parse_args()
+    args.device = "cpu"
+    args.check_backend = False
+    configure_cpu(args.cpu_threads)
+    logger.info("args value: {}".format(args))
+
+    # mixformer setting & cfg, same as the trackers
+    settings = ws_settings.Settings()
+    settings.script_name = args.script
+    settings.config_name = args.config
+    prj_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../MixViT"))
+    settings.cfg_file = os.path.join(prj_dir, f"experiments/{args.script}/{args.config}.yaml")
+    config_module = importlib.import_module("lib.config.%s.config" % settings.script_name)
+    cfg = config_module.cfg
+    config_module.update_config_from_file(settings.cfg_file)
+    update_settings(settings, cfg)
+    cropper = ROICropper(settings, cfg.DATA.MEAN, cfg.DATA.STD)
+
+    network = build_network(args, cfg)
+    reference = build_network(argparse.Namespace(**{**vars(args), "backend": "torch"}), cfg)
+
+    exp = get_exp(args.exp_file, None)
+    dataset = exp.get_eval_loader(1, False).dataset
+    pairs = sample_pairs(dataset, args.num_pairs, args.gap)
+    logger.info("sampled {} template/search pairs".format(len(pairs)))
+
+    def load_img(index):
+        return torch.from_numpy(dataset.pull_item(index)[0]).permute(2, 0, 1)
+
+    elapsed = {"fp32": 0.0, args.backend: 0.0}
+    score_diff, peak_match, sim_fp32, sim_backend = [], [], [], []
+    with torch.inference_mode():
+        for start in range(0, len(pairs), args.batch_size):
+            templates, searches, coords = [], [], []
+            for index, index_next, track_id in pairs[start:start + args.batch_size]:
+                box = load_box(dataset, index, track_id)[None]
+                template, _ = cropper.crop(load_img(index), box, "template")
+                # search around the previous box like the tracker, the target is the new box
+                box_next = load_box(dataset, index_next, track_id)[None]
+                search, _, coord = cropper.crop(load_img(index_next), box, "search", box_next)
+                templates.append(template)
+                searches.append(search)
+                coords.append(coord)
+            templates, searches = torch.cat(templates), torch.cat(searches)
+            coords = np.concatenate(coords)
+
+            scores = {}
+            for name, net in (("fp32", reference), (args.backend, network)):
+                tic = time.perf_counter()
+                scores[name] = heatmap_scores(
+                    net.forward_search(searches, net.forward_template(templates)), args.radius
+                )
+                elapsed[name] += time.perf_counter() - tic
+            expected, actual = scores["fp32"], scores[args.backend]
+            expected, actual = expected.flatten(1), actual.flatten(1)
+            score_diff.append((actual - expected).abs().max(dim=1)[0].numpy())
+            peak_match.append((actual.argmax(1) == expected.argmax(1)).numpy())
+            search_size = cropper.output_sz["search"]
+            sim_fp32.append(gather_similarity(scores["fp32"], coords, search_size)[:, 0])
+            sim_backend.append(gather_similarity(scores[args.backend], coords, search_size)[:, 0])
+
+    score_diff, peak_match = np.concatenate(score_diff), np.concatenate(peak_match)
+    sim_fp32, sim_backend = np.concatenate(sim_fp32), np.concatenate(sim_backend)
+    logger.info(
+        "\n".join(
+            [
+                "{} vs fp32 on {} pairs:".format(args.backend, len(pairs)),
+                "score map max abs diff: mean {:.4f}, max {:.4f}".format(
+                    score_diff.mean(), score_diff.max()
+                ),
+                "peak location agreement: {:.2%}".format(peak_match.mean()),
+                "similarity of the target: fp32 {:.4f}, {} {:.4f}, mean abs diff {:.4f}".format(
+                    sim_fp32.mean(),
+                    args.backend,
+                    sim_backend.mean(),
+                    np.abs(sim_backend - sim_fp32).mean(),
+                ),
+                "ms per pair: fp32 {:.2f}, {} {:.2f}, speedup {:.2f}x".format(
+                    elapsed["fp32"] / len(pairs) * 1e3,
+                    args.backend,
+                    elapsed[args.backend] / len(pairs) * 1e3,
+                    elapsed["fp32"] / elapsed[args.backend],
+                ),
+            ]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+from loguru import logger
+
+import torch
+from torch import nn
+
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '../MixViT'))
+from MixViT.lib.models.mixformer_vit import build_mixformer_deit
+import MixViT.lib.train.admin.settings as ws_settings
+from MixViT.lib.train.base_functions import update_settings
+from yolox.tracking_utils.mixformer_backend import OnnxMixFormer, check_parity, split_model_paths
+
+import argparse
+import importlib
+
+
+def make_parser():
+    parser = argparse.ArgumentParser("MixFormer onnx deploy")
+    parser.add_argument(
+        "--output-name", type=str, default="mixformer.onnx",
+        help="output name of the joint template+search model",
+    )
+    parser.add_argument(
+        "-o", "--opset", default=13, type=int, help="onnx opset version"
+    )
+    parser.add_argument("--no-onnxsim", action="store_true", help="use onnxsim or not")
+    parser.add_argument(
+        "--no-check", action="store_true", help="skip the parity check against pytorch"
+    )
+    parser.add_argument("--script", type=str, default='mixformer_deit')
+    parser.add_argument("--config", type=str, default='track')
+    parser.add_argument(
+        "-c", "--ckpt", default=None, type=str,
+        help="MixFormer ckpt path, MODEL.BACKBONE.PRETRAINED_PATH of the config if not given",
+    )
+    return parser
+
+
+class TemplateGraph(nn.Module):
+    """template -> per-block template keys/values"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, template):
+        return self.model.forward_template(template)
+
+
+class SearchGraph(nn.Module):
+    """search & per-block template keys/values -> heatmap"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, search, template_kv):
+        return self.model.forward_search(search, template_kv)
+
+
+def export(model, inputs, input_names, output_name, path, opset):
+    # the wrappers are created in train mode, which the export would restore on the MixFormer
+    model.eval()
+    # every input & the output have a dynamic batch dimension
+    dynamic_axes = {name: {0: "batch"} for name in input_names + [output_name]}
+    torch.onnx.export(
+        model,
+        inputs,
+        path,
+        input_names=input_names,
+        output_names=[output_name],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+    )
+    logger.info("generated onnx model named {}".format(path))
+
+
+def simplify(path):
+    import onnx
+
+    from onnxsim import simplify
+
+    # use onnxsimplify to reduce reduent model.
+    onnx_model = onnx.load(path)
+    model_simp, check = simplify(onnx_model)
+    assert check, "Simplified ONNX model could not be validated"
+    onnx.save(model_simp, path)
+    logger.info("generated simplified onnx model named {}".format(path))
+
+
+@logger.catch
+def main():
+    args = make_parser().parse_args()
+    logger.info("args value: {}".format(args))
+
+    # mixformer setting & cfg, same as the trackers
+    settings = ws_settings.Settings()
+    settings.script_name = args.script
+    settings.config_name = args.config
+    prj_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../MixViT"))
+    settings.cfg_file = os.path.join(prj_dir, f"experiments/{args.script}/{args.config}.yaml")
+    config_module = importlib.import_module("lib.config.%s.config" % settings.script_name)
+    cfg = config_module.cfg
+    config_module.update_config_from_file(settings.cfg_file)
+    update_settings(settings, cfg)
+    if args.ckpt is not None:
+        cfg.MODEL.BACKBONE.PRETRAINED = True
+        cfg.MODEL.BACKBONE.PRETRAINED_PATH = args.ckpt
+
+    model = build_mixformer_deit(cfg)
+    model.eval()
+    logger.info("loading checkpoint done.")
+
+    template_sz, search_sz = settings.output_sz["template"], settings.output_sz["search"]
+    template = torch.randn(2, 3, template_sz, template_sz)
+    search = torch.randn(2, 3, search_sz, search_sz)
+    with torch.no_grad():
+        template_kv = model.forward_template(template)
+
+    template_path, search_path = split_model_paths(args.output_name)
+    opset = args.opset
+    export(model, (template, search), ["template", "search"], "heatmap", args.output_name, opset)
+    export(TemplateGraph(model), (template,), ["template"], "template_kv", template_path, opset)
+    export(
+        SearchGraph(model), (search, template_kv), ["search", "template_kv"], "heatmap",
+        search_path, opset,
+    )
+
+    if not args.no_onnxsim:
+        for path in (args.output_name, template_path, search_path):
+            simplify(path)
+
+    if not args.no_check:
+        diff = check_parity(OnnxMixFormer(args.output_name), model, cfg)
+        logger.info("ONNX Runtime matches pytorch, max abs diff {:.2e}".format(diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,12 @@ import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../MixViT'))
 from yolox.core import launch
 from yolox.exp import get_exp
-from yolox.utils import configure_nccl, fuse_model, get_local_rank, get_model_info, setup_logger
-from yolox.evaluators import MOTEvaluator
+from yolox.utils import configure_cpu, fuse_model, get_device, get_model_info, setup_logger
+from yolox.evaluators import MOTEvaluator, build_detection_cache
+from yolox.evaluators.sweep import config_id, grid_configs, random_configs, run_sweep
 
 import argparse
+import json
 import random
 import warnings
 import glob
@@ -34,7 +36,10 @@ def make_parser():
         type=str,
         help="url used to set up distributed training",
     )
-    parser.add_argument("-b", "--batch-size", type=int, default=1, help="batch size")
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=1,
+        help="batch size, i.e. consecutive frames detected at once before they are tracked",
+    )
     parser.add_argument(
         "-d", "--devices", default=1, type=int, help="device for training"
     )
@@ -101,9 +106,11 @@ def make_parser():
     parser.add_argument("--nms", default=0.7, type=float, help="test nms threshold")
     parser.add_argument("--tsize", default=None, type=int, help="test img size")
     parser.add_argument("--seed", default=None, type=int, help="eval seed")
+    parser.add_argument("--det_cache", default=None, type=str, help="directory of cached detections, read if valid, written otherwise")
     # tracking args
     parser.add_argument("--track_thresh", type=float, default=0.6, help="tracking confidence threshold")
     parser.add_argument("--track_buffer", type=int, default=30, help="the frames for keep lost tracks")
+    parser.add_argument("--removed_buffer", type=int, default=30, help="the frames for keep the ids of removed tracks")
     parser.add_argument("--match_thresh", type=float, default=0.9, help="matching threshold for tracking")
     parser.add_argument("--iou_thresh",type=float,default=0.3)
     parser.add_argument("--min-box-area", type=float, default=100, help='filter out tiny boxes')
@@ -113,7 +120,29 @@ def make_parser():
     parser.add_argument("--config",type=str,default='track')
     parser.add_argument("--alpha",type=float,default=0.6,help='fuse parameter')
     parser.add_argument("--radius",type=int,default=0,help='radius for computing similarity')
+    parser.add_argument("--backend",type=str,default="torch",choices=["torch","onnx","int8"],help='run MixFormer on pytorch, on ONNX Runtime (cpu) or int8 quantized (cpu)')
+    parser.add_argument("--onnx_model",type=str,default="mixformer.onnx",help='joint MixFormer graph from tools/export_mixformer_onnx.py')
+    parser.add_argument("--check_backend",dest="check_backend",default=False,action="store_true",help='check the onnx/int8 MixFormer against pytorch fp32 at startup')
+    parser.add_argument("--vit_gate",dest="vit_gate",default=False,action="store_true",help='only run mixformer for ambiguous track/detection pairs')
+    parser.add_argument("--gate_iou",type=float,default=0.1,help='iou floor for a track/detection pair to be an association candidate')
+    parser.add_argument("--gate_margin",type=float,default=1.0,help='a candidate is ambiguous if a competing one is within this iou margin')
+    # sweep args
+    parser.add_argument("--sweep",type=str,default=None,help='json search space of tracker args, ranks them over the detections of --det_cache instead of evaluating')
+    parser.add_argument("--sweep_samples",type=int,default=0,help='number of random configs drawn from the search space, 0 for the whole grid')
+    parser.add_argument("--sweep_workers",type=int,default=1,help='processes of the sweep, each one holding a MixFormer')
+    parser.add_argument("--sweep_metric",type=str,default="idf1",choices=["idf1","mota"],help='metric ranking the configs of the sweep')
+    parser.add_argument(
+        "--compare_backend", type=str, default=None, choices=["onnx", "int8"],
+        help='track the detections of --det_cache with pytorch fp32 and with this MixFormer '
+        'backend instead of evaluating, and report the IDF1/MOTA difference',
+    )
+    parser.add_argument("--torch_assoc",dest="torch_assoc",default=False,action="store_true",help='keep detections & association costs on the detector device, only the cost matrices go to the cpu')
     
+    parser.add_argument("--device",type=str,default="gpu",choices=["gpu","cpu"],help='device to run detection & tracking on')
+    parser.add_argument("--cpu_threads",type=int,default=None,help='intra-op threads on cpu, one per physical core by default')
+    parser.add_argument("--pipeline",dest="pipeline",default=False,action="store_true",help='run detection ahead of tracking on a background thread')
+    parser.add_argument("--pipeline_depth",type=int,default=4,help='max number of frames detected ahead of tracking')
+    parser.add_argument("--streams",type=int,default=1,help='number of videos tracked in lock-step, every detector batch holds the next frame of each')
     parser.add_argument("--iou_only",dest="iou_only",default=False, action="store_true",help='only use iou for similarity')
     return parser
 
@@ -146,6 +175,9 @@ def main(exp, args, num_gpu):
 
     # set environment variables for distributed training
     cudnn.benchmark = True
+    if args.device == "cpu":
+        configure_cpu(args.cpu_threads)
+    device = get_device(args)
 
     rank = args.local_rank
     # rank = get_local_rank()
@@ -180,10 +212,12 @@ def main(exp, args, num_gpu):
         confthre=exp.test_conf,
         nmsthre=exp.nmsthre,
         num_classes=exp.num_classes,
+        detection_cache=build_detection_cache(args, exp, file_name),
         )
 
-    torch.cuda.set_device(rank)
-    model.cuda(rank)
+    if device.type == "cuda":
+        torch.cuda.set_device(rank)
+    model.to(device)
     model.eval()
 
     if not args.speed and not args.trt:
@@ -192,8 +226,7 @@ def main(exp, args, num_gpu):
         else:
             ckpt_file = args.ckpt
         logger.info("loading checkpoint")
-        loc = "cuda:{}".format(rank)
-        ckpt = torch.load(ckpt_file, map_location=loc)
+        ckpt = torch.load(ckpt_file, map_location=device)
         # load the model state dict
         model.load_state_dict(ckpt["model"])
         # torch.jit.load()
@@ -208,8 +241,8 @@ def main(exp, args, num_gpu):
 
     if args.trt:
         assert (
-            not args.fuse and not is_distributed and args.batch_size == 1
-        ), "TensorRT model is not support model fusing and distributed inferencing!"
+            not args.fuse and not is_distributed and args.batch_size == 1 and args.streams == 1
+        ), "TensorRT model is not support model fusing, distributed inferencing and streams!"
         trt_file = os.path.join(file_name, "model_trt.pth")
         assert os.path.exists(
             trt_file
@@ -221,14 +254,70 @@ def main(exp, args, num_gpu):
         decoder = None
 
     # start evaluate
-    *_, summary = evaluator.evaluate_mixsort(
-        model, is_distributed, args.fp16, trt_file, decoder, exp.test_size, results_folder
-    )
+    if args.streams > 1:
+        *_, summary = evaluator.evaluate_mixsort_streams(
+            model, is_distributed, args.fp16, trt_file, decoder, exp.test_size, results_folder, args.streams
+        )
+    else:
+        *_, summary = evaluator.evaluate_mixsort(
+            model, is_distributed, args.fp16, trt_file, decoder, exp.test_size, results_folder
+        )
     logger.info("\n" + summary)
 
     logger.info('Completed')
 
 
+def sweep(exp, args):
+    """
+    rank the tracker args of a search space over the cached detections, see `run_sweep`, or
+    compare a MixFormer backend with fp32 on them
+    """
+    file_name = os.path.join(exp.output_dir, args.experiment_name)
+    os.makedirs(file_name, exist_ok=True)
+    setup_logger(file_name, filename="sweep_log.txt", mode="a")
+    logger.info("Args: {}".format(args))
+
+    if args.conf is not None:
+        exp.test_conf = args.conf
+    if args.nms is not None:
+        exp.nmsthre = args.nms
+    if args.tsize is not None:
+        exp.test_size = (args.tsize, args.tsize)
+    assert args.det_cache is not None, "a sweep replays the detections of --det_cache"
+    cache = build_detection_cache(args, exp, file_name)
+    # images & ground truth of the videos
+    dataset = exp.get_eval_loader(1, False, args.test, return_origin_img=True).dataset
+    data_root = os.path.join(dataset.data_dir, dataset.name)
+
+    if args.compare_backend is not None:
+        configs = [{"backend": "torch"}, {"backend": args.compare_backend}]
+    else:
+        with open(args.sweep) as f:
+            space = json.load(f)
+        if args.sweep_samples > 0:
+            configs = random_configs(space, args.sweep_samples, args.seed or 0)
+        else:
+            configs = grid_configs(space)
+    rows = run_sweep(
+        args, "mixsort", configs, cache, data_root, os.path.join(file_name, "sweep"),
+        metric=args.sweep_metric, workers=args.sweep_workers,
+    )
+    if args.compare_backend is not None:
+        # the output may hold the cells of other sweeps
+        rows = {row["id"]: row for row in rows}
+        fp32, other = (rows[config_id(config)] for config in configs)
+        logger.info(
+            "{} vs fp32: idf1 {:.4f} vs {:.4f} ({:+.4f}), mota {:.4f} vs {:.4f} ({:+.4f}), "
+            "id switches {} vs {}".format(
+                args.compare_backend,
+                other["idf1"], fp32["idf1"], other["idf1"] - fp32["idf1"],
+                other["mota"], fp32["mota"], other["mota"] - fp32["mota"],
+                other["num_switches"], fp32["num_switches"],
+            )
+        )
+    logger.info('Completed')
+
+
 if __name__ == "__main__":
     args = make_parser().parse_args()
     exp = get_exp(args.exp_file, args.name)
@@ -237,8 +326,18 @@ if __name__ == "__main__":
     if not args.experiment_name:
         args.experiment_name = exp.exp_name
 
-    num_gpu = torch.cuda.device_count() if args.devices is None else args.devices
-    assert num_gpu <= torch.cuda.device_count()
+    if args.sweep is not None or args.compare_backend is not None:
+        # tracking only, in worker processes of its own
+        sweep(exp, args)
+        sys.exit(0)
+
+    if args.device == "cpu":
+        assert not args.fp16 and not args.trt, "fp16 and TensorRT are only supported on gpu"
+        # a single process, all cores are used by intra-op threads
+        num_gpu = 1
+    else:
+        num_gpu = torch.cuda.device_count() if args.devices is None else args.devices
+        assert num_gpu <= torch.cuda.device_count()
 
     launch(
         main,
@@ -7,10 +7,12 @@ import sys, os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../MixViT'))
 from yolox.core import launch
 from yolox.exp import get_exp
-from yolox.utils import configure_nccl, fuse_model, get_local_rank, get_model_info, setup_logger
-from yolox.evaluators import MOTEvaluator
+from yolox.utils import configure_cpu, fuse_model, get_device, get_model_info, setup_logger
+from yolox.evaluators import MOTEvaluator, build_detection_cache
+from yolox.evaluators.sweep import grid_configs, random_configs, run_sweep
 
 import argparse
+import json
 import random
 import warnings
 import glob
@@ -28,7 +30,10 @@ def make_parser():
     parser.add_argument( "--dist-backend", default="nccl", type=str, help="distributed backend")
     parser.add_argument("--output_dir", type=str, default="evaldata/trackers/mot_challenge")
     parser.add_argument("--dist-url", default=None, type=str, help="url used to set up distributed training")
-    parser.add_argument("-b", "--batch-size", type=int, default=1, help="batch size")
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=1,
+        help="batch size, i.e. consecutive frames detected at once before they are tracked",
+    )
     parser.add_argument("-d", "--devices", default=1, type=int, help="device for training")
 
     parser.add_argument("--local_rank", default=0, type=int, help="local rank for dist training")
@@ -59,6 +64,7 @@ def make_parser():
     parser.add_argument("--nms", default=0.7, type=float, help="test nms threshold")
     parser.add_argument("--tsize", default=None, type=int, help="test img size")
     parser.add_argument("--seed", default=None, type=int, help="eval seed")
+    parser.add_argument("--det_cache", default=None, type=str, help="directory of cached detections, read if valid, written otherwise")
 
     # tracking args
     parser.add_argument("--track_thresh", type=float, default=0.6, help="detection confidence threshold")
@@ -102,13 +108,26 @@ def make_parser():
         default="gpu",
         type=str,
         help="device to run our model, can either be cpu or gpu",
+        choices=["gpu", "cpu"],
     )
+    parser.add_argument("--cpu_threads",type=int,default=None,help='intra-op threads on cpu, one per physical core by default')
     # mixformer args
     parser.add_argument("--script",type=str,default='mixformer_deit')
     parser.add_argument("--config",type=str,default='track')
     parser.add_argument("--alpha",type=float,default=0.6,help='fuse parameter')
     parser.add_argument("--radius",type=int,default=0,help='radius for computing similarity')
     parser.add_argument("--mix_iou",type=float,default=0.2,help='threshold for updating template')
+    parser.add_argument("--backend",type=str,default="torch",choices=["torch","onnx","int8"],help='run MixFormer on pytorch, on ONNX Runtime (cpu) or int8 quantized (cpu)')
+    parser.add_argument("--onnx_model",type=str,default="mixformer.onnx",help='joint MixFormer graph from tools/export_mixformer_onnx.py')
+    parser.add_argument("--check_backend",dest="check_backend",default=False,action="store_true",help='check the onnx/int8 MixFormer against pytorch fp32 at startup')
+    parser.add_argument("--vit_gate",dest="vit_gate",default=False,action="store_true",help='only run mixformer for ambiguous track/detection pairs')
+    parser.add_argument("--gate_iou",type=float,default=0.1,help='iou floor for a track/detection pair to be an association candidate')
+    parser.add_argument("--gate_margin",type=float,default=1.0,help='a candidate is ambiguous if a competing one is within this iou margin')
+    # sweep args
+    parser.add_argument("--sweep",type=str,default=None,help='json search space of tracker args, ranks them over the detections of --det_cache instead of evaluating')
+    parser.add_argument("--sweep_samples",type=int,default=0,help='number of random configs drawn from the search space, 0 for the whole grid')
+    parser.add_argument("--sweep_workers",type=int,default=1,help='processes of the sweep, each one holding a MixFormer')
+    parser.add_argument("--sweep_metric",type=str,default="idf1",choices=["idf1","mota"],help='metric ranking the configs of the sweep')
 
     return parser
 
@@ -141,6 +160,9 @@ def main(exp, args, num_gpu):
 
     # set environment variables for distributed training
     cudnn.benchmark = True
+    if args.device == "cpu":
+        configure_cpu(args.cpu_threads)
+    device = get_device(args)
 
     rank = args.local_rank
     # rank = get_local_rank()
@@ -175,10 +197,12 @@ def main(exp, args, num_gpu):
         confthre=exp.test_conf,
         nmsthre=exp.nmsthre,
         num_classes=exp.num_classes,
+        detection_cache=build_detection_cache(args, exp, file_name),
         )
 
-    torch.cuda.set_device(rank)
-    model.cuda(rank)
+    if device.type == "cuda":
+        torch.cuda.set_device(rank)
+    model.to(device)
     model.eval()
 
     if not args.speed and not args.trt:
@@ -187,8 +211,7 @@ def main(exp, args, num_gpu):
         else:
             ckpt_file = args.ckpt
         logger.info("loading checkpoint")
-        loc = "cuda:{}".format(rank)
-        ckpt = torch.load(ckpt_file, map_location=loc)
+        ckpt = torch.load(ckpt_file, map_location=device)
         # load the model state dict
         model.load_state_dict(ckpt["model"])
         # torch.jit.load()
@@ -224,6 +247,38 @@ def main(exp, args, num_gpu):
     logger.info('Completed')
 
 
+def sweep(exp, args):
+    """rank the tracker args of a search space over the cached detections, see `run_sweep`"""
+    file_name = os.path.join(exp.output_dir, args.experiment_name)
+    os.makedirs(file_name, exist_ok=True)
+    setup_logger(file_name, filename="sweep_log.txt", mode="a")
+    logger.info("Args: {}".format(args))
+
+    if args.conf is not None:
+        exp.test_conf = args.conf
+    if args.nms is not None:
+        exp.nmsthre = args.nms
+    if args.tsize is not None:
+        exp.test_size = (args.tsize, args.tsize)
+    assert args.det_cache is not None, "a sweep replays the detections of --det_cache"
+    cache = build_detection_cache(args, exp, file_name)
+    # images & ground truth of the videos
+    dataset = exp.get_eval_loader(1, False, args.test, return_origin_img=True).dataset
+    data_root = os.path.join(dataset.data_dir, dataset.name)
+
+    with open(args.sweep) as f:
+        space = json.load(f)
+    if args.sweep_samples > 0:
+        configs = random_configs(space, args.sweep_samples, args.seed or 0)
+    else:
+        configs = grid_configs(space)
+    run_sweep(
+        args, "mixsort_oc", configs, cache, data_root, os.path.join(file_name, "sweep"),
+        metric=args.sweep_metric, workers=args.sweep_workers,
+    )
+    logger.info('Completed')
+
+
 if __name__ == "__main__":
     args = make_parser().parse_args()
     exp = get_exp(args.exp_file, args.name)
@@ -232,8 +287,18 @@ if __name__ == "__main__":
     if not args.experiment_name:
         args.experiment_name = exp.exp_name
 
-    num_gpu = torch.cuda.device_count() if args.devices is None else args.devices
-    assert num_gpu <= torch.cuda.device_count()
+    if args.sweep is not None:
+        # tracking only, in worker processes of its own
+        sweep(exp, args)
+        sys.exit(0)
+
+    if args.device == "cpu":
+        assert not args.fp16 and not args.trt, "fp16 and TensorRT are only supported on gpu"
+        # a single process, all cores are used by intra-op threads
+        num_gpu = 1
+    else:
+        num_gpu = torch.cuda.device_count() if args.devices is None else args.devices
+        assert num_gpu <= torch.cuda.device_count()
 
     launch(
         main,
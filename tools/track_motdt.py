@@ -7,7 +7,7 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from yolox.core import launch
 from yolox.exp import get_exp
 from yolox.utils import configure_nccl, fuse_model, get_local_rank, get_model_info, setup_logger
-from yolox.evaluators import MOTEvaluator
+from yolox.evaluators import MOTEvaluator, build_detection_cache
 
 import argparse
 import os
@@ -34,7 +34,10 @@ def make_parser():
         type=str,
         help="url used to set up distributed training",
     )
-    parser.add_argument("-b", "--batch-size", type=int, default=64, help="batch size")
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=1,
+        help="batch size, must be 1, the tracker takes one frame at a time",
+    )
     parser.add_argument(
         "-d", "--devices", default=None, type=int, help="device for training"
     )
@@ -101,6 +104,7 @@ def make_parser():
     parser.add_argument("--nms", default=0.7, type=float, help="test nms threshold")
     parser.add_argument("--tsize", default=None, type=int, help="test img size")
     parser.add_argument("--seed", default=None, type=int, help="eval seed")
+    parser.add_argument("--det_cache", default=None, type=str, help="directory of cached detections, read if valid, written otherwise")
     # tracking args
     parser.add_argument("--track_thresh", type=float, default=0.6, help="tracking confidence threshold")
     parser.add_argument("--track_buffer", type=int, default=30, help="the frames for keep lost tracks")
@@ -168,6 +172,7 @@ def main(exp, args, num_gpu):
 
     #evaluator = exp.get_evaluator(args.batch_size, is_distributed, args.test)
 
+    assert args.batch_size == 1, "the tracker takes one frame at a time, -b must be 1"
     val_loader = exp.get_eval_loader(args.batch_size, is_distributed, args.test)
     evaluator = MOTEvaluator(
         args=args,
@@ -176,6 +181,7 @@ def main(exp, args, num_gpu):
         confthre=exp.test_conf,
         nmsthre=exp.nmsthre,
         num_classes=exp.num_classes,
+        detection_cache=build_detection_cache(args, exp, file_name),
         )
 
     torch.cuda.set_device(rank)
@@ -6,4 +6,4 @@ from .data_augment import TrainTransform, ValTransform
 from .data_prefetcher import DataPrefetcher
 from .dataloading import DataLoader, get_yolox_datadir
 from .datasets import *
-from .samplers import InfiniteSampler, YoloBatchSampler
+from .samplers import InfiniteSampler, VideoBatchSampler, VideoSampler, YoloBatchSampler
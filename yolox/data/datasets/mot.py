@@ -90,6 +90,10 @@ class MOTDataset(Dataset):
 
         return (res, img_info, file_name)
 
+    def video_ids(self):
+        """video of every sample, e.g. for `VideoSampler`"""
+        return [img_info[3] for _, img_info, _ in self.annotations]
+
     def load_anno(self, index):
         return self.annotations[index][0]
 
@@ -93,3 +93,98 @@ class InfiniteSampler(Sampler):
 
     def __len__(self):
         return self._size // self._world_size
+
+
+class VideoSampler(Sampler):
+    """
+    Evaluation sampler of video datasets over several processes, which keeps videos whole.
+    Trackers need all the frames of a video in order, while `DistributedSampler` interleaves
+    the frames over the ranks. Here every video goes to a single rank: the videos are taken
+    largest first, each one by the rank with the fewest frames so far, and every rank goes
+    through its videos and their frames in dataset order. The ranks get different numbers of
+    frames, nothing is padded.
+    """
+
+    def __init__(self, video_ids, rank=0, world_size=1):
+        """
+        Args:
+            video_ids (list): video of every sample of the dataset
+            rank (int): taken from torch.distributed when initialized
+            world_size (int): taken from torch.distributed when initialized
+        """
+        if dist.is_available() and dist.is_initialized():
+            self._rank = dist.get_rank()
+            self._world_size = dist.get_world_size()
+        else:
+            self._rank = rank
+            self._world_size = world_size
+
+        # video -> its samples, in dataset order
+        videos = {}
+        for index, video in enumerate(video_ids):
+            videos.setdefault(video, []).append(index)
+        # number of frames of every rank
+        self.loads = [0] * self._world_size
+        owner = {}
+        for video in sorted(videos, key=lambda v: len(videos[v]), reverse=True):
+            rank = min(range(self._world_size), key=lambda r: self.loads[r])
+            owner[video] = rank
+            self.loads[rank] += len(videos[video])
+        self.videos = [video for video in videos if owner[video] == self._rank]
+        self.indices = [index for video in self.videos for index in videos[video]]
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class VideoBatchSampler(Sampler):
+    """
+    Evaluation batch sampler which runs several videos in lock-step: batch t holds the next
+    frame of every video on one of `num_streams` streams, so the detector sees a full batch
+    while every video is still tracked frame by frame. A stream takes the next video once its
+    own one ends, and the last batches are smaller when no video is left to start.
+
+    `schedule` has, for every batch, the (stream, sample, last frame of its video) of each
+    of its samples, in batch order.
+    """
+
+    def __init__(self, video_ids, num_streams, indices=None):
+        """
+        Args:
+            video_ids (list): video of every sample of the dataset
+            num_streams (int): max number of videos per batch
+            indices (iterable): samples to go through, in order, e.g. the ones of the
+                `VideoSampler` of a rank. All the samples of the dataset if None.
+        """
+        if indices is None:
+            indices = range(len(video_ids))
+        # video -> its samples, in order
+        videos = {}
+        for index in indices:
+            videos.setdefault(video_ids[index], []).append(index)
+        queue = list(videos.values())[::-1]
+        # samples left of the video of every stream
+        streams = [[] for _ in range(num_streams)]
+        self.schedule = []
+        while True:
+            batch = []
+            for stream in range(num_streams):
+                if len(streams[stream]) == 0:
+                    if len(queue) == 0:
+                        continue
+                    streams[stream] = queue.pop()[::-1]
+                index = streams[stream].pop()
+                batch.append((stream, index, len(streams[stream]) == 0))
+            if len(batch) == 0:
+                break
+            self.schedule.append(batch)
+
+    def __iter__(self):
+        for batch in self.schedule:
+            yield [index for _, index, _ in batch]
+
+    def __len__(self):
+        return len(self.schedule)
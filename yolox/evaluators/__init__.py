@@ -3,4 +3,5 @@
 # Copyright (c) Megvii, Inc. and its affiliates.
 
 from .coco_evaluator import COCOEvaluator
+from .detection_cache import DetectionCache, build_detection_cache
 from .mot_evaluator import MOTEvaluator
@@ -83,7 +83,8 @@ class COCOEvaluator:
 
         inference_time = 0
         nms_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(self.dataloader) - 1, 0)
 
         if trt_file is not None:
             from torch2trt import TRTModule
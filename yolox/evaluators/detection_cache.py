@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import torch
+from loguru import logger
+
+
+class DetectionCache(object):
+    """Detector outputs of every frame, stored on disk per video to replay tracker runs.
+
+    Tracking only depends on the `postprocess` outputs of the detector, so runs which only
+    change tracker arguments read them back instead of running YOLOX again. Entries are keyed
+    by the experiment, the checkpoint (path, size & modification time), test size, confidence
+    & NMS thresholds and precision, with one directory per key under `root` and one entry per
+    video in it:
+
+    - `dets.npy`, float32 (D, 7), the rows of all the frames one after the other, as given by
+      `postprocess`: x1, y1, x2, y2 in the test image scale, obj_conf, class_conf, class_pred,
+    - `offsets.npy`, int64 (F + 1,), frame i holds the rows offsets[i]:offsets[i + 1],
+    - `frames.json`, the frame id & image file of every frame.
+
+    The arrays are memory-mapped when read. A video is written after all its frames went
+    through the detector, to a temporary directory renamed in place, so an entry is either
+    complete or missing. Frames not in the entry of their video, e.g. of another split, are
+    detected again.
+    """
+
+    # columns of the `postprocess` outputs
+    num_columns = 7
+
+    def __init__(self, root, exp_name, ckpt, test_size, confthre, nmsthre, half=False):
+        """
+        :param root: directory of the cache, shared by all keys
+        :param exp_name: name of the experiment, i.e. the dataset & the detector
+        :param ckpt: path of the detector checkpoint, None for a model without weights
+        :param test_size: (h, w) of the detector input
+        :param confthre: confidence threshold of `postprocess`
+        :param nmsthre: NMS IoU threshold of `postprocess`
+        :param half: whether the detector runs in fp16
+        """
+        key = {
+            "exp": exp_name,
+            "ckpt": None,
+            "test_size": list(test_size),
+            "conf": confthre,
+            "nms": nmsthre,
+            "half": bool(half),
+        }
+        if ckpt is not None:
+            stat = os.stat(ckpt)
+            key["ckpt"] = [os.path.abspath(ckpt), stat.st_size, int(stat.st_mtime)]
+        self.key = key
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        self.dir = os.path.join(root, "{}-{}".format(exp_name, digest))
+        os.makedirs(self.dir, exist_ok=True)
+        key_file = os.path.join(self.dir, "key.json")
+        if not os.path.exists(key_file):
+            with open(key_file, "w") as f:
+                json.dump(key, f, indent=2)
+
+        # video -> (dets, offsets, {frame id: (index, file)}), None for videos not cached
+        self.entries = {}
+        # video -> [(frame id, file, dets)] of the videos being detected, in order
+        self.recordings = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def video_of(file_name):
+        return file_name.split("/")[0]
+
+    def entry(self, video):
+        """
+        Open the entry of `video`.
+        :rtype (dets np.memmap (D, 7), offsets np.ndarray (F + 1,), frames dict) | None
+        """
+        if video not in self.entries:
+            path = os.path.join(self.dir, video)
+            entry = None
+            if os.path.isdir(path):
+                dets = np.load(os.path.join(path, "dets.npy"), mmap_mode="r")
+                offsets = np.load(os.path.join(path, "offsets.npy"))
+                with open(os.path.join(path, "frames.json")) as f:
+                    meta = json.load(f)
+                frames = {
+                    frame_id: (i, file_name)
+                    for i, (frame_id, file_name) in enumerate(zip(meta["frame_ids"], meta["files"]))
+                }
+                entry = (dets, offsets, frames)
+            self.entries[video] = entry
+        return self.entries[video]
+
+    def videos(self):
+        """
+        :rtype list[str], the cached videos, sorted
+        """
+        return sorted(
+            name for name in os.listdir(self.dir)
+            if not name.startswith(".") and os.path.isdir(os.path.join(self.dir, name))
+        )
+
+    def frames(self, video):
+        """
+        Replay the cached frames of `video`, in the order they were detected.
+        :rtype iterator of (frame id, image file, dets np.ndarray (n, 7))
+        """
+        dets, offsets, frames = self.entry(video)
+        for frame_id, (i, file_name) in sorted(frames.items(), key=lambda item: item[1][0]):
+            yield frame_id, file_name, np.array(dets[offsets[i]:offsets[i + 1]])
+
+    def get(self, info_imgs, device=None, dtype=None):
+        """
+        Cached detector outputs of a batch.
+        :param info_imgs: from the data loader, heights, widths, frame ids, video ids & image files
+        :param device: device of the returned tensors
+        :param dtype: dtype of the returned tensors, the one of the detector outputs
+
+        :rtype list[torch.Tensor | None] like `postprocess`, None unless all the frames of the
+            batch are cached
+        """
+        outputs = []
+        for frame_id, file_name in zip(info_imgs[2].tolist(), info_imgs[4]):
+            video = self.video_of(file_name)
+            entry = None if video in self.recordings else self.entry(video)
+            frame = None if entry is None else entry[2].get(frame_id)
+            if frame is None or frame[1] != file_name:
+                self.misses += len(info_imgs[4])
+                return None
+            dets, offsets, _ = entry
+            begin, end = offsets[frame[0]], offsets[frame[0] + 1]
+            if begin == end:
+                # no detection left, like `postprocess`
+                outputs.append(None)
+            else:
+                outputs.append(torch.from_numpy(np.array(dets[begin:end])).to(device, dtype))
+        self.hits += len(outputs)
+        return outputs
+
+    def put(self, info_imgs, outputs, interleaved=False):
+        """
+        Add the detector outputs of a batch missed by `get`. The frames of videos without an
+        entry are kept until a frame of another video comes in, or `close`.
+        :param outputs: list[torch.Tensor | None] from `postprocess`
+        :param interleaved: whether the frames of several videos come mixed, their videos
+            are then only written by `finish` or `close`
+        """
+        for frame_id, file_name, output in zip(info_imgs[2].tolist(), info_imgs[4], outputs):
+            video = self.video_of(file_name)
+            if video not in self.recordings:
+                if not interleaved:
+                    # frames come in order, the other videos are done
+                    self.finish()
+                if self.entry(video) is not None:
+                    continue
+                self.recordings[video] = []
+            if output is None:
+                dets = np.zeros((0, self.num_columns), dtype=np.float32)
+            else:
+                # a copy, the trackers scale the outputs in place
+                dets = np.array(output.float().cpu().numpy(), dtype=np.float32)
+            self.recordings[video].append((frame_id, file_name, dets))
+
+    def finish(self, videos=None):
+        """
+        Write the videos being detected.
+        :param videos: list[str] of the videos which are done, all of them if None
+        """
+        if videos is None:
+            videos = list(self.recordings)
+        for video in videos:
+            frames = self.recordings.pop(video, None)
+            if frames is not None:
+                self.write(video, frames)
+
+    def write(self, video, frames):
+        frame_ids, files, dets = zip(*frames)
+        offsets = np.zeros(len(dets) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(d) for d in dets])
+        tmp = tempfile.mkdtemp(prefix=".{}-".format(video), dir=self.dir)
+        np.save(os.path.join(tmp, "dets.npy"), np.concatenate(dets).reshape(-1, self.num_columns))
+        np.save(os.path.join(tmp, "offsets.npy"), offsets)
+        with open(os.path.join(tmp, "frames.json"), "w") as f:
+            json.dump({"frame_ids": list(frame_ids), "files": list(files)}, f)
+        try:
+            os.rename(tmp, os.path.join(self.dir, video))
+        except OSError:
+            # written by another process in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        # read back from the disk if the video comes again
+        self.entries.pop(video, None)
+        logger.info("cached the detections of {} ({} frames)".format(video, len(frames)))
+
+    def close(self):
+        """Write the last video, at the end of an evaluation."""
+        self.finish()
+        logger.info(
+            "detection cache {}: {} frames read, {} detected".format(
+                self.dir, self.hits, self.misses
+            )
+        )
+
+
+def build_detection_cache(args, exp, file_name):
+    """
+    The detection cache of the `tools/track_*.py` entry points, under `args.det_cache`.
+    :param file_name: output directory of the experiment, holding the default checkpoint
+        & the TensorRT engine
+    :rtype DetectionCache | None without `args.det_cache`
+    """
+    if getattr(args, "det_cache", None) is None:
+        return None
+    # the detector weights are part of the key, a TensorRT engine replaces them
+    if args.trt:
+        weights = os.path.join(file_name, "model_trt.pth")
+    elif args.speed:
+        weights = None
+    elif args.ckpt is None:
+        weights = os.path.join(file_name, "best_ckpt.pth.tar")
+    else:
+        weights = args.ckpt
+    return DetectionCache(
+        args.det_cache, exp.exp_name, weights, exp.test_size, exp.test_conf, exp.nmsthre, args.fp16
+    )
@@ -3,11 +3,14 @@ from loguru import logger
 from tqdm import tqdm
 
 import torch
+from torch.utils.data.dataloader import default_collate
 
 from yolox.utils import (
     gather,
+    get_device,
     is_main_process,
     postprocess,
+    stream_synchronized,
     synchronize,
     time_synchronized,
     xyxy2xywh
@@ -16,8 +19,10 @@ from yolox.utils import (
 from yolox.sort_tracker.sort import Sort
 from yolox.deepsort_tracker.deepsort import DeepSort
 from yolox.motdt_tracker.motdt_tracker import OnlineTracker
+from yolox.evaluators.pipeline import BackgroundWriter, run_ahead
 
 import contextlib
+import copy
 import io
 import os
 import itertools
@@ -52,6 +57,37 @@ def write_results_no_score(filename, results):
     logger.info('save results to {}'.format(filename))
 
 
+def collate_origin_imgs(batch):
+    """
+    default collate, except for the original images which stay a list, videos may differ in size
+    """
+    origin_imgs = [sample[0] for sample in batch]
+    return (origin_imgs, *default_collate([sample[1:] for sample in batch]))
+
+
+# like ByteTrack, MixSort uses different settings for different videos
+MIXSORT_SETTINGS = {
+    'MOT17-01-FRCNN': {'track_buffer': 27, 'track_thresh': 0.6275},
+    'MOT17-03-FRCNN': {'track_buffer': 31, 'track_thresh': 0.5722},
+    'MOT17-06-FRCNN': {'track_buffer': 16, 'track_thresh': 0.5446},
+    'MOT17-07-FRCNN': {'track_buffer': 24, 'track_thresh': 0.5939},
+    'MOT17-08-FRCNN': {'track_buffer': 24, 'track_thresh': 0.7449},
+    'MOT17-12-FRCNN': {'track_buffer': 29, 'track_thresh': 0.7036},
+    'MOT17-14-FRCNN': {'track_buffer': 28, 'track_thresh': 0.5436},
+}
+
+
+def set_mixsort_args(args, video):
+    """set the MixSort arguments of `video` in place and return them"""
+    for k, v in MIXSORT_SETTINGS.get(video, {}).items():
+        setattr(args, k, v)
+    if 'MOT17' in video:
+        args.alpha = 0.8778
+        args.iou_thresh = 0.2217
+        args.match_thresh = 0.7986
+    return args
+
+
 class MOTEvaluator:
     """
     COCO AP Evaluation class.  All the data in the val2017 dataset are processed
@@ -59,7 +95,7 @@ class MOTEvaluator:
     """
 
     def __init__(
-        self, args, dataloader, img_size, confthre, nmsthre, num_classes):
+        self, args, dataloader, img_size, confthre, nmsthre, num_classes, detection_cache=None):
         """
         Args:
             dataloader (Dataloader): evaluate dataloader.
@@ -68,6 +104,9 @@ class MOTEvaluator:
             confthre (float): confidence threshold ranging from 0 to 1, which
                 is defined in the config file.
             nmsthre (float): IoU threshold of non-max supression ranging from 0 to 1.
+            detection_cache (DetectionCache, optional): detector outputs stored by earlier
+                runs with the same detector settings, read instead of running the detector
+                and filled with the frames it misses. Defaults to None.
         """
         self.dataloader = dataloader
         self.img_size = img_size
@@ -75,6 +114,66 @@ class MOTEvaluator:
         self.nmsthre = nmsthre
         self.num_classes = num_classes
         self.args = args
+        self.detection_cache = detection_cache
+
+    def run_detector(self, model, imgs, info_imgs, decoder=None, interleaved=False):
+        """
+        `postprocess`ed detector outputs of a batch, read from the detection cache if it holds
+        all its frames, else computed and added to the cache. With `interleaved` batches of
+        several videos, the caller finishes the cached videos.
+        """
+        if self.detection_cache is not None:
+            outputs = self.detection_cache.get(info_imgs, imgs.device, imgs.dtype)
+            if outputs is not None:
+                return outputs
+        outputs = model(imgs)
+        if decoder is not None:
+            outputs = decoder(outputs, dtype=outputs.type())
+
+        outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
+        if self.detection_cache is not None:
+            self.detection_cache.put(info_imgs, outputs, interleaved)
+        return outputs
+
+    def filter_targets(self, online_targets):
+        """
+        Boxes, ids & scores of the MixSort targets to save, neither tiny nor lying.
+        :rtype online_tlwhs list, online_ids list, online_scores list
+        """
+        online_tlwhs = []
+        online_ids = []
+        online_scores = []
+        for t in online_targets:
+            tlwh = t.tlwh
+            tid = t.track_id
+            vertical = tlwh[2] / tlwh[3] > 1.6
+            if tlwh[2] * tlwh[3] > self.args.min_box_area and not vertical:
+                online_tlwhs.append(tlwh)
+                online_ids.append(tid)
+                online_scores.append(t.score)
+        return online_tlwhs, online_ids, online_scores
+
+    def filter_oc_targets(self, online_targets):
+        """
+        Boxes & ids of the OC MixSort targets to save, given as (x1, y1, x2, y2, id) rows.
+        :rtype online_tlwhs list, online_ids list
+        """
+        online_tlwhs = []
+        online_ids = []
+        for t in online_targets:
+            tlwh = [t[0], t[1], t[2] - t[0], t[3] - t[1]]
+            tid = t[4]
+            vertical = tlwh[2] / tlwh[3] > 1.6
+            if tlwh[2] * tlwh[3] > self.args.min_box_area and not vertical:
+                online_tlwhs.append(tlwh)
+                online_ids.append(tid)
+        return online_tlwhs, online_ids
+
+    def finish_video(self, result_folder, video, results):
+        """Write the results of a video and drop its frames from the detection cache."""
+        write_results(os.path.join(result_folder, '{}.txt'.format(video)), results)
+        if self.detection_cache is not None:
+            self.detection_cache.finish([video])
 
     def evaluate_byte(
         self,
@@ -113,11 +212,14 @@ class MOTEvaluator:
         data_list = []
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(self.dataloader) - 1, 0) * self.dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -137,7 +239,7 @@ class MOTEvaluator:
             with torch.no_grad():
                 # init tracker
                 frame_id = info_imgs[2].item()
-                video_id = info_imgs[3].item()
+                prev_video_id, video_id = video_id, info_imgs[3].item()
                 img_file_name = info_imgs[4]
                 video_name = img_file_name[0].split('/')[0]
                 if video_name == 'MOT17-05-FRCNN' or video_name == 'MOT17-06-FRCNN':
@@ -165,7 +267,9 @@ class MOTEvaluator:
                 if frame_id == 1:
                     tracker = BYTETracker(self.args)
                     if len(results) != 0:
-                        result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id - 1]))
+                        result_filename = os.path.join(
+                            result_folder, '{}.txt'.format(video_names[prev_video_id])
+                        )
                         write_results(result_filename, results)
                         results = []
 
@@ -176,11 +280,7 @@ class MOTEvaluator:
                 if is_time_record:
                     start = time.time()
 
-                outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
-
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
             
                 if is_time_record:
                     infer_end = time_synchronized()
@@ -214,6 +314,8 @@ class MOTEvaluator:
                 result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
                 write_results(result_filename, results)
 
+        if self.detection_cache is not None:
+            self.detection_cache.close()
         statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
         if distributed:
             data_list = gather(data_list, dst=0)
@@ -240,6 +342,10 @@ class MOTEvaluator:
 
         NOTE: This function will change training mode to False, please save states if needed.
 
+        A batch of the data loader holds consecutive frames: the detector runs on all of them
+        at once, then they are tracked one at a time, so the batch size is the look-ahead of
+        the detector and bounds the frames held in memory. The last batch may be smaller.
+
         Args:
             model : model to evaluate.
 
@@ -253,47 +359,9 @@ class MOTEvaluator:
         else:
             from yolox.mixsort_tracker.mixsort_tracker import MIXTracker
 
-        # like ByteTrack, we use different setting for different videos
-        setting = {
-                    'MOT17-01-FRCNN':{
-                        'track_buffer':27,
-                        'track_thresh':0.6275
-                    },
-                    'MOT17-03-FRCNN':{
-                        'track_buffer':31,
-                        'track_thresh':0.5722
-                    },
-                    'MOT17-06-FRCNN':{
-                        'track_buffer':16,
-                        'track_thresh':0.5446
-                    },
-                    'MOT17-07-FRCNN':{
-                        'track_buffer':24,
-                        'track_thresh':0.5939
-                    },
-                    'MOT17-08-FRCNN':{
-                        'track_buffer':24,
-                        'track_thresh':0.7449
-                    },
-                    'MOT17-12-FRCNN':{
-                        'track_buffer':29,
-                        'track_thresh':0.7036
-                    },
-                    'MOT17-14-FRCNN':{
-                        'track_buffer':28,
-                        'track_thresh':0.5436
-                    },
-                }
-        
-        def set_args(args, video):
-            if video not in setting.keys():
-                return args
-            for k,v in setting[video].items():
-                args.__setattr__(k,v)
-            return args
-        
         # TODO half to amp_test
-        tensor_type = torch.cuda.HalfTensor if half else torch.cuda.FloatTensor
+        device = get_device(self.args)
+        dtype = torch.float16 if half else torch.float32
         model = model.eval()
         if half:
             model = model.half()
@@ -301,11 +369,24 @@ class MOTEvaluator:
         data_list = []
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
+        # batches of consecutive frames, of videos which may differ in size
+        dataloader = torch.utils.data.DataLoader(
+            self.dataloader.dataset,
+            batch_size=self.dataloader.batch_size,
+            sampler=self.dataloader.sampler,
+            num_workers=self.dataloader.num_workers,
+            pin_memory=self.dataloader.pin_memory,
+            collate_fn=collate_origin_imgs,
+        )
+
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(dataloader) - 1, 0) * dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -319,44 +400,217 @@ class MOTEvaluator:
             
         tracker = MIXTracker(self.args)
         ori_thresh = self.args.track_thresh
-        for cur_iter, (origin_imgs, imgs, _, info_imgs, ids) in enumerate(
-            progress_bar(self.dataloader)
-        ):
-            with torch.no_grad():
+
+        def synchronized():
+            # in pipeline mode detection & tracking run on their own cuda streams, each one
+            # only waits for its own stream, a device-wide sync would serialize them
+            if self.args.pipeline:
+                return stream_synchronized(device)
+            return time_synchronized()
+
+        def detect(batch):
+            cur_iter, (origin_imgs, imgs, _, info_imgs, ids) = batch
+            # skip the the last iters since batchsize might be not enough for batch inference
+            is_time_record = cur_iter < len(dataloader) - 1
+            infer_time = 0
+            with torch.inference_mode():
+                imgs = imgs.to(device, dtype)
+                if is_time_record:
+                    start = time.time()
+
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
+
+                if is_time_record:
+                    infer_time = synchronized() - start
+            return cur_iter, origin_imgs, info_imgs, ids, outputs, infer_time
+
+        batches = enumerate(progress_bar(dataloader))
+        writer = None
+        if self.args.pipeline:
+            # the detector runs ahead on its own thread & cuda stream, tracking consumes
+            # frames in order and result files are written in the background
+            side_stream = torch.cuda.Stream() if device.type == 'cuda' else None
+
+            def detect_ahead(batch):
+                if side_stream is None:
+                    return detect(batch)
+                with torch.cuda.stream(side_stream):
+                    out = detect(batch)
+                    # outputs are used on the default stream, don't let the allocator reuse them
+                    # early
+                    for output in out[4]:
+                        if output is not None:
+                            output.record_stream(torch.cuda.default_stream(output.device))
+                side_stream.synchronize()
+                return out
+
+            frames = run_ahead(batches, detect_ahead, self.args.pipeline_depth)
+            writer = BackgroundWriter(self.args.pipeline_depth)
+        else:
+            frames = map(detect, batches)
+
+        def save(result_filename, results):
+            if writer is None:
+                write_results(result_filename, results)
+            else:
+                writer.submit(write_results, result_filename, results)
+
+        for cur_iter, origin_imgs, info_imgs, ids, outputs, infer_time in frames:
+            is_time_record = cur_iter < len(dataloader) - 1
+            inference_time += infer_time
+            if is_time_record:
+                track_start = time.time()
+
+            output_results = self.convert_to_coco_format(outputs, info_imgs, ids)
+            data_list.extend(output_results)
+
+            # the detections of a batch of consecutive frames are tracked one frame at a time
+            for i, output in enumerate(outputs):
                 # init tracker
-                frame_id = info_imgs[2].item()
-                video_id = info_imgs[3].item()
-                img_file_name = info_imgs[4]
-                video_name = img_file_name[0].split('/')[0]
-                
+                frame_id = info_imgs[2][i].item()
+                prev_video_id, video_id = video_id, info_imgs[3][i].item()
+                video_name = info_imgs[4][i].split('/')[0]
+
                 if video_name not in video_names:
                     video_names[video_id] = video_name
                 if frame_id == 1:
-                    self.args = set_args(self.args, video_name)
-                    if 'MOT17' in video_name:
-                        self.args.alpha = 0.8778
-                        self.args.iou_thresh = 0.2217
-                        self.args.match_thresh = 0.7986
+                    self.args = set_mixsort_args(self.args, video_name)
                     tracker.re_init(self.args)
                     if len(results) != 0:
-                        result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id - 1]))
-                        write_results(result_filename, results)
+                        result_filename = os.path.join(
+                            result_folder, '{}.txt'.format(video_names[prev_video_id])
+                        )
+                        save(result_filename, results)
                         results = []
 
-                imgs = imgs.type(tensor_type)
+                # run tracking
+                if output is not None:
+                    img_info = (info_imgs[0][i], info_imgs[1][i])
+                    with torch.inference_mode():
+                        online_targets = tracker.update(
+                            output, img_info, self.img_size, origin_imgs[i].to(device)
+                        )
+                    # save results
+                    results.append((frame_id, *self.filter_targets(online_targets)))
 
-                # skip the the last iters since batchsize might be not enough for batch inference
-                is_time_record = cur_iter < len(self.dataloader) - 1
+            if is_time_record:
+                track_end = synchronized()
+                track_time += track_end - track_start
+
+            if cur_iter == len(dataloader) - 1:
+                result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
+                save(result_filename, results)
+
+        if writer is not None:
+            writer.close()
+
+        if not self.args.iou_only and self.args.vit_gate:
+            logger.info(
+                'MixFormer skipped {:.2%} of track/detection pairs'.format(tracker.vit_skip_ratio)
+            )
+        logger.info('tracker memory usage at the end: {}'.format(tracker.memory_usage))
+        logger.info('linear assignment: {}'.format(tracker.assignment.summary()))
+
+        if self.detection_cache is not None:
+            self.detection_cache.close()
+        statistics = torch.tensor(
+            [inference_time, track_time, n_samples], dtype=torch.float32, device=device
+        )
+        if distributed:
+            data_list = gather(data_list, dst=0)
+            data_list = list(itertools.chain(*data_list))
+            torch.distributed.reduce(statistics, dst=0)
+
+        eval_results = self.evaluate_prediction(data_list, statistics)
+        synchronize()
+        return eval_results
+
+    def evaluate_mixsort_streams(
+        self,
+        model,
+        distributed=False,
+        half=False,
+        trt_file=None,
+        decoder=None,
+        test_size=None,
+        result_folder=None,
+        num_streams=4,
+    ):
+        """
+        Same evaluation as `evaluate_mixsort`, with `num_streams` videos in lock-step. Every
+        detector batch holds the next frame of up to `num_streams` videos, see
+        `VideoBatchSampler`, and the outputs are split so that the tracker of every video gets
+        its frames in order. The trackers are the streams of a `MultiStreamEngine`, which also
+        pools their MixFormer search regions. Every video is tracked with a copy of the
+        arguments holding its own settings.
+
+        Args:
+            model : model to evaluate.
+            num_streams (int): number of videos tracked at once, i.e. detector batch size.
+
+        Returns:
+            ap50_95 (float) : COCO AP of IoU=50:95
+            ap50 (float) : COCO AP of IoU=50
+            summary (sr): summary info of evaluation.
+        """
+        from yolox.data import VideoBatchSampler
+        from yolox.mixsort_tracker.multi_stream import MultiStreamEngine
+
+        assert not self.args.iou_only, "streams need the MixFormer tracker"
+        device = get_device(self.args)
+        dtype = torch.float16 if half else torch.float32
+        model = model.eval()
+        if half:
+            model = model.half()
+        data_list = []
+        progress_bar = tqdm if is_main_process() else iter
+
+        # the samples of this rank, regrouped into batches of several videos
+        dataset = self.dataloader.dataset
+        batch_sampler = VideoBatchSampler(
+            dataset.video_ids(), num_streams, indices=self.dataloader.sampler
+        )
+        dataloader = torch.utils.data.DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=self.dataloader.num_workers,
+            pin_memory=self.dataloader.pin_memory,
+            collate_fn=collate_origin_imgs,
+        )
+
+        inference_time = 0
+        track_time = 0
+        n_samples = sum(len(batch) for batch in batch_sampler.schedule[:-1])
+
+        if trt_file is not None:
+            from torch2trt import TRTModule
+
+            model_trt = TRTModule()
+            model_trt.load_state_dict(torch.load(trt_file))
+
+            x = torch.ones(1, 3, test_size[0], test_size[1]).cuda()
+            model(x)
+            model = model_trt
+
+        engine = MultiStreamEngine(self.args, num_streams=num_streams)
+        # video, current frame id & results of every stream
+        videos = [None] * num_streams
+        frame_ids = [0] * num_streams
+        results = [[] for _ in range(num_streams)]
+        # whether the next frame of a stream starts a new video
+        starting = [True] * num_streams
+
+        batches = zip(progress_bar(dataloader), batch_sampler.schedule)
+        for cur_iter, ((origin_imgs, imgs, _, info_imgs, ids), schedule) in enumerate(batches):
+            # skip the the last iters since batchsize might be not enough for batch inference
+            is_time_record = cur_iter < len(dataloader) - 1
+            with torch.inference_mode():
+                imgs = imgs.to(device, dtype)
                 if is_time_record:
                     start = time.time()
 
-                with torch.no_grad():
-                    outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
+                outputs = self.run_detector(model, imgs, info_imgs, decoder, interleaved=True)
 
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
-            
                 if is_time_record:
                     infer_end = time_synchronized()
                     inference_time += infer_end - start
@@ -364,32 +618,51 @@ class MOTEvaluator:
             output_results = self.convert_to_coco_format(outputs, info_imgs, ids)
             data_list.extend(output_results)
 
-            # run tracking
-            if outputs[0] is not None:
-                online_targets = tracker.update(outputs[0], info_imgs, self.img_size, origin_imgs.squeeze(0).cuda())
-                online_tlwhs = []
-                online_ids = []
-                online_scores = []
-                for t in online_targets:
-                    tlwh = t.tlwh
-                    tid = t.track_id
-                    vertical = tlwh[2] / tlwh[3] > 1.6
-                    if tlwh[2] * tlwh[3] > self.args.min_box_area and not vertical:
-                        online_tlwhs.append(tlwh)
-                        online_ids.append(tid)
-                        online_scores.append(t.score)
+            # run tracking, every frame on the stream of its video
+            done = {}
+            with torch.inference_mode():
+                for i, (stream, _, _) in enumerate(schedule):
+                    frame_ids[stream] = info_imgs[2][i].item()
+                    if starting[stream]:
+                        videos[stream] = info_imgs[4][i].split('/')[0]
+                        args = set_mixsort_args(copy.copy(self.args), videos[stream])
+                        done.update(engine.reset_stream(stream, args=args))
+                    if outputs[i] is not None:
+                        img_info = (info_imgs[0][i], info_imgs[1][i])
+                        done.update(engine.update(
+                            stream, outputs[i], img_info, self.img_size, origin_imgs[i].to(device)
+                        ))
+                if len(engine.pending) > 0:
+                    done.update(engine.flush())
+
+            for stream, online_targets in done.items():
                 # save results
-                results.append((frame_id, online_tlwhs, online_ids, online_scores))
+                results[stream].append((frame_ids[stream], *self.filter_targets(online_targets)))
+
+            for stream, _, last in schedule:
+                starting[stream] = last
+                if last:
+                    self.finish_video(result_folder, videos[stream], results[stream])
+                    results[stream] = []
 
             if is_time_record:
                 track_end = time_synchronized()
                 track_time += track_end - infer_end
-            
-            if cur_iter == len(self.dataloader) - 1:
-                result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
-                write_results(result_filename, results)
 
-        statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
+        if self.args.vit_gate:
+            skipped = sum(tracker.vit_skip_ratio for tracker in engine.trackers)
+            skipped /= max(len(engine.trackers), 1)
+            logger.info('MixFormer skipped {:.2%} of track/detection pairs'.format(skipped))
+        for stream, tracker in enumerate(engine.trackers):
+            logger.info(
+                'stream {} tracker memory usage at the end: {}'.format(stream, tracker.memory_usage)
+            )
+
+        if self.detection_cache is not None:
+            self.detection_cache.close()
+        statistics = torch.tensor(
+            [inference_time, track_time, n_samples], dtype=torch.float32, device=device
+        )
         if distributed:
             data_list = gather(data_list, dst=0)
             data_list = list(itertools.chain(*data_list))
@@ -425,7 +698,8 @@ class MOTEvaluator:
         """
         from yolox.mixsort_oc_tracker.mixsort_oc_tracker import MIXTracker
         # TODO half to amp_test
-        tensor_type = torch.cuda.HalfTensor if half else torch.cuda.FloatTensor
+        device = get_device(self.args)
+        dtype = torch.float16 if half else torch.float32
         model = model.eval()
         if half:
             model = model.half()
@@ -434,11 +708,24 @@ class MOTEvaluator:
         seq_data_list = dict()
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
+        # batches of consecutive frames, of videos which may differ in size
+        dataloader = torch.utils.data.DataLoader(
+            self.dataloader.dataset,
+            batch_size=self.dataloader.batch_size,
+            sampler=self.dataloader.sampler,
+            num_workers=self.dataloader.num_workers,
+            pin_memory=self.dataloader.pin_memory,
+            collate_fn=collate_origin_imgs,
+        )
+
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(dataloader) - 1, 0) * dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -453,21 +740,35 @@ class MOTEvaluator:
         tracker = MIXTracker(det_thresh = self.args.track_thresh,args=self.args, iou_threshold=self.args.iou_thresh,
             asso_func=self.args.asso, delta_t=self.args.deltat, inertia=self.args.inertia, use_byte=self.args.use_byte, max_age=self.args.track_buffer)
         for cur_iter, (origin_imgs, imgs, _, info_imgs, ids) in enumerate(
-            progress_bar(self.dataloader)
+            progress_bar(dataloader)
         ):
-            with torch.no_grad():
-                frame_id = info_imgs[2].item()
-                img_file_name = info_imgs[4]
-                video_name = img_file_name[0].split('/')[0]
+            # skip the the last iters since batchsize might be not enough for batch inference
+            is_time_record = cur_iter < len(dataloader) - 1
+            with torch.inference_mode():
+                imgs = imgs.to(device, dtype)
+                if is_time_record:
+                    start = time.time()
+
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
+
+                if is_time_record:
+                    infer_end = time_synchronized()
+                    inference_time += infer_end - start
+
+            # the detections of a batch of consecutive frames are tracked one frame at a time
+            for i, output in enumerate(outputs):
+                frame_id = info_imgs[2][i].item()
+                prev_video_id, video_id = video_id, info_imgs[3][i].item()
+                img_file_name = info_imgs[4][i]
+                video_name = img_file_name.split('/')[0]
                 if frame_id == 1:
                     tracker.re_init()
                     if len(results) != 0:
-                        result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
+                        result_filename = os.path.join(
+                            result_folder, '{}.txt'.format(video_names[prev_video_id])
+                        )
                         write_results_no_score(result_filename, results)
                         results = []
-                # init tracker
-                video_id = info_imgs[3].item()
-                img_name = img_file_name[0].split("/")[2]
                 """
                     Here, you can use adaptive detection threshold as in BYTE
                     (line 268 - 292), which can boost the performance on MOT17/MOT20
@@ -476,55 +777,42 @@ class MOTEvaluator:
                 """
                 if video_name not in video_names:
                     video_names[video_id] = video_name
-                
-                imgs = imgs.type(tensor_type)
-
-                # skip the the last iters since batchsize might be not enough for batch inference
-                is_time_record = cur_iter < len(self.dataloader) - 1
-                if is_time_record:
-                    start = time.time()
-
-                outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
-
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
-            
-                if is_time_record:
-                    infer_end = time_synchronized()
-                    inference_time += infer_end - start
 
-            output_results = self.convert_to_coco_format(outputs, info_imgs, ids)
+                img_info = (info_imgs[0][i:i + 1], info_imgs[1][i:i + 1])
+                output_results = self.convert_to_coco_format([output], img_info, ids[i:i + 1])
 
-            if video_name not in seq_data_list:
-                seq_data_list[video_name] = []
-            seq_data_list[video_name].extend(output_results)
-            data_list.extend(output_results)
+                if video_name not in seq_data_list:
+                    seq_data_list[video_name] = []
+                seq_data_list[video_name].extend(output_results)
+                data_list.extend(output_results)
 
-            # run tracking
-            if outputs[0] is not None:
-                online_targets = tracker.update(outputs[0], info_imgs, self.img_size, origin_imgs.squeeze(0).cuda())
-                online_tlwhs = []
-                online_ids = []
-                for t in online_targets:
-                    tlwh = [t[0], t[1], t[2] - t[0], t[3] - t[1]]
-                    tid = t[4]
-                    vertical = tlwh[2] / tlwh[3] > 1.6
-                    if tlwh[2] * tlwh[3] > self.args.min_box_area and not vertical:
-                        online_tlwhs.append(tlwh)
-                        online_ids.append(tid)
-                # save results
-                results.append((frame_id, online_tlwhs, online_ids))
+                # run tracking
+                if output is not None:
+                    with torch.inference_mode():
+                        online_targets = tracker.update(
+                            output, img_info, self.img_size, origin_imgs[i].to(device)
+                        )
+                    # save results
+                    results.append((frame_id, *self.filter_oc_targets(online_targets)))
 
             if is_time_record:
                 track_end = time_synchronized()
                 track_time += track_end - infer_end
             
-            if cur_iter == len(self.dataloader) - 1:
+            if cur_iter == len(dataloader) - 1:
                 result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
                 write_results_no_score(result_filename, results)
 
-        statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
+        if self.args.vit_gate:
+            logger.info('MixFormer skipped {:.2%} of detection/tracker pairs'.format(
+                tracker.mixformer.vit_skip_ratio
+            ))
+
+        if self.detection_cache is not None:
+            self.detection_cache.close()
+        statistics = torch.tensor(
+            [inference_time, track_time, n_samples], dtype=torch.float32, device=device
+        )
         if distributed:
             data_list = gather(data_list, dst=0)
             data_list = list(itertools.chain(*data_list))
@@ -572,11 +860,14 @@ class MOTEvaluator:
         seq_data_list = dict()
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(self.dataloader) - 1, 0) * self.dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -597,7 +888,7 @@ class MOTEvaluator:
             with torch.no_grad():
                 # init tracker
                 frame_id = info_imgs[2].item()
-                video_id = info_imgs[3].item()
+                prev_video_id, video_id = video_id, info_imgs[3].item()
                 img_file_name = info_imgs[4]
                 video_name = img_file_name[0].split('/')[0]
                 img_name = img_file_name[0].split("/")[2]
@@ -614,7 +905,9 @@ class MOTEvaluator:
                         asso_func=self.args.asso, delta_t=self.args.deltat, inertia=self.args.inertia)
                     if len(results) != 0:
                         try:
-                            result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id - 1]))
+                            result_filename = os.path.join(
+                                result_folder, '{}.txt'.format(video_names[prev_video_id])
+                            )
                         except:
                             import pdb; pdb.set_trace()
                         write_results_no_score(result_filename, results)
@@ -628,11 +921,7 @@ class MOTEvaluator:
                 if is_time_record:
                     start = time.time()
 
-                outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
-
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
             
                 if is_time_record:
                     infer_end = time_synchronized()
@@ -668,6 +957,8 @@ class MOTEvaluator:
                 result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
                 write_results_no_score(result_filename, results)
 
+        if self.detection_cache is not None:
+            self.detection_cache.close()
         statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
         if distributed:
             data_list = gather(data_list, dst=0)
@@ -714,11 +1005,14 @@ class MOTEvaluator:
         data_list = []
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(self.dataloader) - 1, 0) * self.dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -738,7 +1032,7 @@ class MOTEvaluator:
             with torch.no_grad():
                 # init tracker
                 frame_id = info_imgs[2].item()
-                video_id = info_imgs[3].item()
+                prev_video_id, video_id = video_id, info_imgs[3].item()
                 img_file_name = info_imgs[4]
                 video_name = img_file_name[0].split('/')[0]
 
@@ -747,7 +1041,9 @@ class MOTEvaluator:
                 if frame_id == 1:
                     tracker = Sort(self.args.track_thresh)
                     if len(results) != 0:
-                        result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id - 1]))
+                        result_filename = os.path.join(
+                            result_folder, '{}.txt'.format(video_names[prev_video_id])
+                        )
                         write_results_no_score(result_filename, results)
                         results = []
 
@@ -758,11 +1054,7 @@ class MOTEvaluator:
                 if is_time_record:
                     start = time.time()
 
-                outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
-
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
             
                 if is_time_record:
                     infer_end = time_synchronized()
@@ -793,6 +1085,8 @@ class MOTEvaluator:
                 result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
                 write_results_no_score(result_filename, results)
 
+        if self.detection_cache is not None:
+            self.detection_cache.close()
         statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
         if distributed:
             data_list = gather(data_list, dst=0)
@@ -837,11 +1131,14 @@ class MOTEvaluator:
         data_list = []
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(self.dataloader) - 1, 0) * self.dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -861,7 +1158,7 @@ class MOTEvaluator:
             with torch.no_grad():
                 # init tracker
                 frame_id = info_imgs[2].item()
-                video_id = info_imgs[3].item()
+                prev_video_id, video_id = video_id, info_imgs[3].item()
                 img_file_name = info_imgs[4]
                 video_name = img_file_name[0].split('/')[0]
 
@@ -870,7 +1167,9 @@ class MOTEvaluator:
                 if frame_id == 1:
                     tracker = DeepSort(model_folder, min_confidence=self.args.track_thresh)
                     if len(results) != 0:
-                        result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id - 1]))
+                        result_filename = os.path.join(
+                            result_folder, '{}.txt'.format(video_names[prev_video_id])
+                        )
                         write_results_no_score(result_filename, results)
                         results = []
 
@@ -881,11 +1180,7 @@ class MOTEvaluator:
                 if is_time_record:
                     start = time.time()
 
-                outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
-
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
             
                 if is_time_record:
                     infer_end = time_synchronized()
@@ -916,6 +1211,8 @@ class MOTEvaluator:
                 result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
                 write_results_no_score(result_filename, results)
 
+        if self.detection_cache is not None:
+            self.detection_cache.close()
         statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
         if distributed:
             data_list = gather(data_list, dst=0)
@@ -960,11 +1257,14 @@ class MOTEvaluator:
         data_list = []
         results = []
         video_names = defaultdict()
+        # the videos of a rank do not have consecutive ids when sharded
+        video_id = None
         progress_bar = tqdm if is_main_process() else iter
 
         inference_time = 0
         track_time = 0
-        n_samples = len(self.dataloader) - 1
+        # a rank may have no video at all
+        n_samples = max(len(self.dataloader) - 1, 0) * self.dataloader.batch_size
 
         if trt_file is not None:
             from torch2trt import TRTModule
@@ -983,7 +1283,7 @@ class MOTEvaluator:
             with torch.no_grad():
                 # init tracker
                 frame_id = info_imgs[2].item()
-                video_id = info_imgs[3].item()
+                prev_video_id, video_id = video_id, info_imgs[3].item()
                 img_file_name = info_imgs[4]
                 video_name = img_file_name[0].split('/')[0]
 
@@ -992,7 +1292,9 @@ class MOTEvaluator:
                 if frame_id == 1:
                     tracker = OnlineTracker(model_folder, min_cls_score=self.args.track_thresh)
                     if len(results) != 0:
-                        result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id - 1]))
+                        result_filename = os.path.join(
+                            result_folder, '{}.txt'.format(video_names[prev_video_id])
+                        )
                         write_results(result_filename, results)
                         results = []
 
@@ -1003,11 +1305,7 @@ class MOTEvaluator:
                 if is_time_record:
                     start = time.time()
 
-                outputs = model(imgs)
-                if decoder is not None:
-                    outputs = decoder(outputs, dtype=outputs.type())
-
-                outputs = postprocess(outputs, self.num_classes, self.confthre, self.nmsthre)
+                outputs = self.run_detector(model, imgs, info_imgs, decoder)
             
                 if is_time_record:
                     infer_end = time_synchronized()
@@ -1040,6 +1338,8 @@ class MOTEvaluator:
                 result_filename = os.path.join(result_folder, '{}.txt'.format(video_names[video_id]))
                 write_results(result_filename, results)
 
+        if self.detection_cache is not None:
+            self.detection_cache.close()
         statistics = torch.cuda.FloatTensor([inference_time, track_time, n_samples])
         if distributed:
             data_list = gather(data_list, dst=0)
@@ -1065,7 +1365,8 @@ class MOTEvaluator:
             scale = min(
                 self.img_size[0] / float(img_h), self.img_size[1] / float(img_w)
             )
-            bboxes /= scale
+            # not in place, .cpu() does not copy tensors which are on cpu already
+            bboxes = bboxes / scale
             bboxes = xyxy2xywh(bboxes)
 
             cls = output[:, 6]
@@ -1092,10 +1393,11 @@ class MOTEvaluator:
 
         inference_time = statistics[0].item()
         track_time = statistics[1].item()
-        n_samples = statistics[2].item()
+        # timed frames, none when every batch was the last one of its rank
+        n_samples = max(statistics[2].item(), 1)
 
-        a_infer_time = 1000 * inference_time / (n_samples * self.dataloader.batch_size)
-        a_track_time = 1000 * track_time / (n_samples * self.dataloader.batch_size)
+        a_infer_time = 1000 * inference_time / n_samples
+        a_track_time = 1000 * track_time / n_samples
 
         time_info = ", ".join(
             [
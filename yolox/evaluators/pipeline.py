@@ -0,0 +1,86 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+def run_ahead(iterable, fn, depth=4):
+    """
+    Yield `fn(item)` for every item of `iterable` in order, while `fn` runs on a background
+    thread at most `depth` items ahead of the consumer. Errors of the background thread are
+    raised in the consumer.
+    :param iterable: inputs, consumed by the background thread only
+    :param fn: stage to run ahead, e.g. the detector
+    :param depth: size of the queue between the stage and the consumer
+    """
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                results.put((fn(item), None))
+        except BaseException as e:
+            results.put((None, e))
+            return
+        results.put(_DONE)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            out = results.get()
+            if out is _DONE:
+                break
+            result, error = out
+            if error is not None:
+                raise error
+            yield result
+    finally:
+        # let a worker blocked on a full queue exit
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class BackgroundWriter(object):
+    """Run calls, e.g. writing result files, in submission order on a background thread."""
+
+    def __init__(self, depth=4):
+        """
+        :param depth: max number of calls waiting to be run
+        """
+        self.calls = queue.Queue(maxsize=depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            call = self.calls.get()
+            if call is _DONE:
+                return
+            fn, args = call
+            if self.error is None:
+                try:
+                    fn(*args)
+                except BaseException as e:
+                    self.error = e
+
+    def submit(self, fn, *args):
+        """queue `fn(*args)`, the arguments must not be modified afterwards"""
+        if self.error is not None:
+            raise self.error
+        self.calls.put((fn, args))
+
+    def close(self):
+        """wait for all queued calls and raise the first error"""
+        self.calls.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
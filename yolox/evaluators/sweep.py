@@ -0,0 +1,340 @@
+import copy
+import hashlib
+import itertools
+import json
+import os
+import random
+import time
+
+import cv2
+import motmetrics as mm
+import numpy as np
+import torch
+from loguru import logger
+
+from yolox.utils import configure_cpu, get_device
+from .evaluation import Evaluator
+from .mot_evaluator import set_mixsort_args
+
+# metric counts of every (config, video) cell, summed over the videos of a config
+COUNTS = (
+    "num_frames", "num_objects", "num_false_positives", "num_misses", "num_switches",
+    "idtp", "idfp", "idfn",
+)
+# metrics a sweep can be ranked by
+RANK_METRICS = ("idf1", "mota")
+
+
+def grid_configs(space):
+    """
+    All the combinations of a grid search space.
+    :param space: dict, argument name -> list of values
+
+    :rtype list[dict]
+    """
+    names = sorted(space)
+    grid = itertools.product(*(space[name] for name in names))
+    return [dict(zip(names, values)) for values in grid]
+
+
+def random_configs(space, samples, seed=0):
+    """
+    Random configs of a search space. An argument is drawn from its list of values, or from
+    {"uniform": [low, high]} or {"randint": [low, high]}, high included.
+    :param samples: number of configs, fewer if a discrete space runs out of them
+
+    :rtype list[dict], without duplicates
+    """
+    rng = random.Random(seed)
+    names = sorted(space)
+    configs = {}
+    for _ in range(100 * samples):
+        if len(configs) == samples:
+            break
+        config = {}
+        for name in names:
+            values = space[name]
+            if isinstance(values, dict) and "uniform" in values:
+                config[name] = round(rng.uniform(*values["uniform"]), 4)
+            elif isinstance(values, dict) and "randint" in values:
+                config[name] = rng.randint(*values["randint"])
+            else:
+                config[name] = rng.choice(values)
+        configs.setdefault(config_id(config), config)
+    return list(configs.values())
+
+
+def config_id(config):
+    """short stable id of a config"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def overall_metrics(counts):
+    """
+    :param counts: dict, summed `COUNTS` of a config
+    :rtype dict, idf1 & mota over all the videos
+    """
+    num_objects = max(counts["num_objects"], 1)
+    errors = counts["num_misses"] + counts["num_false_positives"] + counts["num_switches"]
+    idtp = counts["idtp"]
+    return {
+        "idf1": 2 * idtp / max(2 * idtp + counts["idfp"] + counts["idfn"], 1),
+        "mota": 1 - errors / num_objects,
+    }
+
+
+class SweepTable(object):
+    """Finished (config, video) cells of a sweep, appended to a JSON lines file as they come.
+
+    Every line is one cell: config id & values, video, metric counts and run time. A sweep
+    started again with the same file skips the cells already in it. A line cut by a crash is
+    ignored, so its cell runs again.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: JSON lines file, created if missing
+        """
+        self.path = path
+        # (config id, video) -> record
+        self.cells = {}
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            text = f.read()
+        for line in text.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self.cells[(record["id"], record["video"])] = record
+        if len(text) > 0 and not text.endswith("\n"):
+            # the next record starts on a line of its own
+            with open(path, "a") as f:
+                f.write("\n")
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, cell):
+        return cell in self.cells
+
+    def add(self, record):
+        """
+        Append a finished cell, on disk before it is counted as done.
+        :type record: dict
+        """
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.cells[(record["id"], record["video"])] = record
+
+    def ranking(self, metric, videos):
+        """
+        Metrics of every config over `videos`.
+        :param metric: one of `RANK_METRICS`
+        :param videos: list[str], videos of the sweep
+
+        :rtype list[dict], one row per config, the configs done on all the videos first, best first
+        """
+        videos = set(videos)
+        rows = {}
+        for record in self.cells.values():
+            if record["video"] not in videos:
+                continue
+            row = rows.setdefault(record["id"], dict(
+                id=record["id"], config=record["config"], videos=0, seconds=0.,
+                **{c: 0 for c in COUNTS}
+            ))
+            row["videos"] += 1
+            row["seconds"] += record["seconds"]
+            for c in COUNTS:
+                row[c] += record["counts"][c]
+        for row in rows.values():
+            row.update(overall_metrics(row))
+        return sorted(rows.values(), key=lambda row: (row["videos"] < len(videos), -row[metric]))
+
+    def write(self, path, metric, videos):
+        """
+        Write the ranking as a tab separated table.
+        :rtype list[dict], see `ranking`
+        """
+        rows = self.ranking(metric, videos)
+        with open(path, "w") as f:
+            f.write("rank\tidf1\tmota\tidsw\tvideos\tfps\tid\tconfig\n")
+            for rank, row in enumerate(rows, 1):
+                f.write("{}\t{:.4f}\t{:.4f}\t{}\t{}/{}\t{:.1f}\t{}\t{}\n".format(
+                    rank, row["idf1"], row["mota"], row["num_switches"],
+                    row["videos"], len(set(videos)),
+                    row["num_frames"] / max(row["seconds"], 1e-9),
+                    row["id"], json.dumps(row["config"], sort_keys=True),
+                ))
+        return rows
+
+
+def make_tracker(kind, args, network=None):
+    """
+    :param kind: "mixsort" or "mixsort_oc"
+    :param network: loaded MixFormer to share, built from `args` if None
+
+    :rtype tracker, its MixFormer
+    """
+    if kind == "mixsort":
+        if args.iou_only:
+            from yolox.mixsort_tracker.mixsort_iou_tracker import MIXTracker
+        else:
+            from yolox.mixsort_tracker.mixsort_tracker import MIXTracker
+        tracker = MIXTracker(args, network=network)
+        return tracker, tracker.network
+    if kind == "mixsort_oc":
+        from yolox.mixsort_oc_tracker.mixsort_oc_tracker import MIXTracker
+        tracker = MIXTracker(
+            det_thresh=args.track_thresh, args=args, iou_threshold=args.iou_thresh,
+            asso_func=args.asso, delta_t=args.deltat, inertia=args.inertia,
+            use_byte=args.use_byte, max_age=args.track_buffer, network=network,
+        )
+        return tracker, tracker.mixformer.network
+    raise ValueError("unknown tracker {}".format(kind))
+
+
+def online_boxes(kind, online_targets, args):
+    """
+    tlwh & ids of the tracker outputs kept in the results, filtered like `MOTEvaluator`.
+    :rtype tlwhs np.ndarray (n, 4), ids list[int]
+    """
+    tlwhs, ids = [], []
+    for t in online_targets:
+        if kind == "mixsort":
+            tlwh, tid = t.tlwh, t.track_id
+        else:
+            tlwh, tid = [t[0], t[1], t[2] - t[0], t[3] - t[1]], int(t[4])
+        vertical = tlwh[2] / tlwh[3] > 1.6
+        if tlwh[2] * tlwh[3] > args.min_box_area and not vertical:
+            tlwhs.append(tlwh)
+            ids.append(tid)
+    return np.asarray(tlwhs, dtype=float).reshape(-1, 4), ids
+
+
+# state of a worker process, set by `_init_worker`
+_worker = {}
+
+
+def _init_worker(args, kind, cache, data_root, ranks, num_threads):
+    args = copy.copy(args)
+    # gpu workers take the gpus in turn
+    args.local_rank = ranks.get()
+    device = get_device(args)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    else:
+        configure_cpu(num_threads)
+    _worker.update(
+        args=args, kind=kind, cache=cache, data_root=data_root, device=device,
+        networks={}, evaluators={},
+    )
+
+
+def _run_cell(job):
+    cid, config, video = job
+    kind, cache = _worker["kind"], _worker["cache"]
+    args = copy.copy(_worker["args"])
+    if kind == "mixsort":
+        # the settings `evaluate_mixsort` tracks the video with, the swept ones still win
+        args = set_mixsort_args(args, video)
+    args.__dict__.update(config)
+    data_root, device = _worker["data_root"], _worker["device"]
+    # one MixFormer per backend & worker, shared by the trackers of all its cells
+    networks = _worker["networks"]
+    tracker, networks[args.backend] = make_tracker(kind, args, networks.get(args.backend))
+    if video not in _worker["evaluators"]:
+        _worker["evaluators"][video] = Evaluator(data_root, video, "mot")
+    evaluator = _worker["evaluators"][video]
+    evaluator.reset_accumulator()
+    test_size = tuple(cache.key["test_size"])
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for frame_id, file_name, dets in cache.frames(video):
+            img = cv2.imread(os.path.join(data_root, file_name))
+            assert img is not None
+            tlwhs, ids = np.zeros((0, 4)), []
+            if len(dets) > 0:
+                online_targets = tracker.update(
+                    torch.from_numpy(dets).to(device),
+                    img.shape[:2],
+                    test_size,
+                    torch.from_numpy(img).permute(2, 0, 1).to(device),
+                )
+                tlwhs, ids = online_boxes(kind, online_targets, args)
+            evaluator.eval_frame(frame_id, tlwhs, ids)
+    seconds = time.perf_counter() - start
+
+    summary = mm.metrics.create().compute(evaluator.acc, metrics=list(COUNTS), name=video)
+    return {
+        "id": cid,
+        "config": config,
+        "video": video,
+        "counts": {c: int(summary[c].iloc[0]) for c in COUNTS},
+        "seconds": seconds,
+    }
+
+
+def run_sweep(args, kind, configs, cache, data_root, output_dir, metric="idf1", workers=1):
+    """
+    Track every cached video with every config over a pool of processes, each one holding a
+    MixFormer of its own, and rank the configs by the MOT metrics of `Evaluator`.
+
+    Finished (config, video) cells go to `cells.jsonl` in `output_dir` as they come, a sweep
+    run again with the same output only runs the missing cells. The ranking is written to
+    `ranking.tsv`.
+
+    :param args: tracking arguments, for "mixsort" the per-video `MIXSORT_SETTINGS` override
+        them like in `evaluate_mixsort`, and the ones of a config override both
+    :param kind: "mixsort" or "mixsort_oc"
+    :param configs: list[dict], argument name -> value
+    :param cache: DetectionCache of the detector, filled by a run of the tracker before
+    :param data_root: directory of the images & ground truth of the videos, `video/gt/gt.txt`
+    :param metric: one of `RANK_METRICS`
+    :param workers: number of processes, with `args.device` gpu they take the gpus in turn
+
+    :rtype list[dict], the ranking, see `SweepTable.ranking`
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    table = SweepTable(os.path.join(output_dir, "cells.jsonl"))
+    videos = cache.videos()
+    if len(videos) == 0:
+        raise ValueError(
+            "no cached detections in {}, run the tracker with --det_cache first".format(cache.dir)
+        )
+    jobs = [
+        (config_id(config), config, video)
+        for config in configs for video in videos if (config_id(config), video) not in table
+    ]
+    logger.info(
+        "sweep of {} configs over {} videos, {} cells done, {} to run".format(
+            len(configs), len(videos), len(configs) * len(videos) - len(jobs), len(jobs)
+        )
+    )
+
+    if len(jobs) > 0:
+        ctx = torch.multiprocessing.get_context("spawn")
+        ranks = ctx.Queue()
+        num_gpus = torch.cuda.device_count() if args.device == "gpu" else 0
+        for i in range(workers):
+            ranks.put(i % num_gpus if num_gpus > 0 else 0)
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        initargs = (args, kind, cache, data_root, ranks, num_threads)
+        with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+            for done, record in enumerate(pool.imap_unordered(_run_cell, jobs), 1):
+                table.add(record)
+                logger.info("[{}/{}] {} {} {:.1f}s".format(
+                    done, len(jobs), record["id"], record["video"], record["seconds"]
+                ))
+
+    rows = table.write(os.path.join(output_dir, "ranking.tsv"), metric, videos)
+    for rank, row in enumerate(rows[:5], 1):
+        logger.info("#{} idf1 {:.4f} mota {:.4f} {}".format(
+            rank, row["idf1"], row["mota"], row["config"]
+        ))
+    return rows
@@ -1,6 +1,7 @@
 import os
 import numpy as np
 from .mixformer import MixFormer
+from yolox.tracking_utils.gate import ambiguous_pairs
 
 def iou_batch(bboxes1, bboxes2):
     """
@@ -184,6 +185,27 @@ def speed_direction_batch(dets, tracks):
     return dy, dx # size: num_track x num_det
 
 
+def mix_similarity(detections, trackers, iou_matrix, img, mixformer:MixFormer, templates):
+    """
+    MixFormer similarity of every tracker with every detection, num_track x num_det.
+    With `mixformer.vit_gate` only the ambiguous pairs are scored by MixFormer, the
+    other pairs keep their IoU so that they are decided by IoU alone.
+    """
+    if mixformer.vit_gate:
+        mask = ambiguous_pairs(iou_matrix, mixformer.gate_iou, mixformer.gate_margin)
+    else:
+        mask = np.ones(iou_matrix.shape, dtype=bool)
+    mixformer.vit_pairs += mask.size
+    mixformer.vit_pairs_skipped += mask.size - int(mask.sum())
+
+    vit = np.array(iou_matrix, dtype=np.float64).T
+    trks = np.where(mask.any(axis=0))[0]
+    if len(trks) > 0:
+        vit_trks = mixformer.compute_vit_sim(detections, trackers[trks], img, templates)
+        vit[trks] = np.where(mask[:, trks].T, vit_trks, vit[trks])
+    return vit
+
+
 def linear_assignment(cost_matrix):
     try:
         import lap
@@ -269,7 +291,7 @@ def associate(detections, trackers, iou_threshold, velocities, previous_obs, vdc
         if a.sum(1).max() == 1 and a.sum(0).max() == 1: # trivial condition: no overlap, direct association
             matched_indices = np.stack(np.where(a), axis=1) # non-zero elements
         else:
-            vit=mixformer.compute_vit_sim(detections,trackers,img,templates)
+            vit=mix_similarity(detections,trackers,iou_matrix,img,mixformer,templates)
             matched_indices = linear_assignment(-(alpha*(iou_matrix+angle_diff_cost)+(1-alpha)*vit.T))
     else:
         matched_indices = np.empty(shape=(0,2))
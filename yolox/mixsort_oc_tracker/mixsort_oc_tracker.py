@@ -4,20 +4,12 @@
 from __future__ import print_function
 
 import numpy as np
+from collections import deque
 from .association import *
 from typing import List, Union, Tuple
 from .mixformer import MixFormer
-
-def k_previous_obs(observations, cur_age, k):
-    if len(observations) == 0:
-        return [-1, -1, -1, -1, -1]
-    for i in range(k):
-        dt = k - i
-        if cur_age - dt in observations:
-            return observations[cur_age-dt]
-    max_age = max(observations.keys())
-    return observations[max_age]
-
+from yolox.tracking_utils.oc_kalman import OCKalmanBank
+from yolox.tracking_utils.spatial_index import BoxIndex
 
 def convert_bbox_to_z(bbox):
     """
@@ -59,47 +51,29 @@ class KalmanBoxTracker(object):
     """
     This class represents the internal state of individual tracked objects observed as bbox.
     """
-    count = 0
-
-    def __init__(self, bbox, delta_t=3, orig=False, template=None):
+    def __init__(self, bbox, track_id, kf, delta_t=3, template=None):
         """
         Initialises a tracker using initial bounding box.
+        track_id is handed out by the owning MIXTracker, the constant velocity model is a
+        slot of its OCKalmanBank kf.
 
         """
-        # define constant velocity model
-        if not orig:
-          from .kalmanfilter import KalmanFilterNew as KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        else:
-          from filterpy.kalman import KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array([[1, 0, 0, 0, 1, 0, 0], [0, 1, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0, 1], [
-                            0, 0, 0, 1, 0, 0, 0],  [0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 1]])
-        self.kf.H = np.array([[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0],
-                            [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]])
-
-        self.kf.R[2:, 2:] *= 10.
-        self.kf.P[4:, 4:] *= 1000.  # give high uncertainty to the unobservable initial velocities
-        self.kf.P *= 10.
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)
+        self.kf = kf
+        self.slot = kf.allocate(convert_bbox_to_z(bbox))
         self.time_since_update = 0
-        self.id = KalmanBoxTracker.count
-        KalmanBoxTracker.count += 1
-        self.history = []
+        self.id = track_id
+        # predicted boxes since the last observation, the delta_t last ones
+        self.history = deque(maxlen=delta_t)
         self.hits = 0
         self.hit_streak = 0
         self.age = 0
         """
         NOTE: [-1,-1,-1,-1,-1] is a compromising placeholder for non-observation status, the same for the return of 
         function k_previous_obs. It is ugly and I do not like it. But to support generate observation array in a 
-        fast and unified way, which you would see below k_observations = np.array([k_previous_obs(...]]), let's bear it for now.
+        fast and unified way, which you would see below k_observations = self.kf.k_previous_obs(...), let's bear it for now.
+        The observations themselves are kept by kf, the last ones only.
         """
         self.last_observation = np.array([-1, -1, -1, -1, -1])  # placeholder
-        self.observations = dict()
-        self.history_observations = []
         self.velocity = None
         self.delta_t = delta_t
 
@@ -111,55 +85,47 @@ class KalmanBoxTracker(object):
         """
         if bbox is not None:
             if self.last_observation.sum() >= 0:  # no previous observation
-                previous_box = None
-                for i in range(self.delta_t):
-                    dt = self.delta_t - i
-                    if self.age - dt in self.observations:
-                        previous_box = self.observations[self.age-dt]
-                        break
-                if previous_box is None:
-                    previous_box = self.last_observation
+                previous_box = self.kf.previous_obs(self.slot, self.age, self.delta_t)
                 """
                   Estimate the track speed direction with observations \Delta t steps away
                 """
                 self.velocity = speed_direction(previous_box, bbox)
             
-            """
-              Insert new observations. This is a ugly way to maintain both self.observations
-              and self.history_observations. Bear it for the moment.
-            """
             self.last_observation = bbox
-            self.observations[self.age] = bbox
-            self.history_observations.append(bbox)
+            self.kf.record(self.slot, self.age, bbox)
 
             self.time_since_update = 0
-            self.history = []
+            self.history.clear()
             self.hits += 1
             self.hit_streak += 1
-            self.kf.update(convert_bbox_to_z(bbox))
+            self.kf.update(self.slot, convert_bbox_to_z(bbox))
         else:
-            self.kf.update(bbox)
+            self.kf.update(self.slot, None)
 
     def predict(self):
         """
         Advances the state vector and returns the predicted bounding box estimate.
         """
-        if((self.kf.x[6]+self.kf.x[2]) <= 0):
-            self.kf.x[6] *= 0.0
+        self.kf.predict([self.slot])
+        return self.advance(self.get_state())
 
-        self.kf.predict()
+    def advance(self, bbox):
+        """
+        Bookkeeping of a predict, bbox is the predicted estimate of the state vector which
+        was advanced by the bank.
+        """
         self.age += 1
         if(self.time_since_update > 0):
             self.hit_streak = 0
         self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
+        self.history.append(bbox)
         return self.history[-1]
 
     def get_state(self):
         """
         Returns the current bounding box estimate.
         """
-        return convert_x_to_bbox(self.kf.x)
+        return self.kf.tlbr([self.slot])
 
 
 """
@@ -177,50 +143,65 @@ ASSO_FUNCS = {  "iou": iou_batch,
 
 class MIXTracker(object):
     def __init__(self, det_thresh, args, max_age=30, min_hits=3, 
-        iou_threshold=0.3, delta_t=3, asso_func="iou", inertia=0.2, use_byte=False):
+        iou_threshold=0.3, delta_t=3, asso_func="iou", inertia=0.2, use_byte=False, network=None):
         """
         Sets key parameters for SORT
+        network is a loaded MixFormer shared with other trackers, built from args if None
         """
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
         self.trackers = [] #type: List[KalmanBoxTracker]
+        # Kalman filters & last observations of all the trackers, enough of them for the
+        # velocity direction & the head padding, the trackers of update_public look 3 steps back
+        self.kf = OCKalmanBank(history=max(delta_t, min_hits, 3))
         self.frame_count = 0
         self.det_thresh = det_thresh
         self.delta_t = delta_t
         self.asso_func = ASSO_FUNCS[asso_func]
         self.inertia = inertia
         self.use_byte = use_byte
-        KalmanBoxTracker.count = 0
+        # ids of the trackers created by this MIXTracker
+        self.id_count = 0
 
-        self.mixformer=MixFormer(args)
+        self.mixformer=MixFormer(args, network)
         self.mix_iou=args.mix_iou
         self.alpha=args.alpha
 
     def re_init(self):
         self.trackers = [] #type: List[KalmanBoxTracker]
+        self.kf = OCKalmanBank(history=max(self.delta_t, self.min_hits, 3))
         self.frame_count = 0
         #self.det_thresh=det_thresh
         #self.max_age=max_age
-        KalmanBoxTracker.count = 0
+        self.id_count = 0
+
+    def next_id(self):
+        track_id = self.id_count
+        self.id_count += 1
+        return track_id
+
+    def predict(self):
+        """
+        Advance all the trackers in one step.
+        Returns their predicted bounding box estimates, (N, 4).
+        """
+        slots = np.array([trk.slot for trk in self.trackers], dtype=np.int64)
+        self.kf.predict(slots)
+        bboxes = self.kf.tlbr(slots)
+        for trk, bbox in zip(self.trackers, bboxes):
+            trk.advance(bbox[None])
+        return bboxes
+
+    def remove(self, t):
+        """
+        Drop the t-th tracker & free its Kalman filter.
+        """
+        self.kf.release(self.trackers.pop(t).slot)
 
     def uncovered_area(self, bbox:np.ndarray):
-        result=[]
-        for i, (x1,y1,x2,y2) in enumerate(bbox):
-            w,h=x2-x1,y2-y1
-            temp=np.ones((h,w),dtype=np.int8)
-            for j, (_x1,_y1,_x2,_y2) in enumerate(bbox):
-                if i==j:
-                    continue
-                _x1-=x1
-                _y1-=y1
-                _x2-=x1
-                _y2-=y1
-                if _x1>w or _x2<0 or _y1>h or _y2<0:
-                    continue
-                temp[max(0,_y1):min(h,_y2),max(0,_x1):min(w,_x2)]=0
-            result.append(1-int(temp.sum())/(w*h))
-        return result
+        # fraction of every box covered by the union of the other boxes
+        return BoxIndex(bbox).covered_area()
 
     def update(self, output_results, img_info, img_size, img, scale=True):
         """
@@ -263,32 +244,37 @@ class MIXTracker(object):
         trks = np.zeros((len(self.trackers), 6))
         to_del = []
         ret = []
+        predicted = self.predict()
         for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
+            pos = predicted[t]
             trk[:] = [pos[0], pos[1], pos[2], pos[3], 0, t]
             if np.any(np.isnan(pos)):
                 to_del.append(t)
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks)) # discard invalid track predictions
         for t in reversed(to_del):
-            self.trackers.pop(t)
+            self.remove(t)
 
         velocities = np.array(
             [trk.velocity if trk.velocity is not None else np.array((0, 0)) for trk in self.trackers])
         last_boxes = np.array([trk.last_observation for trk in self.trackers])
-        k_observations = np.array(
-            [k_previous_obs(trk.observations, trk.age, self.delta_t) for trk in self.trackers])
+        k_observations = self.kf.k_previous_obs(
+            [trk.slot for trk in self.trackers], [trk.age for trk in self.trackers], self.delta_t)
 
         """
             First round of association
         """
         matched, unmatched_dets, unmatched_trks = associate(
             dets, trks, self.iou_threshold, velocities, k_observations, self.inertia, img, self.mixformer,self.alpha,templates)
+        # trackers getting a new template & where to crop it, cropped in one batch at the end
+        template_trks = []
+        template_boxes = []
         for m in matched:
             self.trackers[m[1]].update(dets[m[0], :-1])
             det=np.array(dets[m[0]])
             det[2:4]=det[2:4]-det[0:2]
             if det[-1]<self.mix_iou:
-                self.trackers[m[1]].template=self.mixformer.crop_and_resize(img,det,"template")
+                template_trks.append(self.trackers[m[1]])
+                template_boxes.append(det)
 
         """
             Second round of associaton by OCR
@@ -304,7 +290,7 @@ class MIXTracker(object):
                     get a higher performance especially on MOT17/MOT20 datasets. But we keep it
                     uniform here for simplicity
                 """
-                vit=self.mixformer.compute_vit_sim(dets_second,u_trks,img,templates)
+                vit=mix_similarity(dets_second,u_trks,iou_left,img,self.mixformer,templates)
                 matched_indices = linear_assignment(-(self.alpha*iou_left+(1-self.alpha)*vit.T))
                 to_remove_trk_indices = []
                 for m in matched_indices:
@@ -316,7 +302,8 @@ class MIXTracker(object):
                     det=np.array(dets_second[det_ind])
                     det[2:4]=det[2:4]-det[0:2]
                     if det[-1]<self.mix_iou:
-                        self.trackers[trk_ind].template=self.mixformer.crop_and_resize(img,det,"template")
+                        template_trks.append(self.trackers[trk_ind])
+                        template_boxes.append(det)
                 unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
 
         if unmatched_dets.shape[0] > 0 and unmatched_trks.shape[0] > 0:
@@ -330,7 +317,7 @@ class MIXTracker(object):
                     get a higher performance especially on MOT17/MOT20 datasets. But we keep it
                     uniform here for simplicity
                 """
-                vit=self.mixformer.compute_vit_sim(left_dets,left_trks,img,templates)
+                vit=mix_similarity(left_dets,left_trks,iou_left,img,self.mixformer,templates)
                 rematched_indices = linear_assignment(-(self.alpha*iou_left+(1-self.alpha)*vit.T))
                 to_remove_det_indices = []
                 to_remove_trk_indices = []
@@ -342,7 +329,8 @@ class MIXTracker(object):
                     det=np.array(dets[det_ind])
                     det[2:4]=det[2:4]-det[0:2]
                     if det[-1]<self.mix_iou:
-                        self.trackers[trk_ind].template=self.mixformer.crop_and_resize(img,det,"template")
+                        template_trks.append(self.trackers[trk_ind])
+                        template_boxes.append(det)
                     to_remove_det_indices.append(det_ind)
                     to_remove_trk_indices.append(trk_ind)
                 unmatched_dets = np.setdiff1d(unmatched_dets, np.array(to_remove_det_indices))
@@ -355,8 +343,15 @@ class MIXTracker(object):
         for i in unmatched_dets:
             det=np.array(dets[i])
             det[2:4]=det[2:4]-det[0:2]
-            trk = KalmanBoxTracker(dets[i, :-1], delta_t=self.delta_t,template=self.mixformer.crop_and_resize(img,det,"template"))
+            trk = KalmanBoxTracker(dets[i, :-1], self.next_id(), self.kf, delta_t=self.delta_t)
             self.trackers.append(trk)
+            template_trks.append(trk)
+            template_boxes.append(det)
+        # templates are first used in the next frame, crop them all at once
+        if len(template_trks) > 0:
+            new_templates = self.mixformer.crop_templates(img, np.stack(template_boxes))
+            for trk, template in zip(template_trks, new_templates):
+                trk.template = template
         i = len(self.trackers)
         for trk in reversed(self.trackers):
             if trk.last_observation.sum() < 0:
@@ -373,7 +368,7 @@ class MIXTracker(object):
             i -= 1
             # remove dead tracklet
             if(trk.time_since_update > self.max_age):
-                self.trackers.pop(i)
+                self.remove(i)
         if(len(ret) > 0):
             return np.concatenate(ret)
         return np.empty((0, 5))
@@ -392,19 +387,21 @@ class MIXTracker(object):
         trks = np.zeros((len(self.trackers), 5))
         to_del = []
         ret = []
+        predicted = self.predict()
         for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
+            pos = predicted[t]
             cat = self.trackers[t].cate
             trk[:] = [pos[0], pos[1], pos[2], pos[3], cat]
             if np.any(np.isnan(pos)):
                 to_del.append(t)
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
-            self.trackers.pop(t)
+            self.remove(t)
 
         velocities = np.array([trk.velocity if trk.velocity is not None else np.array((0,0)) for trk in self.trackers])
         last_boxes = np.array([trk.last_observation for trk in self.trackers])
-        k_observations = np.array([k_previous_obs(trk.observations, trk.age, self.delta_t) for trk in self.trackers])
+        k_observations = self.kf.k_previous_obs(
+            [trk.slot for trk in self.trackers], [trk.age for trk in self.trackers], self.delta_t)
 
         matched, unmatched_dets, unmatched_trks = associate_kitti\
               (dets, trks, cates, self.iou_threshold, velocities, k_observations, self.inertia)
@@ -454,7 +451,7 @@ class MIXTracker(object):
                 unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
 
         for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i,:])
+            trk = KalmanBoxTracker(dets[i,:], self.next_id(), self.kf)
             trk.cate = cates[i]
             self.trackers.append(trk)
         i = len(self.trackers)
@@ -470,13 +467,14 @@ class MIXTracker(object):
                     ret.append(np.concatenate((d, [trk.id+1], [trk.cate], [0])).reshape(1,-1)) 
                 if trk.hit_streak == self.min_hits:
                     # Head Padding (HP): recover the lost steps during initializing the track
+                    recent_obs = self.kf.recent_obs(trk.slot, self.min_hits)
                     for prev_i in range(self.min_hits - 1):
-                        prev_observation = trk.history_observations[-(prev_i+2)]
+                        prev_observation = recent_obs[prev_i+1]
                         ret.append((np.concatenate((prev_observation[:4], [trk.id+1], [trk.cate], 
                             [-(prev_i+1)]))).reshape(1,-1))
             i -= 1 
             if (trk.time_since_update > self.max_age):
-                  self.trackers.pop(i)
+                  self.remove(i)
         
         if(len(ret)>0):
             return np.concatenate(ret)
@@ -9,8 +9,74 @@ class TrackState(object):
     Removed = 3
 
 
+class IDAllocator(object):
+    """Hands out the track ids of one tracker, starting from 1."""
+
+    def __init__(self):
+        self.count = 0
+
+    def next_id(self):
+        self.count += 1
+        return self.count
+
+
+class RemovedTracks(object):
+    """Ids of the tracks a tracker removed in the last `retention` frames.
+
+    A track removed from the lost list only leaves it one frame later, when the tracker drops
+    the lost tracks whose id was removed. Only the ids are needed for that, so removed tracks
+    are not kept and their templates can be freed right away.
+    """
+
+    def __init__(self, retention):
+        """
+        :param retention: number of frames an id is kept, at least 1
+        """
+        self.retention = max(retention, 1)
+        # track id -> frame it was removed at, oldest first
+        self.frames = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, track_id):
+        return track_id in self.frames
+
+    def add(self, stracks, frame_id):
+        """
+        Remember the ids of `stracks`, removed at `frame_id`, and forget the ids removed
+        more than `retention` frames before.
+        :type stracks: list[BaseTrack]
+        """
+        for t in stracks:
+            # keep the dict ordered by frame for tracks removed again
+            self.frames.pop(t.track_id, None)
+            self.frames[t.track_id] = frame_id
+        while len(self.frames) > 0:
+            track_id = next(iter(self.frames))
+            if frame_id - self.frames[track_id] < self.retention:
+                break
+            del self.frames[track_id]
+
+
+def sub_removed(stracks, removed_ids):
+    """
+    `stracks` without the ones whose id was removed. Like `sub_stracks` on the removed
+    tracks, a track listed twice is only kept once.
+    :type stracks: list[BaseTrack]
+    :type removed_ids: RemovedTracks
+
+    :rtype list[BaseTrack]
+    """
+    kept = {}
+    for t in stracks:
+        kept[t.track_id] = t
+    return [t for track_id, t in kept.items() if track_id not in removed_ids]
+
+
 class BaseTrack(object):
-    _count = 0
+    # set by the owning tracker, so that every tracker counts its own ids
+    id_allocator = None
 
     track_id = 0
     is_activated = False
@@ -31,10 +97,8 @@ class BaseTrack(object):
     def end_frame(self):
         return self.frame_id
 
-    @staticmethod
-    def next_id():
-        BaseTrack._count += 1
-        return BaseTrack._count
+    def next_id(self):
+        return self.id_allocator.next_id()
 
     def activate(self, *args):
         raise NotImplementedError
@@ -180,10 +180,8 @@ class KalmanFilter(object):
             self._std_weight_velocity * mean[:, 3]]
         sqr = np.square(np.r_[std_pos, std_vel]).T
 
-        motion_cov = []
-        for i in range(len(mean)):
-            motion_cov.append(np.diag(sqr[i]))
-        motion_cov = np.asarray(motion_cov)
+        motion_cov = np.zeros((len(mean), 8, 8))
+        motion_cov[:, np.arange(8), np.arange(8)] = sqr
 
         mean = np.dot(mean, self._motion_mat.T)
         left = np.dot(self._motion_mat, covariance).transpose((1, 0, 2))
@@ -225,6 +223,47 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def multi_update(self, mean, covariance, measurement):
+        """Run Kalman filter correction step (Vectorized version).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the predicted states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the states.
+        measurement : ndarray
+            The Nx4 dimensional measurement matrix, one (x, y, a, h) row per
+            state.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        std = [
+            self._std_weight_position * mean[:, 3],
+            self._std_weight_position * mean[:, 3],
+            1e-1 * np.ones_like(mean[:, 3]),
+            self._std_weight_position * mean[:, 3]]
+        innovation_cov = np.zeros((len(mean), 4, 4))
+        innovation_cov[:, np.arange(4), np.arange(4)] = np.square(np.r_[std]).T
+
+        projected_mean = np.dot(mean, self._update_mat.T)
+        cov_update = np.matmul(covariance, self._update_mat.T)
+        projected_cov = np.matmul(self._update_mat, cov_update) + innovation_cov
+
+        # K = P H^T S^-1, S is symmetric
+        kalman_gain = np.linalg.solve(
+            projected_cov, cov_update.transpose((0, 2, 1))).transpose((0, 2, 1))
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(
+            np.matmul(kalman_gain, projected_cov), kalman_gain.transpose((0, 2, 1)))
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False, metric='maha'):
         """Compute gating distance between state distribution and measurements.
@@ -3,6 +3,7 @@ import numpy as np
 import scipy
 import lap
 from scipy.spatial.distance import cdist
+from torchvision.ops import box_iou
 
 from cython_bbox import bbox_overlaps as bbox_ious
 from . import kalman_filter
@@ -36,11 +37,17 @@ def _indices_to_matches(cost_matrix, indices, thresh):
     return matches, unmatched_a, unmatched_b
 
 
-def linear_assignment(cost_matrix, thresh):
+def linear_assignment(cost_matrix, thresh, solver=None):
+    """
+    :param solver: LinearAssignment | None, solver of the tracker, lapjv if None
+    """
     if cost_matrix.size == 0:
         return np.empty((0, 2), dtype=int), tuple(range(cost_matrix.shape[0])), tuple(range(cost_matrix.shape[1]))
     matches, unmatched_a, unmatched_b = [], [], []
-    cost, x, y = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
+    if solver is None:
+        cost, x, y = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
+    else:
+        x, y = solver(cost_matrix, thresh)
     for ix, mx in enumerate(x):
         if mx >= 0:
             matches.append([ix, mx])
@@ -70,6 +77,19 @@ def ious(atlbrs, btlbrs):
     return ious
 
 
+def torch_ious(atlbrs, btlbrs):
+    """
+    `ious` on the device, with the same convention: a box covers the pixels x1..x2 inclusive
+    :type atlbrs: torch.Tensor (M, 4)
+    :type btlbrs: torch.Tensor (N, 4)
+
+    :rtype ious torch.Tensor (M, N)
+    """
+    # box_iou takes x2 & y2 as exclusive
+    shift = atlbrs.new_tensor([0, 0, 1, 1])
+    return box_iou(atlbrs + shift, btlbrs + shift)
+
+
 def iou_distance(atracks, btracks):
     """
     Compute cost based on IoU
@@ -178,4 +198,13 @@ def fuse_score(cost_matrix, detections):
     det_scores = np.expand_dims(det_scores, axis=0).repeat(cost_matrix.shape[0], axis=0)
     fuse_sim = iou_sim * det_scores
     fuse_cost = 1 - fuse_sim
-    return fuse_cost
\ No newline at end of file
+    return fuse_cost
+
+
+def torch_fuse_score(cost_matrix, det_scores):
+    """
+    `fuse_score` on the device
+    :type cost_matrix: torch.Tensor (M, N)
+    :type det_scores: torch.Tensor (N,)
+    """
+    return 1 - (1 - cost_matrix) * det_scores[None]
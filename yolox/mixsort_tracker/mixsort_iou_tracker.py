@@ -11,7 +11,10 @@ from torch.utils.tensorboard import SummaryWriter
 
 from .kalman_filter import KalmanFilter
 from . import matching
-from .basetrack import BaseTrack, TrackState
+from yolox.tracking_utils.mixformer_backend import build_network
+from .basetrack import BaseTrack, IDAllocator, RemovedTracks, TrackState, sub_removed
+from yolox.tracking_utils.spatial_index import BoxIndex
+from yolox.tracking_utils.assignment import LinearAssignment
 from MixViT.lib.models.mixformer_vit import build_mixformer_deit
 from MixViT.lib.train.data.processing import MixformerProcessing as MP
 from MixViT.lib.train.data.transforms import Transform, ToTensor, Normalize
@@ -38,8 +41,9 @@ class STrack(BaseTrack):
         self.score = score
         self.tracklet_len = 0
 
-    def activate(self, frame_id, template):
+    def activate(self, frame_id, template, id_allocator):
         """Start a new tracklet"""
+        self.id_allocator = id_allocator
         self.track_id = self.next_id()
         self.template = template
         self.tlwh=self._tlwh
@@ -129,10 +133,16 @@ class STrack(BaseTrack):
 
 
 class MIXTracker(object):
-    def __init__(self, args, frame_rate=30):
+    def __init__(self, args, frame_rate=30, network=None):
+        """
+        Args:
+            args: tracking arguments
+            frame_rate (int, optional): frame rate of the video. Defaults to 30.
+            network (optional): loaded MixFormer shared with other trackers, built from
+                `args` if not given. Defaults to None.
+        """
         self.tracked_stracks = []  # type: list[STrack]
         self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
 
         self.frame_id = 0
         self.args = args
@@ -140,7 +150,12 @@ class MIXTracker(object):
         self.det_thresh = args.track_thresh + 0.1
         self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
+        # ids of the removed tracks, the tracks themselves are dropped
+        self.removed_ids = RemovedTracks(int(frame_rate / 30.0 * args.removed_buffer))
         self.kalman_filter = KalmanFilter()
+        self.assignment = LinearAssignment()
+        # track ids of this tracker, a new allocator restarts them for a new video
+        self.id_allocator = IDAllocator()
 
         self.last_img = None
         self.alpha = args.alpha
@@ -165,16 +180,13 @@ class MIXTracker(object):
         config_module.update_config_from_file(self.settings.cfg_file)
         update_settings(self.settings, self.cfg)
 
-        # need modification, for distributed
-        network = build_mixformer_deit(self.cfg)
-        self.network = network.cuda(torch.device(f"cuda:{args.local_rank}"))
-        self.network.eval()
+        if network is None:
+            network = build_network(args, self.cfg)
+        self.network = network
 
     def re_init(self, args, frame_rate=30):
-        BaseTrack._count = 0 # set to 0 for new video
         self.tracked_stracks = []  # type: list[STrack]
         self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
 
         self.frame_id = 0
         self.args = args
@@ -182,13 +194,31 @@ class MIXTracker(object):
         self.det_thresh = args.track_thresh + 0.1
         self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
+        # ids of the removed tracks, the tracks themselves are dropped
+        self.removed_ids = RemovedTracks(int(frame_rate / 30.0 * args.removed_buffer))
         self.kalman_filter = KalmanFilter()
+        # track ids of this tracker, a new allocator restarts them for a new video
+        self.id_allocator = IDAllocator()
 
         self.last_img = None
         self.alpha = args.alpha
         self.radius = args.radius
         self.iou_thresh = args.iou_thresh
 
+    @property
+    def memory_usage(self):
+        """number of tracked & lost tracks, removed track ids held, and bytes of the templates
+        of the tracks"""
+        stracks = self.tracked_stracks + self.lost_stracks
+        return {
+            "tracks": len(stracks),
+            "removed_ids": len(self.removed_ids),
+            "template_bytes": sum(
+                s.template.element_size() * s.template.nelement()
+                for s in stracks if s.template is not None
+            ),
+        }
+
     def visualize(self, logger: SummaryWriter, template, search, search_box):
         # utils for debugging
         logger.add_image("template", template)
@@ -230,7 +260,7 @@ class MIXTracker(object):
                 img, y, x, crop_sz, crop_sz, [output_sz, output_sz]
             )
         except:  # too small box
-            zero_img = torch.zeros((3, output_sz, output_sz)).cuda()
+            zero_img = torch.zeros((3, output_sz, output_sz), device=img.device)
             return zero_img if annos is None else zero_img, []
 
         if annos is not None:
@@ -359,15 +389,8 @@ class MIXTracker(object):
         scale = min(img_size[0] / float(img_h), img_size[1] / float(img_w))
         bboxes /= scale
 
-        # compute all ious
-        all_dets = [x for x in bboxes]
-        iou = matching.ious(all_dets, all_dets)
         # compute max iou for every det
-        max_iou = []
-        for i in range(len(all_dets)):
-            iou[i][i] = 0
-            max_iou.append(iou[i].max())
-        max_iou = np.array(max_iou)
+        max_iou = BoxIndex(bboxes).max_iou()
 
         remain_inds = scores > self.args.track_thresh
         inds_low = scores > 0.1
@@ -405,7 +428,7 @@ class MIXTracker(object):
         # if not self.args.mot20:
         #     dists = matching.fuse_score(dists, detections)
         matches, u_track, u_detection = matching.linear_assignment(
-            dists, thresh=self.args.match_thresh
+            dists, thresh=self.args.match_thresh, solver=self.assignment
         )
 
         for itracked, idet in matches:
@@ -441,7 +464,7 @@ class MIXTracker(object):
         # dists = matching.iou_distance(r_tracked_stracks, detections_second)
         dists = self.compute_mix_dist(r_tracked_stracks, detections_second, img)
         matches, u_track, u_detection_second = matching.linear_assignment(
-            dists, thresh=0.5
+            dists, thresh=0.5, solver=self.assignment
         )
         for itracked, idet in matches:
             track = r_tracked_stracks[itracked]
@@ -471,7 +494,7 @@ class MIXTracker(object):
         # if not self.args.mot20:
         #     dists = matching.fuse_score(dists, detections)
         matches, u_unconfirmed, u_detection = matching.linear_assignment(
-            dists, thresh=0.7
+            dists, thresh=0.7, solver=self.assignment
         )
         for itracked, idet in matches:
             det = detections[idet]
@@ -496,6 +519,7 @@ class MIXTracker(object):
             track.activate(
                 self.frame_id,
                 self.crop_and_resize(img, track._tlwh, "template"),
+                self.id_allocator,
             )
             activated_starcks.append(track)
         """ Step 5: Update state"""
@@ -506,6 +530,7 @@ class MIXTracker(object):
 
         # print('Ramained match {} s'.format(t4-t3))
 
+        previous_stracks = self.tracked_stracks + self.lost_stracks
         self.tracked_stracks = [
             t for t in self.tracked_stracks if t.state == TrackState.Tracked
         ]
@@ -513,11 +538,16 @@ class MIXTracker(object):
         self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
         self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
         self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
+        self.lost_stracks = sub_removed(self.lost_stracks, self.removed_ids)
+        self.removed_ids.add(removed_stracks, self.frame_id)
         self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(
             self.tracked_stracks, self.lost_stracks
         )
+        # free the templates of tracks which are neither tracked nor lost anymore
+        live = set(map(id, self.tracked_stracks + self.lost_stracks))
+        for track in previous_stracks:
+            if id(track) not in live:
+                track.template = None
         # get scores of lost tracks
         output_stracks = [track for track in self.tracked_stracks if track.is_activated]
         self.last_img = img
@@ -550,8 +580,10 @@ def sub_stracks(tlista, tlistb):
 
 
 def remove_duplicate_stracks(stracksa, stracksb):
-    pdist = matching.iou_distance(stracksa, stracksb)
-    pairs = np.where(pdist < 0.05)
+    # only overlapping pairs can be duplicates
+    p, q, ious = BoxIndex([t.tlbr for t in stracksb]).ious([t.tlbr for t in stracksa])
+    dup = 1 - ious < 0.05
+    pairs = p[dup], q[dup]
     dupa, dupb = list(), list()
     for p, q in zip(*pairs):
         timep = stracksa[p].frame_id - stracksa[p].start_frame
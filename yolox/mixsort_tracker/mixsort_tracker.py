@@ -11,7 +11,14 @@ from torch.utils.tensorboard import SummaryWriter
 
 from .kalman_filter import KalmanFilter
 from . import matching
-from .basetrack import BaseTrack, TrackState
+from yolox.tracking_utils.mixformer_backend import build_network
+from .basetrack import BaseTrack, RemovedTracks, TrackState, sub_removed
+from .track_table import TrackTable, Column, slots_of, ids_of
+from yolox.tracking_utils.roi_crop import ROICropper
+from yolox.tracking_utils.heatmap import heatmap_scores, gather_similarity
+from yolox.tracking_utils.gate import ambiguous_pairs, torch_ambiguous_pairs
+from yolox.tracking_utils.spatial_index import BoxIndex
+from yolox.tracking_utils.assignment import LinearAssignment
 from MixViT.lib.models.mixformer_vit import build_mixformer_deit
 from MixViT.lib.train.data.processing import MixformerProcessing as MP
 from MixViT.lib.train.data.transforms import Transform, ToTensor, Normalize
@@ -24,52 +31,78 @@ from typing import List, Union, Tuple
 
 
 class STrack(BaseTrack):
-    shared_kalman = KalmanFilter()
+    """A detection, or a track once activated.
+
+    The Kalman state and bookkeeping of activated tracks live in a row of the tracker's
+    `TrackTable`, the attributes below are views of that row.
+    """
+
+    track_id = Column("track_id", 0)
+    state = Column("state", TrackState.New)
+    is_activated = Column("is_activated", False)
+    score = Column("score", 0)
+    start_frame = Column("start_frame", 0)
+    frame_id = Column("frame_id", 0)
+    tracklet_len = Column("tracklet_len", 0)
 
     def __init__(self, tlwh, score, iou):
 
         # wait activate
+        self.table = None
+        self.slot = None
         self._tlwh = np.asarray(tlwh, dtype=np.float)
-        self.kalman_filter = None
-        self.mean, self.covariance = None, None
         self.is_activated = False
         self.template = None
+        # per-block template keys/values, filled lazily by MIXTracker.cache_templates
+        self.template_kv = None
         self._iou = iou
+        # row of the detection in the device tensors of its frame, with torch_assoc
+        self.det_index = None
 
         self.score = score
         self.tracklet_len = 0
 
+    @property
+    def mean(self):
+        return None if self.slot is None else self.table.mean[self.slot]
+
+    @property
+    def covariance(self):
+        return None if self.slot is None else self.table.covariance[self.slot]
+
+    def attach(self, table):
+        """take a slot of `table`, moving the attributes stored on the object into it"""
+        values = {name: getattr(self, name) for name in table.columns}
+        self.table = table
+        self.id_allocator = table.ids
+        self.slot = table.allocate(self)
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def detach(self):
+        """free the slot & template of a track no longer tracked, keeping its last values"""
+        self._tlwh = self.tlwh
+        values = {name: getattr(self, name) for name in self.table.columns}
+        self.table.release(self.slot)
+        self.slot = None
+        self.__dict__.update(values)
+        self.set_template(None)
+
     def predict(self):
-        mean_state = self.mean.copy()
-        if self.state != TrackState.Tracked:
-            mean_state[7] = 0
-        self.mean, self.covariance = self.kalman_filter.predict(
-            mean_state, self.covariance
-        )
+        self.table.predict(np.array([self.slot]))
 
     @staticmethod
     def multi_predict(stracks):
         if len(stracks) > 0:
-            multi_mean = np.asarray([st.mean.copy() for st in stracks])
-            multi_covariance = np.asarray([st.covariance for st in stracks])
-            for i, st in enumerate(stracks):
-                if st.state != TrackState.Tracked:
-                    multi_mean[i][7] = 0
-            multi_mean, multi_covariance = STrack.shared_kalman.multi_predict(
-                multi_mean, multi_covariance
-            )
-            for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
-                stracks[i].mean = mean
-                stracks[i].covariance = cov
+            stracks[0].table.predict(slots_of(stracks))
 
-    def activate(self, kalman_filter, frame_id, template):
+    def activate(self, table, frame_id, template=None):
         """Start a new tracklet"""
-        self.kalman_filter = kalman_filter
+        self.attach(table)
         self.track_id = self.next_id()
-        self.mean, self.covariance = self.kalman_filter.initiate(
-            self.tlwh_to_xyah(self._tlwh)
-        )
-        self.template = template
+        table.initiate([self.slot], [self._tlwh])
+        if template is not None:
+            self.set_template(template)
 
         self.tracklet_len = 0
         self.state = TrackState.Tracked
@@ -80,19 +113,14 @@ class STrack(BaseTrack):
         self.start_frame = frame_id
 
     def re_activate(self, new_track, frame_id, new_id=False, template=None):
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_track.tlwh)
+        self.table.update(
+            np.array([self.slot]), new_track.tlwh[None], new_track.score, frame_id, True
         )
-        self.tracklet_len = 0
-        self.state = TrackState.Tracked
-        self.is_activated = True
-        self.frame_id = frame_id
         if new_id:
             self.track_id = self.next_id()
-        self.score = new_track.score
 
         if template is not None:
-            self.template = template
+            self.set_template(template)
 
     def update(self, new_track, frame_id, template=None):
         """
@@ -102,20 +130,17 @@ class STrack(BaseTrack):
         :type update_feature: bool
         :return:
         """
-        self.frame_id = frame_id
-        self.tracklet_len += 1
-
-        new_tlwh = new_track.tlwh
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_tlwh)
+        self.table.update(
+            np.array([self.slot]), new_track.tlwh[None], new_track.score, frame_id, False
         )
-        self.state = TrackState.Tracked
-        self.is_activated = True
-
-        self.score = new_track.score
 
         if template is not None:
-            self.template = template
+            self.set_template(template)
+
+    def set_template(self, template):
+        """replace the normalized template crop and invalidate its cached feature"""
+        self.template = template
+        self.template_kv = None
 
     @property
     # @jit(nopython=True)
@@ -123,12 +148,9 @@ class STrack(BaseTrack):
         """Get current position in bounding box format `(top left x, top left y,
         width, height)`.
         """
-        if self.mean is None:
+        if self.slot is None:
             return self._tlwh.copy()
-        ret = self.mean[:4].copy()
-        ret[2] *= ret[3]
-        ret[:2] -= ret[2:] / 2
-        return ret
+        return self.table.tlwh([self.slot])[0]
 
     @property
     # @jit(nopython=True)
@@ -172,11 +194,104 @@ class STrack(BaseTrack):
         return "OT_{}_({}-{})".format(self.track_id, self.start_frame, self.end_frame)
 
 
+class SearchContext(object):
+    """Per-frame association context of MIXTracker.
+
+    Holds the similarity scores of every track's search region for the current frame, so
+    that all association passes of `MIXTracker.update` only index into them with their own
+    detection subsets instead of cropping and running MixFormer again. Tracks are encoded
+    in batches on first request, or all at once with `encode`.
+
+    With `torch_assoc`, it also holds the boxes & scores of the detections on the device,
+    the detections index them by `STrack.det_index`.
+    """
+
+    def __init__(self, tracker, img, det_boxes=None, det_scores=None):
+        """
+        :param tracker: MIXTracker owning the network and the cropper
+        :param img: torch.Tensor, current image
+        :param det_boxes: torch.Tensor (N, 4) | None, tlbr of the detections of the frame
+        :param det_scores: torch.Tensor (N,) | None, their scores
+        """
+        self.tracker = tracker
+        self.img = img
+        self.det_boxes = det_boxes
+        self.det_scores = det_scores
+        self.search_size = tracker.cropper.output_sz["search"]
+        # track_id -> (scores (H, W) on the network's device, search region (3,))
+        self.rows = {}
+
+    def encode(self, stracks):
+        """
+        Encode the search regions of the tracks not seen yet in one batch.
+        :type stracks: list[STrack], already predicted for the current frame
+        """
+        new = [t for t in stracks if t.track_id not in self.rows]
+        if len(new) == 0:
+            return
+        self.add(new, *self.tracker.encode_search(new, self.img))
+
+    def add(self, stracks, scores, regions):
+        """
+        Store already encoded search regions, e.g. encoded together with other trackers.
+        :type stracks: list[STrack]
+        :param scores: torch.Tensor (m, H, W) from `heatmap_scores`
+        :param regions: np.ndarray (m, 3), search regions
+        """
+        for strack, score, region in zip(stracks, scores, regions):
+            self.rows[strack.track_id] = (score, region)
+
+    def similarity(self, stracks, dets, host=True):
+        """
+        :type stracks: list[STrack]
+        :type dets: list[STrack]
+        :param host: see `gather_similarity`
+
+        :rtype vit np.ndarray | torch.Tensor, len(stracks) x len(dets)
+        """
+        if len(stracks) * len(dets) == 0:
+            if not host:
+                return torch.zeros(
+                    (len(stracks), len(dets)), dtype=torch.float64, device=self.img.device
+                )
+            return np.zeros((len(stracks), len(dets)), dtype=np.float64)
+
+        self.encode(stracks)
+        scores, regions = zip(*[self.rows[t.track_id] for t in stracks])
+        search_boxes = self.tracker.cropper.transform(
+            np.stack([det.tlwh.astype(np.int) for det in dets]),
+            np.stack(regions),
+            "search",
+        )
+        return gather_similarity(torch.stack(scores), search_boxes, self.search_size, host)
+
+
+class FrameState(object):
+    """Detections & track pools of a frame, from `MIXTracker.prepare` to `MIXTracker.associate`."""
+
+    def __init__(
+        self, img, detections, detections_second, strack_pool, unconfirmed, all_stracks, context
+    ):
+        self.img = img
+        self.detections = detections  # type: list[STrack]
+        self.detections_second = detections_second  # type: list[STrack]
+        self.strack_pool = strack_pool  # type: list[STrack]
+        self.unconfirmed = unconfirmed  # type: list[STrack]
+        self.all_stracks = all_stracks  # type: list[STrack]
+        self.context = context  # type: SearchContext
+
+
 class MIXTracker(object):
-    def __init__(self, args, frame_rate=30):
+    def __init__(self, args, frame_rate=30, network=None):
+        """
+        Args:
+            args: tracking arguments
+            frame_rate (int, optional): frame rate of the video. Defaults to 30.
+            network (optional): loaded MixFormer shared with other trackers, built from
+                `args` if not given. Defaults to None.
+        """
         self.tracked_stracks = []  # type: list[STrack]
         self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
 
         self.frame_id = 0
         self.args = args
@@ -184,12 +299,23 @@ class MIXTracker(object):
         self.det_thresh = args.track_thresh + 0.1
         self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
+        # ids of the removed tracks, the tracks themselves are dropped
+        self.removed_ids = RemovedTracks(int(frame_rate / 30.0 * args.removed_buffer))
         self.kalman_filter = KalmanFilter()
+        self.assignment = LinearAssignment()
+        # track states & ids, a new table restarts the ids for a new video
+        self.tracks = TrackTable(self.kalman_filter)
 
         self.last_img = None
         self.alpha = args.alpha
         self.radius = args.radius
         self.iou_thresh = args.iou_thresh
+        # only run MixFormer for pairs that IoU can not decide
+        self.vit_gate = args.vit_gate
+        self.gate_iou = args.gate_iou
+        self.gate_margin = args.gate_margin
+        # keep detections & cost matrices on the device, only the costs go to the solver
+        self.torch_assoc = args.torch_assoc
 
         # mixformer setting & cfg
         # adapted from lib/train/run_training.py & train_script_mixformer.py
@@ -208,17 +334,18 @@ class MIXTracker(object):
         self.cfg = config_module.cfg
         config_module.update_config_from_file(self.settings.cfg_file)
         update_settings(self.settings, self.cfg)
+        self.cropper = ROICropper(self.settings, self.cfg.DATA.MEAN, self.cfg.DATA.STD)
+        # number of track/detection pairs scored & pairs left to IoU by the gate
+        self.vit_pairs = 0
+        self.vit_pairs_skipped = 0
 
-        # need modification, for distributed
-        network = build_mixformer_deit(self.cfg)
-        self.network = network.cuda(torch.device(f"cuda:{args.local_rank}"))
-        self.network.eval()
+        if network is None:
+            network = build_network(args, self.cfg)
+        self.network = network
 
     def re_init(self, args, frame_rate=30):
-        BaseTrack._count = 0 # set to 0 for new video
         self.tracked_stracks = []  # type: list[STrack]
         self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
 
         self.frame_id = 0
         self.args = args
@@ -226,12 +353,41 @@ class MIXTracker(object):
         self.det_thresh = args.track_thresh + 0.1
         self.buffer_size = int(frame_rate / 30.0 * args.track_buffer)
         self.max_time_lost = self.buffer_size
+        # ids of the removed tracks, the tracks themselves are dropped
+        self.removed_ids = RemovedTracks(int(frame_rate / 30.0 * args.removed_buffer))
         self.kalman_filter = KalmanFilter()
+        # track states & ids, a new table restarts the ids for a new video
+        self.tracks = TrackTable(self.kalman_filter)
 
         self.last_img = None
         self.alpha = args.alpha
         self.radius = args.radius
         self.iou_thresh = args.iou_thresh
+        # only run MixFormer for pairs that IoU can not decide
+        self.vit_gate = args.vit_gate
+        self.gate_iou = args.gate_iou
+        self.gate_margin = args.gate_margin
+        # keep detections & cost matrices on the device, only the costs go to the solver
+        self.torch_assoc = args.torch_assoc
+
+    @property
+    def vit_skip_ratio(self):
+        """fraction of track/detection pairs whose MixFormer similarity was skipped"""
+        return self.vit_pairs_skipped / max(self.vit_pairs, 1)
+
+    @property
+    def memory_usage(self):
+        """number of tracked & lost tracks, removed track ids held, and bytes of the templates
+        & cached template features of the tracks"""
+        stracks = self.tracked_stracks + self.lost_stracks
+        tensors = [s.template for s in stracks] + [s.template_kv for s in stracks]
+        return {
+            "tracks": len(stracks),
+            "removed_ids": len(self.removed_ids),
+            "template_bytes": sum(
+                t.element_size() * t.nelement() for t in tensors if t is not None
+            ),
+        }
 
     def visualize(self, logger: SummaryWriter, template, search, search_box):
         # utils for debugging
@@ -244,136 +400,119 @@ class MIXTracker(object):
         # utils for debugging
         logger.add_image_with_boxes(name, img, np.array([s.tlbr for s in dets]),labels=[str(i) for i in range(len(dets))])
 
-    def crop_and_resize(
-        self, img: torch.Tensor, center: np.ndarray, s: str, annos: torch.Tensor = None
-    ) -> Union[Tuple[torch.Tensor, torch.Tensor], torch.Tensor]:
-        """crop&resize the `img` centered at `center` and transform `annos` to the cropped position.
+    @torch.no_grad()
+    def crop_templates(self, img: torch.Tensor, stracks: List[STrack], boxes: List[np.ndarray]):
+        """crop the templates of `stracks` at `boxes` in one call and assign them.
 
         Args:
-            img (torch.Tensor): image to be cropped
-            center (np.ndarray): center coord
-            s (str): 'template' or 'search'
-            annos (torch.Tensor, optional): boxes to be transformed. Defaults to None.
+            img (torch.Tensor): current image
+            stracks (List[STrack]): tracks whose template is replaced
+            boxes (List[np.ndarray]): tlwh of the new templates, one per strack
+        """
+        if len(stracks) == 0:
+            return
+        templates, _ = self.cropper.crop(img, np.stack(boxes), "template")
+        for strack, template in zip(stracks, templates):
+            strack.set_template(template)
 
-        Returns:
-            Union[Tuple[torch.Tensor,torch.Tensor],torch.Tensor]: transfromed image (and boxes)
+    @torch.no_grad()
+    def cache_templates(self, stracks: List[STrack]):
+        """encode the templates of `stracks` whose cached template feature is stale.
+
+        Template tokens only attend to each other in MixFormer, so their per-block keys/values
+        stay valid until `STrack.template` is replaced.
+
+        Args:
+            stracks (List[STrack]): tracks to be checked
         """
-        # compute params
-        center = torch.from_numpy(center.astype(np.int))
-        search_area_factor = self.settings.search_area_factor[s]
-        output_sz = self.settings.output_sz[s]
-        x, y, w, h = [int(i) for i in center]
-        crop_sz = math.ceil(math.sqrt(w * h) * search_area_factor)
-
-        # x:left, y:top
-        x = int(round(x + 0.5 * w - crop_sz * 0.5))
-        y = int(round(y + 0.5 * h - crop_sz * 0.5))
-
-        try:
-            resized_img = resized_crop(
-                img, y, x, crop_sz, crop_sz, [output_sz, output_sz]
-            )
-        except:  # too small box
-            zero_img = torch.zeros((3, output_sz, output_sz)).cuda()
-            return zero_img if annos is None else zero_img, []
-
-        if annos is not None:
-            # (origin_x - x, origin_y - y, origin_w, origin_h)/factor
-            transforemd_coord = torch.cat(
-                (annos[:, 0:2] - torch.tensor([x, y]), annos[:, 2:4]), dim=1
-            )
-            return resized_img, transforemd_coord / (crop_sz / output_sz)
-        else:
-            return resized_img
+        stale = [s for s in stracks if s.template_kv is None]
+        if len(stale) == 0:
+            return
+        template_kv = self.network.forward_template(torch.stack([s.template for s in stale]))
+        for strack, kv in zip(stale, template_kv):
+            strack.template_kv = kv
 
     @torch.no_grad()
+    def encode_search(
+        self, stracks: List[STrack], img: torch.Tensor
+    ) -> Tuple[torch.Tensor, np.ndarray]:
+        """crop the search region of every track and compute its similarity scores.
+
+        Must be called after the tracks are predicted for the current frame, the search
+        region is centered at the predicted position.
+
+        Args:
+            stracks (List[STrack]): tracks to be encoded, len = m
+            img (torch.Tensor): current image
+
+        Returns:
+            Tuple[torch.Tensor, np.ndarray]: (m, H, W) scores on the network's device and
+                (m, 3) search regions
+        """
+        # centered at predicted position
+        search_imgs, regions = self.cropper.crop(
+            img, self.tracks.tlwh(slots_of(stracks)), "search"
+        )
+        # templates come from the per-track cache
+        self.cache_templates(stracks)
+        template_kv = torch.stack([s.template_kv for s in stracks])
+        heatmap = self.network.forward_search(search_imgs, template_kv)
+        # normalized & averaged over radius, kept on device until the lookup
+        return heatmap_scores(heatmap, self.radius), regions
+
     def compute_mix_dist(
         self,
         stracks: List[STrack],
         dets: List[STrack],
-        img: torch.Tensor,
+        context: SearchContext,
         fuse: bool = False,
     ) -> np.ndarray:
         """compute mix distance between stracks and dets.
 
+        With `vit_gate`, MixFormer only scores the ambiguous pairs, see `ambiguous_pairs`,
+        the other pairs keep their IoU cost.
+
         Args:
-            stracks (List[STrack]): len = m
+            stracks (List[STrack]): len = m, already predicted for the current frame
             dets (List[STrack]): len = n
-            img (torch.Tensor): current image
+            context (SearchContext): search regions of the current frame
             fuse (bool, optional): whether to fuse det score into iou. Defaults to False.
 
         Returns:
             np.ndarray: m x n
         """
-
-        # Predict the current location with KF
-        STrack.multi_predict(stracks)
-        # compute iou dist
-        iou = matching.iou_distance(stracks, dets)
+        if self.torch_assoc:
+            return self.compute_mix_dist_torch(stracks, dets, context, fuse)
+        # compute iou dist, track boxes come from the track table in one view
+        iou = matching.iou_distance(
+            self.tracks.tlbr(slots_of(stracks)),
+            np.array([det.tlbr for det in dets]).reshape(-1, 4),
+        )
+        if self.vit_gate:
+            mask = ambiguous_pairs(1 - iou, self.gate_iou, self.gate_margin)
+        else:
+            mask = np.ones(iou.shape, dtype=bool)
         if fuse:
             iou = matching.fuse_score(iou, dets)
 
         if len(stracks) * len(dets) == 0:
             return iou
 
-        # for every strack, compute its vit-dist with dets
-        search_bbox = torch.stack(
-            [torch.from_numpy(det.tlwh.astype(np.int)) for det in dets]
-        )
-        search_imgs = []
-        search_boxes = []
-        # vit dist
+        self.vit_pairs += mask.size
+        self.vit_pairs_skipped += mask.size - int(mask.sum())
+
+        # vit dist, skipped pairs keep their iou cost
         # self.logger=SummaryWriter('./debug_tensorboard')
-        # self.visualize(self.logger,template_imgs[0],search_img,search_box.clone())
         # self.visualize_box(self.logger,img,stracks,"stracks")
         # self.visualize_box(self.logger,img,dets,"dets")
-        vit = np.zeros((len(stracks), len(dets)), dtype=np.float64)
-        template_imgs = [s.template for s in stracks]
-        for strack in stracks:
-            # centered at predicted position
-            center = strack.tlwh
-            # crop search area & transform det coord
-            s_img, s_box = self.crop_and_resize(img, center, "search", search_bbox)
-            search_imgs.append(s_img)
-            search_boxes.append(s_box)
-
-        # img transform & compute
-        template_imgs = normalize(
-            torch.stack(template_imgs).float().div(255),
-            self.cfg.DATA.MEAN,
-            self.cfg.DATA.STD,
-        )
-        search_imgs = normalize(
-            torch.stack(search_imgs).float().div(255),
-            self.cfg.DATA.MEAN,
-            self.cfg.DATA.STD,
-        )
-        heatmap = self.network(template_imgs, search_imgs).cpu().detach().numpy()
-        # linear transform to [0,1]
-        for i in range(heatmap.shape[0]):
-            heatmap[i][0] = heatmap[i][0] - heatmap[i][0].min()
-            heatmap[i][0] = heatmap[i][0] / heatmap[i][0].max()
-
-        # compute similarity
-        search_size = s_img[0].shape[-1]
-        heatmap_size = heatmap.shape[-1]
-        factor = search_size // heatmap_size
-        for i, boxes in enumerate(search_boxes):
-            # correspond to strack[i]
-            for j, (t, l, w, h) in enumerate(boxes):
-                cx, cy = t + w / 2, l + h / 2
-                # don't consider outsiders
-                if cx > 0 and cy > 0 and cx < search_size and cy < search_size:
-                    cx, cy = int(cx) // factor, int(cy) // factor
-                    top = max(0, cy - self.radius)
-                    bottom = min(heatmap_size, cy + self.radius + 1)
-                    left = max(0, cx - self.radius)
-                    right = min(heatmap_size, cx + self.radius + 1)
-                    vit[i][j] = heatmap[i][0][top:bottom, left:right].mean()
-                    # vit[i][j] = heatmap[i][0][cy][cx]
+        vit_dist = iou.copy()
+        rows = np.where(mask.any(axis=1))[0]
+        if len(rows) > 0:
+            vit = context.similarity([stracks[i] for i in rows], dets)
+            vit_dist[rows] = np.where(mask[rows], 1 - vit, iou[rows])
 
         # fuse iou&vit cost
-        return self.alpha * iou + (1 - self.alpha) * (1 - vit)
+        return self.alpha * iou + (1 - self.alpha) * vit_dist
         # if iou.min()<self.args.fuse_iou_thresh:
         #     return iou
         # else:
@@ -385,33 +524,119 @@ class MIXTracker(object):
         #             iou[i][j]=vit[i][j]
         # return iou
 
+    def compute_mix_dist_torch(
+        self,
+        stracks: List[STrack],
+        dets: List[STrack],
+        context: SearchContext,
+        fuse: bool = False,
+    ) -> np.ndarray:
+        """`compute_mix_dist` on the device of the detections, with `torch_assoc`.
+
+        IoU, score fusion, gate & blend run on the device tensors of `context`, only the
+        track boxes are uploaded and only the final cost matrix is copied to the host. The
+        costs are float32, so they may differ from `compute_mix_dist` in the last bits.
+
+        Args:
+            stracks (List[STrack]): len = m, already predicted for the current frame
+            dets (List[STrack]): len = n, detections of `context`'s frame
+            context (SearchContext): search regions & detections of the current frame
+            fuse (bool, optional): whether to fuse det score into iou. Defaults to False.
+
+        Returns:
+            np.ndarray: m x n
+        """
+        rows = torch.as_tensor(
+            [det.det_index for det in dets], dtype=torch.long, device=context.det_boxes.device
+        )
+        det_boxes = context.det_boxes[rows]
+        track_boxes = torch.as_tensor(
+            self.tracks.tlbr(slots_of(stracks)).reshape(-1, 4),
+            dtype=det_boxes.dtype,
+            device=det_boxes.device,
+        )
+        iou = 1 - matching.torch_ious(track_boxes, det_boxes)
+        if self.vit_gate:
+            mask = torch_ambiguous_pairs(1 - iou, self.gate_iou, self.gate_margin)
+        if fuse:
+            iou = matching.torch_fuse_score(iou, context.det_scores[rows])
+
+        if len(stracks) * len(dets) == 0:
+            return iou.double().cpu().numpy()
+
+        if self.vit_gate:
+            # the only sync before the final copy, to know which tracks to score
+            scored = mask.sum(dim=1).cpu().numpy()
+            track_rows = np.nonzero(scored)[0]
+            self.vit_pairs += mask.numel()
+            self.vit_pairs_skipped += mask.numel() - int(scored.sum())
+        else:
+            track_rows = np.arange(len(stracks))
+            self.vit_pairs += iou.numel()
+
+        # vit dist, skipped pairs keep their iou cost
+        vit_dist = iou.clone()
+        if len(track_rows) > 0:
+            vit = context.similarity([stracks[i] for i in track_rows], dets, host=False)
+            vit = vit.to(iou.dtype)
+            index = torch.as_tensor(track_rows, device=iou.device)
+            if self.vit_gate:
+                vit_dist[index] = torch.where(mask[index], 1 - vit, iou[index])
+            else:
+                vit_dist = 1 - vit
+
+        # fuse iou&vit cost
+        return (self.alpha * iou + (1 - self.alpha) * vit_dist).double().cpu().numpy()
+
     def update(self, output_results, img_info, img_size, img):
+        frame = self.prepare(output_results, img_info, img_size, img)
+        if not self.vit_gate:
+            # every track is scored, encode all of them in one batch
+            frame.context.encode(self.search_candidates(frame))
+        return self.associate(frame)
+
+    def prepare(self, output_results, img_info, img_size, img) -> "FrameState":
+        """split the detections of a new frame and predict every track.
+
+        First half of `update`, search regions can be encoded between `prepare` and
+        `associate`, e.g. pooled with other trackers by `MultiStreamEngine`.
+
+        Returns:
+            FrameState: detections & track pools of the frame
+        """
         self.frame_id += 1
-        activated_starcks = []
-        refind_stracks = []
-        lost_stracks = []
-        removed_stracks = []
 
-        if output_results.shape[1] == 5:
-            scores = output_results[:, 4]
-            bboxes = output_results[:, :4]
-        else:
-            output_results = output_results.cpu().numpy()
-            scores = output_results[:, 4] * output_results[:, 5]
-            bboxes = output_results[:, :4]  # x1y1x2y2
         img_h, img_w = img_info[0], img_info[1]
         scale = min(img_size[0] / float(img_h), img_size[1] / float(img_w))
-        bboxes /= scale
-
-        # compute all ious
-        all_dets = [x for x in bboxes]
-        iou = matching.ious(all_dets, all_dets)
-        # compute max iou for every det
-        max_iou = []
-        for i in range(len(all_dets)):
-            iou[i][i] = 0
-            max_iou.append(iou[i].max())
-        max_iou = np.array(max_iou)
+        if self.torch_assoc:
+            device = output_results.device if torch.is_tensor(output_results) else img.device
+            output_results = torch.as_tensor(output_results, device=device).float()
+            if output_results.shape[1] == 5:
+                dev_scores = output_results[:, 4]
+            else:
+                dev_scores = output_results[:, 4] * output_results[:, 5]
+            dev_bboxes = output_results[:, :4] / scale  # x1y1x2y2
+            # compute max iou for every det
+            dev_max_iou = output_results.new_zeros(len(output_results))
+            if len(output_results) > 0:
+                dev_max_iou = matching.torch_ious(dev_bboxes, dev_bboxes)
+                dev_max_iou = dev_max_iou.fill_diagonal_(0).max(dim=1)[0]
+            # the tracks are kept on the host, one copy for all of them
+            host = torch.cat((dev_bboxes, dev_scores[:, None], dev_max_iou[:, None]), dim=1)
+            host = host.cpu().numpy()
+            bboxes, scores, max_iou = host[:, :4], host[:, 4], host[:, 5]
+        else:
+            if output_results.shape[1] == 5:
+                scores = output_results[:, 4]
+                bboxes = output_results[:, :4]
+            else:
+                output_results = output_results.cpu().numpy()
+                scores = output_results[:, 4] * output_results[:, 5]
+                bboxes = output_results[:, :4]  # x1y1x2y2
+            bboxes /= scale
+
+            # compute max iou for every det
+            max_iou = BoxIndex(bboxes).max_iou()
 
         remain_inds = scores > self.args.track_thresh
         inds_low = scores > 0.1
@@ -434,6 +659,15 @@ class MIXTracker(object):
         else:
             detections = []
 
+        if len(dets_second) > 0:
+            """Detections"""
+            detections_second = [
+                STrack(STrack.tlbr_to_tlwh(tlbr), s, u)
+                for (tlbr, s, u) in zip(dets_second, scores_second, max_iou_second)
+            ]
+        else:
+            detections_second = []
+
         """ Add newly detected tracklets to tracked_stracks"""
         unconfirmed = []
         tracked_stracks = []  # type: list[STrack]
@@ -443,63 +677,119 @@ class MIXTracker(object):
             else:
                 tracked_stracks.append(track)
 
-        """ Step 2: First association, with high score detection boxes"""
         strack_pool = joint_stracks(tracked_stracks, self.lost_stracks)
-        dists = self.compute_mix_dist(strack_pool, detections, img, fuse=True)
+        # Predict the current location with KF, once per frame for every track
+        all_stracks = joint_stracks(strack_pool, unconfirmed)
+        self.tracks.predict(slots_of(all_stracks))
+        # search regions are encoded once, shared by all association passes
+        if self.torch_assoc:
+            # the device rows of the detections, in the order of detections + detections_second
+            order = np.concatenate((np.nonzero(remain_inds)[0], np.nonzero(inds_second)[0]))
+            for i, det in enumerate(detections + detections_second):
+                det.det_index = i
+            order = torch.as_tensor(order, device=dev_bboxes.device)
+            context = SearchContext(self, img, dev_bboxes[order], dev_scores[order])
+        else:
+            context = SearchContext(self, img)
+        return FrameState(
+            img, detections, detections_second, strack_pool, unconfirmed, all_stracks, context
+        )
+
+    def search_candidates(self, frame: "FrameState") -> List[STrack]:
+        """tracks whose search region may be scored by the association passes of `frame`.
+
+        Without `vit_gate` every track is scored. With it, only tracks which overlap a
+        detection by more than `gate_iou` can be part of an ambiguous pair.
+
+        Args:
+            frame (FrameState): from `prepare`
+
+        Returns:
+            List[STrack]: tracks to be encoded
+        """
+        dets = frame.detections + frame.detections_second
+        if len(dets) == 0 or len(frame.all_stracks) == 0:
+            return []
+        if not self.vit_gate:
+            return frame.all_stracks
+        iou = 1 - matching.iou_distance(
+            self.tracks.tlbr(slots_of(frame.all_stracks)),
+            np.array([det.tlbr for det in dets]),
+        )
+        overlap = (iou > self.gate_iou).any(axis=1)
+        return [t for t, o in zip(frame.all_stracks, overlap) if o]
+
+    def associate(self, frame: "FrameState") -> List[STrack]:
+        """run the association passes of `frame` and update the track lists.
+
+        Second half of `update`, tracks not encoded in `frame.context` yet are encoded
+        on demand.
+
+        Returns:
+            List[STrack]: activated tracks of the frame
+        """
+        img = frame.img
+        detections = frame.detections
+        detections_second = frame.detections_second
+        strack_pool = frame.strack_pool
+        unconfirmed = frame.unconfirmed
+        context = frame.context
+
+        activated_starcks = []
+        refind_stracks = []
+        lost_stracks = []
+        removed_stracks = []
+        # tracks getting a new template & where to crop it, cropped in one batch at the end
+        template_stracks = []
+        template_boxes = []
+        # matched tracks & detections, the Kalman update is done in one batch after matching
+        matched_stracks = []
+        matched_dets = []
+
+        """ Step 2: First association, with high score detection boxes"""
+        dists = self.compute_mix_dist(strack_pool, detections, context, fuse=True)
         # if not self.args.mot20:
         #     dists = matching.fuse_score(dists, detections)
         matches, u_track, u_detection = matching.linear_assignment(
-            dists, thresh=self.args.match_thresh
+            dists, thresh=self.args.match_thresh, solver=self.assignment
         )
 
         for itracked, idet in matches:
             track = strack_pool[itracked]
             det = detections[idet]
-            template = (
-                self.crop_and_resize(img, det.tlwh, "template")
-                if det._iou < self.iou_thresh
-                else None
-            )
+            if det._iou < self.iou_thresh:
+                template_stracks.append(track)
+                template_boxes.append(det.tlwh)
+            matched_stracks.append(track)
+            matched_dets.append(det)
             if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id, template)
                 activated_starcks.append(track)
             else:
-                track.re_activate(det, self.frame_id, new_id=False, template=template)
                 refind_stracks.append(track)
 
         """ Step 3: Second association, with low score detection boxes"""
         # association the untrack to the low score detections
-        if len(dets_second) > 0:
-            """Detections"""
-            detections_second = [
-                STrack(STrack.tlbr_to_tlwh(tlbr), s, u)
-                for (tlbr, s, u) in zip(dets_second, scores_second, max_iou_second)
-            ]
-        else:
-            detections_second = []
         r_tracked_stracks = [
             strack_pool[i]
             for i in u_track
             if strack_pool[i].state == TrackState.Tracked
         ]
         # dists = matching.iou_distance(r_tracked_stracks, detections_second)
-        dists = self.compute_mix_dist(r_tracked_stracks, detections_second, img)
+        dists = self.compute_mix_dist(r_tracked_stracks, detections_second, context)
         matches, u_track, u_detection_second = matching.linear_assignment(
-            dists, thresh=0.5
+            dists, thresh=0.5, solver=self.assignment
         )
         for itracked, idet in matches:
             track = r_tracked_stracks[itracked]
             det = detections_second[idet]
-            template = (
-                self.crop_and_resize(img, det.tlwh, "template")
-                if det._iou < self.iou_thresh
-                else None
-            )
+            if det._iou < self.iou_thresh:
+                template_stracks.append(track)
+                template_boxes.append(det.tlwh)
+            matched_stracks.append(track)
+            matched_dets.append(det)
             if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id, template)
                 activated_starcks.append(track)
             else:
-                track.re_activate(det, self.frame_id, new_id=False, template=template)
                 refind_stracks.append(track)
 
         for it in u_track:
@@ -510,39 +800,50 @@ class MIXTracker(object):
 
         """Deal with unconfirmed tracks, usually tracks with only one beginning frame"""
         detections = [detections[i] for i in u_detection]
-        dists = self.compute_mix_dist(unconfirmed, detections, img, fuse=True)
+        dists = self.compute_mix_dist(unconfirmed, detections, context, fuse=True)
         # dists = matching.iou_distance(unconfirmed, detections)
         # if not self.args.mot20:
         #     dists = matching.fuse_score(dists, detections)
         matches, u_unconfirmed, u_detection = matching.linear_assignment(
-            dists, thresh=0.7
+            dists, thresh=0.7, solver=self.assignment
         )
         for itracked, idet in matches:
             det = detections[idet]
-            template = (
-                self.crop_and_resize(img, det.tlwh, "template")
-                if det._iou < self.iou_thresh
-                else None
-            )
-            unconfirmed[itracked].update(detections[idet], self.frame_id, template)
+            if det._iou < self.iou_thresh:
+                template_stracks.append(unconfirmed[itracked])
+                template_boxes.append(det.tlwh)
+            matched_stracks.append(unconfirmed[itracked])
+            matched_dets.append(det)
             activated_starcks.append(unconfirmed[itracked])
         for it in u_unconfirmed:
             track = unconfirmed[it]
             track.mark_removed()
             removed_stracks.append(track)
 
+        # update (tracked) & re-activate (lost) all matched tracks at once
+        if len(matched_stracks) > 0:
+            slots = slots_of(matched_stracks)
+            self.tracks.update(
+                slots,
+                np.stack([det.tlwh for det in matched_dets]),
+                np.array([det.score for det in matched_dets]),
+                self.frame_id,
+                refind=self.tracks.state[slots] != TrackState.Tracked,
+            )
+
         """ Step 4: Init new stracks"""
         for inew in u_detection:
             track = detections[inew]
             if track.score < self.det_thresh:
                 continue
             # do not consider iou constraint
-            track.activate(
-                self.kalman_filter,
-                self.frame_id,
-                self.crop_and_resize(img, track._tlwh, "template"),
-            )
+            template_stracks.append(track)
+            template_boxes.append(track._tlwh)
+            track.activate(self.tracks, self.frame_id)
             activated_starcks.append(track)
+        # templates are first used in the next frame, crop them all at once
+        self.crop_templates(img, template_stracks, template_boxes)
+
         """ Step 5: Update state"""
         for track in self.lost_stracks:
             if self.frame_id - track.end_frame > self.max_time_lost:
@@ -558,11 +859,13 @@ class MIXTracker(object):
         self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
         self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
         self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
+        self.lost_stracks = sub_removed(self.lost_stracks, self.removed_ids)
+        self.removed_ids.add(removed_stracks, self.frame_id)
         self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(
             self.tracked_stracks, self.lost_stracks
         )
+        # free the slots of tracks which are neither tracked nor lost anymore
+        self.tracks.collect(slots_of(self.tracked_stracks + self.lost_stracks))
         # get scores of lost tracks
         output_stracks = [track for track in self.tracked_stracks if track.is_activated]
         self.last_img = img
@@ -570,41 +873,36 @@ class MIXTracker(object):
 
 
 def joint_stracks(tlista, tlistb):
-    exists = {}
-    res = []
-    for t in tlista:
-        exists[t.track_id] = 1
-        res.append(t)
-    for t in tlistb:
-        tid = t.track_id
-        if not exists.get(tid, 0):
-            exists[tid] = 1
-            res.append(t)
-    return res
+    ids_a, ids_b = ids_of(tlista), ids_of(tlistb)
+    # first occurrence of every id of b which is not in a
+    _, first = np.unique(ids_b, return_index=True)
+    keep = np.zeros(len(tlistb), dtype=bool)
+    keep[first] = True
+    keep &= ~np.isin(ids_b, ids_a)
+    return tlista + [t for t, k in zip(tlistb, keep) if k]
 
 
 def sub_stracks(tlista, tlistb):
-    stracks = {}
-    for t in tlista:
-        stracks[t.track_id] = t
-    for t in tlistb:
-        tid = t.track_id
-        if stracks.get(tid, 0):
-            del stracks[tid]
-    return list(stracks.values())
+    keep = ~np.isin(ids_of(tlista), ids_of(tlistb))
+    return [t for t, k in zip(tlista, keep) if k]
 
 
 def remove_duplicate_stracks(stracksa, stracksb):
-    pdist = matching.iou_distance(stracksa, stracksb)
-    pairs = np.where(pdist < 0.05)
-    dupa, dupb = list(), list()
-    for p, q in zip(*pairs):
-        timep = stracksa[p].frame_id - stracksa[p].start_frame
-        timeq = stracksb[q].frame_id - stracksb[q].start_frame
-        if timep > timeq:
-            dupb.append(q)
-        else:
-            dupa.append(p)
-    resa = [t for i, t in enumerate(stracksa) if not i in dupa]
-    resb = [t for i, t in enumerate(stracksb) if not i in dupb]
+    if len(stracksa) * len(stracksb) == 0:
+        return stracksa, stracksb
+    slotsa, slotsb = slots_of(stracksa), slots_of(stracksb)
+    table = stracksa[0].table
+    # only overlapping pairs can be duplicates
+    p, q, ious = BoxIndex(table.tlbr(slotsb)).ious(table.tlbr(slotsa))
+    dup = 1 - ious < 0.05
+    p, q = p[dup], q[dup]
+    timep = table.frame_id[slotsa[p]] - table.start_frame[slotsa[p]]
+    timeq = table.frame_id[slotsb[q]] - table.start_frame[slotsb[q]]
+    # the younger track of every duplicate pair is dropped
+    keepa = np.ones(len(stracksa), dtype=bool)
+    keepb = np.ones(len(stracksb), dtype=bool)
+    keepa[p[timep <= timeq]] = False
+    keepb[q[timep > timeq]] = False
+    resa = [t for t, k in zip(stracksa, keepa) if k]
+    resb = [t for t, k in zip(stracksb, keepb) if k]
     return resa, resb
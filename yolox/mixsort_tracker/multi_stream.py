@@ -0,0 +1,172 @@
+import time
+from itertools import groupby
+from typing import Dict, List
+
+import torch
+
+from .mixsort_tracker import MIXTracker, STrack
+from .track_table import slots_of
+from yolox.tracking_utils.heatmap import heatmap_scores
+
+
+class MultiStreamEngine(object):
+    """Track many independent video streams with one MixFormer.
+
+    Every stream is a `MIXTracker` with its own tracks and ids, all of them share the network
+    of the engine. `update` prepares the frame of a stream and queues it. On every tick the
+    search regions of all queued frames are pooled and encoded in batches of at most
+    `max_batch`, then every stream runs its own association with its rows of the result.
+
+    A tick runs when every stream has a queued frame, when `max_batch` search regions are
+    waiting, or when the oldest queued frame waited longer than `deadline` seconds, which is
+    checked on `update` and `poll`.
+    """
+
+    def __init__(self, args, num_streams=0, max_batch=64, deadline=0.05, network=None):
+        """
+        Args:
+            args: tracking arguments, shared by all streams
+            num_streams (int, optional): number of streams to open. Defaults to 0.
+            max_batch (int, optional): max number of search regions per forward. Defaults to 64.
+            deadline (float, optional): max seconds a queued frame waits for other streams.
+                Defaults to 0.05.
+            network (optional): loaded MixFormer, built by the first stream if not given.
+                Defaults to None.
+        """
+        self.args = args
+        self.max_batch = max_batch
+        self.deadline = deadline
+        self.network = network
+        self.trackers = []  # type: list[MIXTracker]
+        # stream id -> (FrameState, tracks to encode, time the frame was queued)
+        self.pending = {}
+        for _ in range(num_streams):
+            self.add_stream()
+
+    def add_stream(self, frame_rate=30) -> int:
+        """open a new stream.
+
+        Returns:
+            int: id of the stream
+        """
+        tracker = MIXTracker(self.args, frame_rate, network=self.network)
+        self.network = tracker.network
+        self.trackers.append(tracker)
+        return len(self.trackers) - 1
+
+    def reset_stream(self, stream_id: int, frame_rate=30, args=None) -> Dict[int, List[STrack]]:
+        """start a new video on a stream, its queued frame is tracked first.
+
+        Args:
+            stream_id (int): stream of the new video
+            frame_rate (int, optional): frame rate of the new video. Defaults to 30.
+            args (optional): tracking arguments of the new video, e.g. with per-video
+                thresholds, the ones of the engine if None. Defaults to None.
+
+        Returns:
+            Dict[int, List[STrack]]: outputs of the frames tracked meanwhile, by stream id
+        """
+        done = self.flush() if stream_id in self.pending else {}
+        self.trackers[stream_id].re_init(self.args if args is None else args, frame_rate)
+        return done
+
+    @property
+    def waiting(self) -> int:
+        """number of search regions queued for the next tick"""
+        return sum(len(stracks) for _, stracks, _ in self.pending.values())
+
+    def expired(self) -> bool:
+        """whether the oldest queued frame waited longer than the deadline"""
+        if len(self.pending) == 0:
+            return False
+        oldest = min(queued for _, _, queued in self.pending.values())
+        return time.perf_counter() - oldest >= self.deadline
+
+    def update(
+        self, stream_id: int, output_results, img_info, img_size, img: torch.Tensor
+    ) -> Dict[int, List[STrack]]:
+        """queue the next frame of a stream, same inputs as `MIXTracker.update`.
+
+        Returns:
+            Dict[int, List[STrack]]: outputs of the frames tracked by this call, by stream id.
+                The frame just queued is only included if it triggered a tick.
+        """
+        done = {}
+        if stream_id in self.pending:
+            # frames of a stream are tracked in order
+            done.update(self.flush())
+        tracker = self.trackers[stream_id]
+        frame = tracker.prepare(output_results, img_info, img_size, img)
+        self.pending[stream_id] = (frame, tracker.search_candidates(frame), time.perf_counter())
+        if (
+            len(self.pending) == len(self.trackers)
+            or self.waiting >= self.max_batch
+            or self.expired()
+        ):
+            done.update(self.flush())
+        return done
+
+    def poll(self) -> Dict[int, List[STrack]]:
+        """run a tick if the oldest queued frame passed the deadline.
+
+        Returns:
+            Dict[int, List[STrack]]: outputs of the frames tracked, by stream id
+        """
+        return self.flush() if self.expired() else {}
+
+    def flush(self) -> Dict[int, List[STrack]]:
+        """encode & associate all queued frames now.
+
+        Returns:
+            Dict[int, List[STrack]]: outputs of the frames tracked, by stream id
+        """
+        pending, self.pending = self.pending, {}
+        jobs = [(stream_id, frame, stracks) for stream_id, (frame, stracks, _) in pending.items()]
+        self.encode(jobs)
+        return {
+            stream_id: self.trackers[stream_id].associate(frame) for stream_id, frame, _ in jobs
+        }
+
+    @torch.no_grad()
+    def encode(self, jobs):
+        """encode the search regions of all jobs in batches of at most `max_batch`.
+
+        Args:
+            jobs (list): (stream id, FrameState, tracks to encode) of every queued frame
+        """
+        items = [(job, strack) for job, (_, _, stracks) in enumerate(jobs) for strack in stracks]
+        for start in range(0, len(items), self.max_batch):
+            chunk = items[start:start + self.max_batch]
+            stracks = [strack for _, strack in chunk]
+
+            # crop per stream, every stream has its own image
+            groups, crops, regions = [], [], []
+            for job, group in groupby(chunk, key=lambda item: item[0]):
+                group = [strack for _, strack in group]
+                stream_id, frame, _ = jobs[job]
+                tracker = self.trackers[stream_id]
+                crop, region = tracker.cropper.crop(
+                    frame.img, tracker.tracks.tlwh(slots_of(group)), "search"
+                )
+                groups.append((tracker, frame, group))
+                crops.append(crop)
+                regions.append(region)
+
+            # templates & search regions of all streams in one forward each
+            stale = [s for s in stracks if s.template_kv is None]
+            if len(stale) > 0:
+                template_kv = self.network.forward_template(
+                    torch.stack([s.template for s in stale])
+                )
+                for strack, kv in zip(stale, template_kv):
+                    strack.template_kv = kv
+            heatmap = self.network.forward_search(
+                torch.cat(crops), torch.stack([s.template_kv for s in stracks])
+            )
+
+            # route the rows back to the frame of every stream, scored with its own radius
+            offset = 0
+            for (tracker, frame, group), region in zip(groups, regions):
+                scores = heatmap_scores(heatmap[offset:offset + len(group)], tracker.radius)
+                frame.context.add(group, scores, region)
+                offset += len(group)
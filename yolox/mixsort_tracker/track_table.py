@@ -0,0 +1,205 @@
+import numpy as np
+
+from .basetrack import IDAllocator, TrackState
+
+
+class TrackTable(object):
+    """Struct-of-arrays storage of the Kalman state and bookkeeping of all live tracks.
+
+    Every activated `STrack` owns one row (slot) of preallocated arrays, so that predict,
+    update and box views run as single array operations over any subset of tracks instead
+    of per-object loops. Slots of tracks which left the tracked and lost lists are put on a
+    free list by `collect` and reused, the arrays grow by doubling when no slot is free.
+    """
+
+    # bookkeeping columns: name -> dtype
+    columns = {
+        "track_id": np.int64,
+        "state": np.int64,
+        "is_activated": np.bool_,
+        "score": np.float64,
+        "start_frame": np.int64,
+        "frame_id": np.int64,
+        "tracklet_len": np.int64,
+    }
+
+    def __init__(self, kalman_filter, capacity=128):
+        """
+        :param kalman_filter: KalmanFilter shared by all tracks
+        :param capacity: number of preallocated slots
+        """
+        self.kalman_filter = kalman_filter
+        # ids of the tracks stored in this table
+        self.ids = IDAllocator()
+        self.capacity = 0
+        self.mean = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 8, 8))
+        # STrack owning every slot, None for free slots
+        self.owner = np.empty(0, dtype=object)
+        # whether every slot is owned, the mask of `owner` not None
+        self.in_use = np.zeros(0, dtype=np.bool_)
+        for name, dtype in self.columns.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self.free = []
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        self.mean = np.concatenate((self.mean, np.zeros((extra, 8))))
+        self.covariance = np.concatenate((self.covariance, np.zeros((extra, 8, 8))))
+        self.owner = np.concatenate((self.owner, np.empty(extra, dtype=object)))
+        self.in_use = np.concatenate((self.in_use, np.zeros(extra, dtype=np.bool_)))
+        for name, dtype in self.columns.items():
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate((column, np.zeros(extra, dtype=dtype))))
+        # pop() hands out the lowest free slot first
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def allocate(self, strack):
+        """
+        Take a free slot for `strack`, growing the arrays if needed.
+        :type strack: STrack
+        :rtype slot int
+        """
+        if len(self.free) == 0:
+            self._grow(max(2 * self.capacity, 1))
+        slot = self.free.pop()
+        self.owner[slot] = strack
+        self.in_use[slot] = True
+        return slot
+
+    def release(self, slot):
+        """
+        Return `slot` to the free list.
+        :type slot: int
+        """
+        self.owner[slot] = None
+        self.in_use[slot] = False
+        self.free.append(slot)
+
+    def collect(self, live_slots):
+        """
+        Detach every track whose slot is not in `live_slots` and free its slot.
+        :param live_slots: np.ndarray, slots of the tracked and lost tracks
+        """
+        used = np.flatnonzero(self.in_use)
+        for slot in used[~np.isin(used, live_slots)]:
+            self.owner[slot].detach()
+
+    def initiate(self, slots, tlwhs):
+        """
+        Initialize the Kalman state of new tracks.
+        :param slots: np.ndarray (N,)
+        :param tlwhs: np.ndarray (N, 4)
+        """
+        for slot, tlwh in zip(slots, tlwhs):
+            self.mean[slot], self.covariance[slot] = self.kalman_filter.initiate(
+                tlwh_to_xyah(tlwh)
+            )
+
+    def predict(self, slots):
+        """
+        Predict the state of all `slots` in one step, the height velocity of tracks
+        which are not tracked is reset to 0.
+        :param slots: np.ndarray (N,)
+        """
+        if len(slots) == 0:
+            return
+        mean = self.mean[slots]
+        mean[self.state[slots] != TrackState.Tracked, 7] = 0
+        self.mean[slots], self.covariance[slots] = self.kalman_filter.multi_predict(
+            mean, self.covariance[slots]
+        )
+
+    def update(self, slots, tlwhs, scores, frame_id, refind):
+        """
+        Correct the state of all matched tracks with their detections in one step.
+        :param slots: np.ndarray (N,)
+        :param tlwhs: np.ndarray (N, 4), matched detections
+        :param scores: np.ndarray (N,), matched detection scores
+        :param frame_id: current frame
+        :param refind: np.ndarray (N,) bool, True for lost tracks which are re-activated
+        """
+        if len(slots) == 0:
+            return
+        self.mean[slots], self.covariance[slots] = self.kalman_filter.multi_update(
+            self.mean[slots], self.covariance[slots], tlwh_to_xyah(tlwhs)
+        )
+        self.tracklet_len[slots] = np.where(refind, 0, self.tracklet_len[slots] + 1)
+        self.state[slots] = TrackState.Tracked
+        self.is_activated[slots] = True
+        self.frame_id[slots] = frame_id
+        self.score[slots] = scores
+
+    def tlwh(self, slots):
+        """
+        :param slots: np.ndarray (N,)
+        :rtype tlwhs np.ndarray (N, 4)
+        """
+        ret = self.mean[slots, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def tlbr(self, slots):
+        """
+        :param slots: np.ndarray (N,)
+        :rtype tlbrs np.ndarray (N, 4)
+        """
+        ret = self.tlwh(slots)
+        ret[:, 2:] += ret[:, :2]
+        return ret
+
+
+class Column(object):
+    """Attribute of an `STrack` which lives in its `TrackTable` row once it owns a slot.
+
+    Detections which are not activated have no slot and keep the value on the object.
+    """
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __get__(self, strack, owner):
+        if strack is None:
+            return self
+        if strack.slot is None:
+            return strack.__dict__.get(self.name, self.default)
+        return getattr(strack.table, self.name)[strack.slot].item()
+
+    def __set__(self, strack, value):
+        if strack.slot is None:
+            strack.__dict__[self.name] = value
+        else:
+            getattr(strack.table, self.name)[strack.slot] = value
+
+
+def tlwh_to_xyah(tlwh):
+    """Convert boxes to format `(center x, center y, aspect ratio, height)`, where the
+    aspect ratio is `width / height`.
+    """
+    ret = np.asarray(tlwh, dtype=np.float64).copy()
+    ret[..., :2] += ret[..., 2:] / 2
+    ret[..., 2] /= ret[..., 3]
+    return ret
+
+
+def slots_of(stracks):
+    """
+    :type stracks: list[STrack]
+    :rtype slots np.ndarray (N,)
+    """
+    return np.array([t.slot for t in stracks], dtype=np.int64)
+
+
+def ids_of(stracks):
+    """
+    :type stracks: list[STrack]
+    :rtype track_ids np.ndarray (N,)
+    """
+    return np.array([t.track_id for t in stracks], dtype=np.int64)
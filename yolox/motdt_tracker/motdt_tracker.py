@@ -14,6 +14,7 @@ from .reid_model import load_reid_model, extract_reid_features
 from yolox.data.dataloading import get_yolox_datadir
 
 from .basetrack import BaseTrack, TrackState
+from yolox.tracking_utils.assignment import LinearAssignment
 
 
 class STrack(BaseTrack):
@@ -189,6 +190,7 @@ class OnlineTracker(object):
         self.max_time_lost = max_time_lost
 
         self.kalman_filter = KalmanFilter()
+        self.assignment = LinearAssignment()
 
         self.tracked_stracks = []   # type: list[STrack]
         self.lost_stracks = []      # type: list[STrack]
@@ -277,7 +279,8 @@ class OnlineTracker(object):
 
         dists = matching.nearest_reid_distance(tracked_stracks, detections, metric='euclidean')
         dists = matching.gate_cost_matrix(self.kalman_filter, dists, tracked_stracks, detections)
-        matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.min_ap_dist)
+        matches, u_track, u_detection = matching.linear_assignment(
+            dists, thresh=self.min_ap_dist, solver=self.assignment)
         for itracked, idet in matches:
             tracked_stracks[itracked].update(detections[idet], self.frame_id, image)
 
@@ -285,7 +288,8 @@ class OnlineTracker(object):
         detections = [detections[i] for i in u_detection]
         dists = matching.nearest_reid_distance(self.lost_stracks, detections, metric='euclidean')
         dists = matching.gate_cost_matrix(self.kalman_filter, dists, self.lost_stracks, detections)
-        matches, u_lost, u_detection = matching.linear_assignment(dists, thresh=self.min_ap_dist)
+        matches, u_lost, u_detection = matching.linear_assignment(
+            dists, thresh=self.min_ap_dist, solver=self.assignment)
         for ilost, idet in matches:
             track = self.lost_stracks[ilost]  # type: STrack
             det = detections[idet]
@@ -298,7 +302,8 @@ class OnlineTracker(object):
         detections = [detections[i] for i in u_detection] + pred_dets
         r_tracked_stracks = [tracked_stracks[i] for i in u_track]
         dists = matching.iou_distance(r_tracked_stracks, detections)
-        matches, u_track, u_detection = matching.linear_assignment(dists, thresh=0.5)
+        matches, u_track, u_detection = matching.linear_assignment(
+            dists, thresh=0.5, solver=self.assignment)
         for itracked, idet in matches:
             r_tracked_stracks[itracked].update(detections[idet], self.frame_id, image, update_feature=True)
         for it in u_track:
@@ -309,7 +314,8 @@ class OnlineTracker(object):
         # unconfirmed
         detections = [detections[i] for i in u_detection if i < len_det]
         dists = matching.iou_distance(unconfirmed, detections)
-        matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
+        matches, u_unconfirmed, u_detection = matching.linear_assignment(
+            dists, thresh=0.7, solver=self.assignment)
         for itracked, idet in matches:
             unconfirmed[itracked].update(detections[idet], self.frame_id, image, update_feature=True)
         for it in u_unconfirmed:
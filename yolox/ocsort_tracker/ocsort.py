@@ -4,19 +4,10 @@
 from __future__ import print_function
 
 import numpy as np
+from collections import deque
 from .association import *
 from typing import List
-
-def k_previous_obs(observations, cur_age, k):
-    if len(observations) == 0:
-        return [-1, -1, -1, -1, -1]
-    for i in range(k):
-        dt = k - i
-        if cur_age - dt in observations:
-            return observations[cur_age-dt]
-    max_age = max(observations.keys())
-    return observations[max_age]
-
+from yolox.tracking_utils.oc_kalman import OCKalmanBank
 
 def convert_bbox_to_z(bbox):
     """
@@ -60,45 +51,29 @@ class KalmanBoxTracker(object):
     """
     count = 0
 
-    def __init__(self, bbox, delta_t=3, orig=False):
+    def __init__(self, bbox, kf, delta_t=3):
         """
         Initialises a tracker using initial bounding box.
+        The constant velocity model is a slot of the OCKalmanBank kf of the owning OCSort.
 
         """
-        # define constant velocity model
-        if not orig:
-          from .kalmanfilter import KalmanFilterNew as KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        else:
-          from filterpy.kalman import KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array([[1, 0, 0, 0, 1, 0, 0], [0, 1, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0, 1], [
-                            0, 0, 0, 1, 0, 0, 0],  [0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 1]])
-        self.kf.H = np.array([[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0],
-                            [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]])
-
-        self.kf.R[2:, 2:] *= 10.
-        self.kf.P[4:, 4:] *= 1000.  # give high uncertainty to the unobservable initial velocities
-        self.kf.P *= 10.
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)
+        self.kf = kf
+        self.slot = kf.allocate(convert_bbox_to_z(bbox))
         self.time_since_update = 0
         self.id = KalmanBoxTracker.count
         KalmanBoxTracker.count += 1
-        self.history = []
+        # predicted boxes since the last observation, the delta_t last ones
+        self.history = deque(maxlen=delta_t)
         self.hits = 0
         self.hit_streak = 0
         self.age = 0
         """
         NOTE: [-1,-1,-1,-1,-1] is a compromising placeholder for non-observation status, the same for the return of 
         function k_previous_obs. It is ugly and I do not like it. But to support generate observation array in a 
-        fast and unified way, which you would see below k_observations = np.array([k_previous_obs(...]]), let's bear it for now.
+        fast and unified way, which you would see below k_observations = self.kf.k_previous_obs(...), let's bear it for now.
+        The observations themselves are kept by kf, the last ones only.
         """
         self.last_observation = np.array([-1, -1, -1, -1, -1])  # placeholder
-        self.observations = dict()
-        self.history_observations = []
         self.velocity = None
         self.delta_t = delta_t
 
@@ -108,55 +83,47 @@ class KalmanBoxTracker(object):
         """
         if bbox is not None:
             if self.last_observation.sum() >= 0:  # no previous observation
-                previous_box = None
-                for i in range(self.delta_t):
-                    dt = self.delta_t - i
-                    if self.age - dt in self.observations:
-                        previous_box = self.observations[self.age-dt]
-                        break
-                if previous_box is None:
-                    previous_box = self.last_observation
+                previous_box = self.kf.previous_obs(self.slot, self.age, self.delta_t)
                 """
                   Estimate the track speed direction with observations \Delta t steps away
                 """
                 self.velocity = speed_direction(previous_box, bbox)
             
-            """
-              Insert new observations. This is a ugly way to maintain both self.observations
-              and self.history_observations. Bear it for the moment.
-            """
             self.last_observation = bbox
-            self.observations[self.age] = bbox
-            self.history_observations.append(bbox)
+            self.kf.record(self.slot, self.age, bbox)
 
             self.time_since_update = 0
-            self.history = []
+            self.history.clear()
             self.hits += 1
             self.hit_streak += 1
-            self.kf.update(convert_bbox_to_z(bbox))
+            self.kf.update(self.slot, convert_bbox_to_z(bbox))
         else:
-            self.kf.update(bbox)
+            self.kf.update(self.slot, None)
 
     def predict(self):
         """
         Advances the state vector and returns the predicted bounding box estimate.
         """
-        if((self.kf.x[6]+self.kf.x[2]) <= 0):
-            self.kf.x[6] *= 0.0
+        self.kf.predict([self.slot])
+        return self.advance(self.get_state())
 
-        self.kf.predict()
+    def advance(self, bbox):
+        """
+        Bookkeeping of a predict, bbox is the predicted estimate of the state vector which
+        was advanced by the bank.
+        """
         self.age += 1
         if(self.time_since_update > 0):
             self.hit_streak = 0
         self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
+        self.history.append(bbox)
         return self.history[-1]
 
     def get_state(self):
         """
         Returns the current bounding box estimate.
         """
-        return convert_x_to_bbox(self.kf.x)
+        return self.kf.tlbr([self.slot])
 
 
 """
@@ -182,6 +149,9 @@ class OCSort(object):
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
         self.trackers = [] #type: List[KalmanBoxTracker]
+        # Kalman filters & last observations of all the trackers, enough of them for the
+        # velocity direction & the head padding, the trackers of update_public look 3 steps back
+        self.kf = OCKalmanBank(history=max(delta_t, min_hits, 3))
         self.frame_count = 0
         self.det_thresh = det_thresh
         self.delta_t = delta_t
@@ -190,6 +160,24 @@ class OCSort(object):
         self.use_byte = use_byte
         KalmanBoxTracker.count = 0
 
+    def predict(self):
+        """
+        Advance all the trackers in one step.
+        Returns their predicted bounding box estimates, (N, 4).
+        """
+        slots = np.array([trk.slot for trk in self.trackers], dtype=np.int64)
+        self.kf.predict(slots)
+        bboxes = self.kf.tlbr(slots)
+        for trk, bbox in zip(self.trackers, bboxes):
+            trk.advance(bbox[None])
+        return bboxes
+
+    def remove(self, t):
+        """
+        Drop the t-th tracker & free its Kalman filter.
+        """
+        self.kf.release(self.trackers.pop(t).slot)
+
     def update(self, output_results, img_info, img_size, img):
         """
         Params:
@@ -225,20 +213,21 @@ class OCSort(object):
         trks = np.zeros((len(self.trackers), 5))
         to_del = []
         ret = []
+        predicted = self.predict()
         for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
+            pos = predicted[t]
             trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
             if np.any(np.isnan(pos)):
                 to_del.append(t)
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
-            self.trackers.pop(t)
+            self.remove(t)
 
         velocities = np.array(
             [trk.velocity if trk.velocity is not None else np.array((0, 0)) for trk in self.trackers])
         last_boxes = np.array([trk.last_observation for trk in self.trackers])
-        k_observations = np.array(
-            [k_previous_obs(trk.observations, trk.age, self.delta_t) for trk in self.trackers])
+        k_observations = self.kf.k_previous_obs(
+            [trk.slot for trk in self.trackers], [trk.age for trk in self.trackers], self.delta_t)
 
         """
             First round of association
@@ -301,7 +290,7 @@ class OCSort(object):
 
         # create and initialise new trackers for unmatched detections
         for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i, :], delta_t=self.delta_t)
+            trk = KalmanBoxTracker(dets[i, :], self.kf, delta_t=self.delta_t)
             self.trackers.append(trk)
         i = len(self.trackers)
         for trk in reversed(self.trackers):
@@ -319,7 +308,7 @@ class OCSort(object):
             i -= 1
             # remove dead tracklet
             if(trk.time_since_update > self.max_age):
-                self.trackers.pop(i)
+                self.remove(i)
         if(len(ret) > 0):
             return np.concatenate(ret)
         return np.empty((0, 5))
@@ -338,19 +327,21 @@ class OCSort(object):
         trks = np.zeros((len(self.trackers), 5))
         to_del = []
         ret = []
+        predicted = self.predict()
         for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
+            pos = predicted[t]
             cat = self.trackers[t].cate
             trk[:] = [pos[0], pos[1], pos[2], pos[3], cat]
             if np.any(np.isnan(pos)):
                 to_del.append(t)
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
-            self.trackers.pop(t)
+            self.remove(t)
 
         velocities = np.array([trk.velocity if trk.velocity is not None else np.array((0,0)) for trk in self.trackers])
         last_boxes = np.array([trk.last_observation for trk in self.trackers])
-        k_observations = np.array([k_previous_obs(trk.observations, trk.age, self.delta_t) for trk in self.trackers])
+        k_observations = self.kf.k_previous_obs(
+            [trk.slot for trk in self.trackers], [trk.age for trk in self.trackers], self.delta_t)
 
         matched, unmatched_dets, unmatched_trks = associate_kitti\
               (dets, trks, cates, self.iou_threshold, velocities, k_observations, self.inertia)
@@ -400,7 +391,7 @@ class OCSort(object):
                 unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
 
         for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i,:])
+            trk = KalmanBoxTracker(dets[i,:], self.kf)
             trk.cate = cates[i]
             self.trackers.append(trk)
         i = len(self.trackers)
@@ -416,13 +407,14 @@ class OCSort(object):
                     ret.append(np.concatenate((d, [trk.id+1], [trk.cate], [0])).reshape(1,-1)) 
                 if trk.hit_streak == self.min_hits:
                     # Head Padding (HP): recover the lost steps during initializing the track
+                    recent_obs = self.kf.recent_obs(trk.slot, self.min_hits)
                     for prev_i in range(self.min_hits - 1):
-                        prev_observation = trk.history_observations[-(prev_i+2)]
+                        prev_observation = recent_obs[prev_i+1]
                         ret.append((np.concatenate((prev_observation[:4], [trk.id+1], [trk.cate], 
                             [-(prev_i+1)]))).reshape(1,-1))
             i -= 1 
             if (trk.time_since_update > self.max_age):
-                  self.trackers.pop(i)
+                  self.remove(i)
         
         if(len(ret)>0):
             return np.concatenate(ret)
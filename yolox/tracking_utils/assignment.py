@@ -0,0 +1,126 @@
+import time
+
+import lap
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class LinearAssignment(object):
+    """Thresholded linear assignment of tracks to detections, split by connected components.
+
+    Gives the matching of `lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)`: a track
+    either takes a detection or stays unmatched at cost `thresh`. Pairs above `thresh` never
+    match, so the tracks & detections are first split into the connected components of the
+    pairs up to it. A track alone in its component takes its cheapest detection, and a detection
+    alone its cheapest track. The other components are independent problems of a few tracks,
+    solved by `lapjv` in batches of up to `min_pairs` pairs instead of one problem for the crowd.
+    Pairs at exactly `thresh` are ties between matching and not, which may be resolved
+    differently than by a single `lapjv` on the whole matrix.
+    """
+
+    # smaller problems go to lapjv directly, cheaper than splitting them
+    min_pairs = 1 << 14
+
+    def __init__(self):
+        self.calls = 0
+        # components of several tracks & detections
+        self.components = 0
+        self.total_time = 0.
+        self.last_time = 0.
+
+    def __call__(self, cost_matrix, thresh):
+        """
+        :param cost_matrix: np.ndarray (M, N), track x detection costs
+        :param thresh: max cost of a match
+
+        :rtype x np.ndarray (M,), detection of every track or -1,
+            y np.ndarray (N,), track of every detection or -1
+        """
+        start = time.perf_counter()
+        cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+        m, n = cost_matrix.shape
+        if cost_matrix.size < self.min_pairs:
+            _, x, y = lap.lapjv(cost_matrix, extend_cost=True, cost_limit=thresh)
+            self.last_time = time.perf_counter() - start
+            self.total_time += self.last_time
+            self.calls += 1
+            return x, y
+
+        x = np.full(m, -1)
+        y = np.full(n, -1)
+
+        row_label, col_label, count = self.components_of(cost_matrix, thresh)
+        num_rows = np.bincount(row_label, minlength=count)
+        num_cols = np.bincount(col_label, minlength=count)
+        # a track alone in its component takes its cheapest detection, a detection alone in
+        # its component its cheapest track, isolated tracks & detections stay unmatched
+        rows = np.nonzero((num_rows[row_label] == 1) & (num_cols[row_label] > 0))[0]
+        x[rows] = cost_matrix[rows].argmin(axis=1)
+        y[x[rows]] = rows
+        cols = np.nonzero((num_cols[col_label] == 1) & (num_rows[col_label] > 1))[0]
+        y[cols] = cost_matrix[:, cols].argmin(axis=0)
+        x[y[cols]] = cols
+
+        # the other components do not interact, they are solved in batches of up to `min_pairs`
+        # pairs, a larger component alone
+        multi = np.nonzero((num_rows > 1) & (num_cols > 1))[0]
+        self.components += len(multi)
+        rows = np.nonzero((num_rows[row_label] > 1) & (num_cols[row_label] > 1))[0]
+        cols = np.nonzero((num_rows[col_label] > 1) & (num_cols[col_label] > 1))[0]
+        row_groups = np.split(
+            rows[np.argsort(row_label[rows], kind="stable")], np.cumsum(num_rows[multi])[:-1]
+        )
+        col_groups = np.split(
+            cols[np.argsort(col_label[cols], kind="stable")], np.cumsum(num_cols[multi])[:-1]
+        )
+        groups = []
+        batch_rows, batch_cols = [], []
+        num_batch_rows = num_batch_cols = 0
+        for rows, cols in zip(row_groups, col_groups) if len(multi) > 0 else ():
+            num_batch_rows += len(rows)
+            num_batch_cols += len(cols)
+            if len(batch_rows) > 0 and num_batch_rows * num_batch_cols >= self.min_pairs:
+                groups.append((np.concatenate(batch_rows), np.concatenate(batch_cols)))
+                batch_rows, batch_cols = [], []
+                num_batch_rows, num_batch_cols = len(rows), len(cols)
+            batch_rows.append(rows)
+            batch_cols.append(cols)
+        if len(batch_rows) > 0:
+            groups.append((np.concatenate(batch_rows), np.concatenate(batch_cols)))
+        for rows, cols in groups:
+            sub = cost_matrix[np.ix_(rows, cols)]
+            _, sub_x, sub_y = lap.lapjv(sub, extend_cost=True, cost_limit=thresh)
+            x[rows] = np.where(sub_x >= 0, cols[sub_x], -1)
+            y[cols] = np.where(sub_y >= 0, rows[sub_y], -1)
+
+        self.last_time = time.perf_counter() - start
+        self.total_time += self.last_time
+        self.calls += 1
+        return x, y
+
+    @staticmethod
+    def components_of(cost_matrix, thresh):
+        """
+        Connected components of the tracks & detections, linked by the pairs of cost up to
+        `thresh`.
+        :rtype row_label np.ndarray (M,), col_label np.ndarray (N,), component of every track
+            & detection, count int, number of components
+        """
+        m, n = cost_matrix.shape
+        rows, cols = np.nonzero(cost_matrix <= thresh)
+        graph = coo_matrix((np.ones(len(rows)), (rows, m + cols)), shape=(m + n, m + n))
+        count, labels = connected_components(graph, directed=False)
+        return labels[:m], labels[m:], count
+
+    def summary(self):
+        """
+        :rtype dict, number of calls, components of several tracks & detections per call & mean
+            time per call in ms
+        """
+        calls = max(self.calls, 1)
+        return {
+            "calls": self.calls,
+            "components": self.components / calls,
+            "ms_per_call": 1000 * self.total_time / calls,
+        }
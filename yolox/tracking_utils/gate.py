@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+
+
+def ambiguous_pairs(iou_sim, iou_floor, margin=1.0):
+    """
+    Find the pairs of an IoU similarity matrix, between tracks and detections in either
+    order, whose association can not be decided by IoU alone. A pair is a candidate if its
+    IoU is above `iou_floor`. A candidate is ambiguous if its row or its column has another
+    candidate whose IoU is within `margin` of the best one, i.e. several detections compete
+    for a track or several tracks for a detection.
+    :type iou_sim: np.ndarray, m x n IoU similarity
+    :type iou_floor: float
+    :type margin: float
+
+    :rtype mask np.ndarray, m x n bool, True for ambiguous pairs
+    """
+    candidates = iou_sim > iou_floor
+    if candidates.size == 0:
+        return candidates
+
+    def competing(axis):
+        # best & second best candidate of every row (axis=1) or column (axis=0)
+        sim = np.sort(np.where(candidates, iou_sim, -1.0), axis=axis)
+        if sim.shape[axis] < 2:
+            return np.zeros(sim.shape[1 - axis], dtype=bool)
+        best, second = sim.take(-1, axis=axis), sim.take(-2, axis=axis)
+        return (second > iou_floor) & (best - second < margin)
+
+    rows = competing(1)
+    cols = competing(0)
+    return candidates & (rows[:, None] | cols[None, :])
+
+
+def torch_ambiguous_pairs(iou_sim, iou_floor, margin=1.0):
+    """
+    `ambiguous_pairs` on the device
+    :type iou_sim: torch.Tensor, m x n IoU similarity
+
+    :rtype mask torch.Tensor, m x n bool
+    """
+    candidates = iou_sim > iou_floor
+    if candidates.numel() == 0:
+        return candidates
+
+    def competing(dim):
+        sim = torch.where(candidates, iou_sim, torch.full_like(iou_sim, -1.0))
+        if sim.shape[dim] < 2:
+            return torch.zeros(sim.shape[1 - dim], dtype=torch.bool, device=sim.device)
+        best, second = sim.topk(2, dim=dim).values.unbind(dim)
+        return (second > iou_floor) & (best - second < margin)
+
+    rows = competing(1)
+    cols = competing(0)
+    return candidates & (rows[:, None] | cols[None, :])
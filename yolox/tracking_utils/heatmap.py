@@ -0,0 +1,61 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def heatmap_scores(heatmap, radius=0):
+    """
+    Turn raw MixFormer heatmaps into per-pixel similarity scores, on the heatmap's device.
+    Every map is min-max normalized to [0, 1] and averaged over a (2 * radius + 1) window,
+    the window is clipped at the border of the map.
+    :param heatmap: torch.Tensor (m, 1, H, W)
+    :param radius: radius for computing similarity
+
+    :rtype scores torch.Tensor (m, H, W)
+    """
+    heatmap = heatmap[:, 0]
+    flat = heatmap.flatten(1)
+    low = flat.min(dim=1)[0][:, None, None]
+    high = flat.max(dim=1)[0][:, None, None]
+    # linear transform to [0,1]
+    scores = (heatmap - low) / (high - low).clamp_min(1e-12)
+    if radius > 0:
+        scores = F.avg_pool2d(
+            scores[:, None],
+            kernel_size=2 * radius + 1,
+            stride=1,
+            padding=radius,
+            count_include_pad=False,
+        )[:, 0]
+    return scores
+
+
+def gather_similarity(scores, coords, search_size, host=True):
+    """
+    Look up the similarity of every detection at its center in the search region.
+    Detections whose center is outside the search region get 0.
+    :param scores: torch.Tensor (m, H, W) from `heatmap_scores`
+    :param coords: np.ndarray (m, n, 4), tlwh of the detections inside every search region
+    :param search_size: side length of the resized search region
+    :param host: return a np.ndarray, else a torch.Tensor on the device of `scores`
+
+    :rtype vit np.ndarray (m, n) | torch.Tensor (m, n)
+    """
+    m, heatmap_size = scores.shape[0], scores.shape[-1]
+    if m * coords.shape[1] == 0:
+        if not host:
+            return torch.zeros((m, coords.shape[1]), dtype=torch.float64, device=scores.device)
+        return np.zeros((m, coords.shape[1]), dtype=np.float64)
+    factor = search_size // heatmap_size
+
+    coords = torch.as_tensor(coords, dtype=torch.float64, device=scores.device)
+    cx = coords[..., 0] + coords[..., 2] / 2
+    cy = coords[..., 1] + coords[..., 3] / 2
+    # don't consider outsiders
+    inside = (cx > 0) & (cy > 0) & (cx < search_size) & (cy < search_size)
+    ix = (cx.clamp(0, search_size - 1).long() // factor).clamp(max=heatmap_size - 1)
+    iy = (cy.clamp(0, search_size - 1).long() // factor).clamp(max=heatmap_size - 1)
+
+    rows = torch.arange(m, device=scores.device)[:, None]
+    vit = torch.where(inside, scores[rows, iy, ix].double(), torch.zeros_like(cx))
+    return vit.cpu().numpy() if host else vit
@@ -0,0 +1,159 @@
+import copy
+import os
+
+import numpy as np
+import torch
+from loguru import logger
+from torch import nn
+
+from MixViT.lib.models.mixformer_vit import build_mixformer_deit
+from yolox.tracking_utils.heatmap import heatmap_scores
+from yolox.utils import get_device
+
+
+def split_model_paths(path):
+    """
+    Paths of the template & search graphs exported next to the joint graph at `path`.
+    :rtype (template path, search path)
+    """
+    stem, ext = os.path.splitext(path)
+    return stem + "_template" + ext, stem + "_search" + ext
+
+
+class OnnxMixFormer(object):
+    """MixFormer exported by `tools/export_mixformer_onnx.py`, run by ONNX Runtime.
+
+    Has the same inference interface as the pytorch `MixFormer`: `__call__(template, search)`,
+    `forward_template(template)` and `forward_search(search, template_kv)`. If the template &
+    search graphs were exported too, the template cache holds the per-block keys/values like
+    the pytorch model. Otherwise the cache is the template crop itself and `forward_search`
+    runs the joint graph. Inputs are torch tensors on any device, outputs are returned on the
+    device of the inputs.
+    """
+
+    def __init__(self, path, providers=("CPUExecutionProvider",), num_threads=None):
+        """
+        :param path: joint template+search -> heatmap graph
+        :param providers: ONNX Runtime execution providers
+        :param num_threads: intra-op threads, ONNX Runtime's default if None
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+
+        def session(model_path):
+            return onnxruntime.InferenceSession(
+                model_path, sess_options=options, providers=list(providers)
+            )
+
+        self.session = session(path)
+        template_path, search_path = split_model_paths(path)
+        self.split = os.path.exists(template_path) and os.path.exists(search_path)
+        if self.split:
+            self.template_session = session(template_path)
+            self.search_session = session(search_path)
+
+    @staticmethod
+    def _run(session, *inputs):
+        feed = {
+            node.name: x.detach().float().cpu().numpy()
+            for node, x in zip(session.get_inputs(), inputs)
+        }
+        out = session.run(None, feed)[0]
+        return torch.from_numpy(out).to(inputs[0].device)
+
+    def __call__(self, template, search):
+        return self._run(self.session, template, search)
+
+    def forward_template(self, template):
+        if not self.split:
+            return template
+        return self._run(self.template_session, template)
+
+    def forward_search(self, search, template_kv):
+        if not self.split:
+            return self._run(self.session, template_kv, search)
+        return self._run(self.search_session, search, template_kv)
+
+
+# max abs difference of the similarity scores allowed by `--check_backend`
+CHECK_ATOL = {"onnx": 1e-3, "int8": 0.1}
+
+
+def quantize_int8(network):
+    """
+    Post-training dynamic quantization for cpu inference. The weights of all `nn.Linear`
+    layers, i.e. qkv/proj of `Attention` and fc1/fc2 of `Mlp`, are stored in int8 and their
+    inputs are quantized on the fly, so no calibration data is needed. The box head is kept
+    in fp32.
+    :param network: pytorch MixFormer, not modified
+
+    :rtype network, the quantized copy on cpu
+    """
+    network = copy.deepcopy(network).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(network, {nn.Linear}, dtype=torch.qint8)
+
+
+def build_network(args, cfg):
+    """
+    Build the MixFormer used for similarity, on the backend selected by `args.backend`.
+    :param args: tracking arguments, `backend` is 'torch', 'onnx' or 'int8'
+    :param cfg: MixFormer config
+
+    :rtype network, the pytorch MixFormer, its int8 copy or an `OnnxMixFormer`
+    """
+    if args.backend == "torch":
+        # need modification, for distributed
+        network = build_mixformer_deit(cfg)
+        network = network.to(get_device(args))
+        network.eval()
+        return network
+    if args.backend == "onnx":
+        network = OnnxMixFormer(args.onnx_model, num_threads=args.cpu_threads)
+        reference = build_mixformer_deit(cfg).eval() if args.check_backend else None
+    elif args.backend == "int8":
+        if get_device(args).type != "cpu":
+            raise ValueError("the int8 MixFormer runs on cpu only, use --device cpu")
+        reference = build_mixformer_deit(cfg).eval()
+        network = quantize_int8(reference)
+    else:
+        raise ValueError("unknown MixFormer backend {}".format(args.backend))
+    if args.check_backend:
+        diff = check_parity(network, reference, cfg, atol=CHECK_ATOL[args.backend])
+        logger.info(
+            "{} MixFormer matches pytorch, max abs score diff {:.2e}".format(args.backend, diff)
+        )
+    return network
+
+
+@torch.no_grad()
+def check_parity(network, reference, cfg, batch=4, atol=1e-3):
+    """
+    Compare the similarity scores of a MixFormer backend with the pytorch model on random
+    crops, for both the joint and the cached template path.
+    :param network: backend to check, e.g. `OnnxMixFormer`
+    :param reference: pytorch MixFormer
+    :param cfg: MixFormer config, for the crop sizes
+    :param batch: number of template/search pairs
+    :param atol: max allowed absolute difference of the scores from `heatmap_scores`
+
+    :rtype diff float, max absolute difference of the scores
+    """
+    device = next(reference.parameters()).device
+    template_sz, search_sz = cfg.DATA.TEMPLATE.SIZE, cfg.DATA.SEARCH.SIZE
+    template = torch.randn(batch, 3, template_sz, template_sz, device=device)
+    search = torch.randn(batch, 3, search_sz, search_sz, device=device)
+
+    expected = heatmap_scores(reference(template, search))
+    joint = heatmap_scores(network(template, search))
+    cached = heatmap_scores(network.forward_search(search, network.forward_template(template)))
+    diff = max(
+        (joint - expected).abs().max().item(), (cached - expected).abs().max().item()
+    )
+    if not np.isfinite(diff) or diff > atol:
+        raise ValueError(
+            "MixFormer backend differs from pytorch by {:.2e} > {:.2e}".format(diff, atol)
+        )
+    return diff
@@ -0,0 +1,297 @@
+import numpy as np
+
+
+class OCKalmanBank(object):
+    """Stacked constant velocity Kalman filters of all the tracks of an OC-SORT tracker.
+
+    Every `KalmanBoxTracker` owns one row (slot) of the state (N, 7) = [x, y, s, r, vx, vy, vs]
+    and covariance (N, 7, 7) arrays, predict and update run as single array operations over
+    all slots. Observations are queued by `update` and applied together on the next read of
+    the state, so the updates of all the association passes of a frame cost one step.
+
+    Same filter as `KalmanFilterNew`, including the observation-centric re-update (ORU): when
+    a track stops being observed its state is frozen, and when it is observed again the frozen
+    state is corrected along the linear virtual trajectory between the last two observations
+    (`unfreeze`). The saved state is the (x, P) row of the slot instead of a copy
+    of the whole filter, and the re-update of all tracks found again in a frame runs at once.
+
+    The bank also keeps the last `history` observations of every track in a ring buffer, for
+    the velocity direction & head padding of the trackers, so that the memory of a track does
+    not grow with its age.
+    """
+
+    dim_x = 7
+    dim_z = 4
+    # observations of the trackers, x1y1x2y2 & score
+    dim_obs = 5
+
+    def __init__(self, capacity=64, history=3):
+        """
+        :param capacity: number of preallocated slots
+        :param history: number of observations kept per track
+        """
+        # constant velocity model, x, y & s move by their velocity
+        self.F = np.eye(self.dim_x)
+        self.F[[0, 1, 2], [4, 5, 6]] = 1
+        self.H = np.eye(self.dim_z, self.dim_x)
+        self.R = np.eye(self.dim_z)
+        self.R[2:, 2:] *= 10.
+        self.Q = np.eye(self.dim_x)
+        self.Q[-1, -1] *= 0.01
+        self.Q[4:, 4:] *= 0.01
+        self.P0 = np.eye(self.dim_x)
+        self.P0[4:, 4:] *= 1000.  # give high uncertainty to the unobservable initial velocities
+        self.P0 *= 10.
+        self._I = np.eye(self.dim_x)
+
+        self.capacity = 0
+        self.x = np.zeros((0, self.dim_x))
+        self.P = np.zeros((0, self.dim_x, self.dim_x))
+        # state saved by the last freeze
+        self.x_saved = np.zeros((0, self.dim_x))
+        self.P_saved = np.zeros((0, self.dim_x, self.dim_x))
+        # updated with an observation (not None) last time
+        self.observed = np.zeros(0, dtype=np.bool_)
+        # frozen since the last observation, the saved state is valid
+        self.frozen = np.zeros(0, dtype=np.bool_)
+        # last observation [x, y, s, r], real or virtual, & number of updates since
+        self.last_z = np.zeros((0, self.dim_z))
+        self.since_obs = np.zeros(0, dtype=np.int64)
+        # ring buffers of the last observations & the age of the track they were made at,
+        # the observation n of a track is in entry n % history
+        self.history = history
+        self.obs = np.zeros((0, history, self.dim_obs))
+        self.obs_age = np.zeros((0, history), dtype=np.int64)
+        self.num_obs = np.zeros(0, dtype=np.int64)
+        self.free = []
+        # queued updates, slot -> [x, y, s, r] or None
+        self.pending = {}
+        self._grow(capacity)
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+    def _grow(self, capacity):
+        extra = capacity - self.capacity
+        for name in (
+            "x", "P", "x_saved", "P_saved", "observed", "frozen", "last_z", "since_obs",
+            "obs", "obs_age", "num_obs",
+        ):
+            column = getattr(self, name)
+            padding = np.zeros((extra,) + column.shape[1:], column.dtype)
+            setattr(self, name, np.concatenate((column, padding)))
+        # pop() hands out the lowest free slot first
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def allocate(self, z):
+        """
+        Take a free slot for a new track, growing the arrays if needed.
+        :param z: np.ndarray (4,), first box [x, y, s, r], the velocities are 0
+        :rtype slot int
+        """
+        if len(self.free) == 0:
+            self._grow(max(2 * self.capacity, 1))
+        slot = self.free.pop()
+        self.x[slot] = 0
+        self.x[slot, :4] = np.ravel(z)
+        self.P[slot] = self.P0
+        self.observed[slot] = False
+        self.frozen[slot] = False
+        self.since_obs[slot] = 0
+        self.num_obs[slot] = 0
+        return slot
+
+    def release(self, slot):
+        """
+        Return `slot` to the free list.
+        :type slot: int
+        """
+        self.pending.pop(slot, None)
+        self.free.append(slot)
+
+    def update(self, slot, z):
+        """
+        Queue an update of `slot`, applied by the next `flush`.
+        :param z: np.ndarray (4,), observed box [x, y, s, r], None if not observed
+        """
+        if slot in self.pending:
+            self.flush()
+        self.pending[slot] = None if z is None else np.ravel(z)
+
+    def record(self, slot, age, bbox):
+        """
+        Add an observation to the history of `slot`, overwriting the oldest one.
+        :param age: age of the track
+        :param bbox: np.ndarray (5,), x1y1x2y2 & score
+        """
+        entry = self.num_obs[slot] % self.history
+        self.obs[slot, entry] = bbox
+        self.obs_age[slot, entry] = age
+        self.num_obs[slot] += 1
+
+    def k_previous_obs(self, slots, ages, k):
+        """
+        Observation of every track made k steps before `ages`, else the first one made in
+        the k - 1 steps after, else the last one, [-1, -1, -1, -1, -1] without observations.
+        k must not be larger than the history.
+        :param slots: np.ndarray (N,)
+        :param ages: np.ndarray (N,), current ages of the tracks
+        :rtype obs np.ndarray (N, 5)
+        """
+        slots, ages = np.asarray(slots, dtype=np.int64), np.asarray(ages, dtype=np.int64)
+        obs, obs_age, num_obs = self.obs[slots], self.obs_age[slots], self.num_obs[slots]
+        rows = np.arange(len(slots))
+        ret = np.where(num_obs[:, None] > 0, obs[rows, (num_obs - 1) % self.history], -1.0)
+        filled = np.arange(self.history) < num_obs[:, None]
+        found = np.zeros(len(slots), dtype=np.bool_)
+        for dt in range(k, 0, -1):
+            hit = filled & (obs_age == (ages - dt)[:, None])
+            new = hit.any(axis=1) & ~found
+            ret[new] = obs[rows[new], hit[new].argmax(axis=1)]
+            found |= new
+        return ret
+
+    def previous_obs(self, slot, age, k):
+        """
+        `k_previous_obs` of a single track, without array overheads.
+        :rtype obs np.ndarray (5,)
+        """
+        num_obs = int(self.num_obs[slot])
+        if num_obs == 0:
+            return np.full(self.dim_obs, -1.0)
+        obs_age = self.obs_age[slot, :num_obs].tolist()
+        for dt in range(k, 0, -1):
+            if age - dt in obs_age:
+                return self.obs[slot, obs_age.index(age - dt)]
+        return self.obs[slot, (num_obs - 1) % self.history]
+
+    def recent_obs(self, slot, n):
+        """
+        The n last observations of `slot`, the last one first, n must not be larger than the
+        history and the number of observations.
+        :rtype obs np.ndarray (n, 5)
+        """
+        return self.obs[slot, (self.num_obs[slot] - 1 - np.arange(n)) % self.history]
+
+    def flush(self):
+        """Apply all the queued updates."""
+        if len(self.pending) == 0:
+            return
+        slots = np.fromiter(self.pending.keys(), dtype=np.int64, count=len(self.pending))
+        seen = np.array([z is not None for z in self.pending.values()], dtype=np.bool_)
+        zs = np.array([z for z in self.pending.values() if z is not None]).reshape(-1, self.dim_z)
+        self.pending = {}
+        self.since_obs[slots] += 1
+
+        # got no observation, freeze the current state for a potential re-update
+        missed = slots[~seen]
+        observed = self.observed[missed]
+        self.x_saved[missed] = np.where(observed[:, None], self.x[missed], self.x_saved[missed])
+        self.P_saved[missed] = np.where(
+            observed[:, None, None], self.P[missed], self.P_saved[missed]
+        )
+        self.frozen[missed] |= self.observed[missed]
+        self.observed[missed] = False
+
+        slots = slots[seen]
+        refound = self.frozen[slots]
+        if refound.any():
+            self.unfreeze(slots[refound], zs[refound])
+        self.last_z[slots[~refound]] = zs[~refound]
+        self.frozen[slots] = False
+        self.observed[slots] = True
+        self.since_obs[slots] = 0
+        self.correct(slots, zs)
+
+    def unfreeze(self, slots, zs):
+        """
+        Observation-centric re-update: restore the state saved by the freeze and correct it
+        with virtual observations moving linearly in [x, y, w, h] from the last observation
+        before the gap to `zs`, one per step. All tracks step together, each one for the
+        length of its own gap.
+        :param slots: np.ndarray (N,), frozen slots observed again
+        :param zs: np.ndarray (N, 4), new observations [x, y, s, r]
+        """
+        self.x[slots] = self.x_saved[slots]
+        self.P[slots] = self.P_saved[slots]
+
+        x1, y1, s1, r1 = self.last_z[slots].T
+        w1 = np.sqrt(s1 * r1)
+        h1 = np.sqrt(s1 / r1)
+        x2, y2, s2, r2 = zs.T
+        w2 = np.sqrt(s2 * r2)
+        h2 = np.sqrt(s2 / r2)
+        time_gap = self.since_obs[slots]
+        dx = (x2 - x1) / time_gap
+        dy = (y2 - y1) / time_gap
+        dw = (w2 - w1) / time_gap
+        dh = (h2 - h1) / time_gap
+
+        for i in range(time_gap.max()):
+            # the constant speed hypothesis, tracks with a shorter gap are done
+            step = i < time_gap
+            x = x1 + (i + 1) * dx
+            y = y1 + (i + 1) * dy
+            w = w1 + (i + 1) * dw
+            h = h1 + (i + 1) * dh
+            virtual = np.stack((x, y, w * h, w / h), axis=1)[step]
+            self.correct(slots[step], virtual)
+            self.last_z[slots[step]] = virtual
+            # no predict after the last virtual observation
+            more = i + 1 < time_gap
+            self.predict(slots[more], clamp=False)
+
+    def correct(self, slots, zs):
+        """
+        Kalman update of `slots`, (I-KH)P(I-KH)' + KRK' form of the covariance.
+        :param slots: np.ndarray (N,)
+        :param zs: np.ndarray (N, 4), observations [x, y, s, r]
+        """
+        if len(slots) == 0:
+            return
+        x, P = self.x[slots], self.P[slots]
+        # y = z - Hx
+        y = zs - x @ self.H.T
+        PHT = P @ self.H.T
+        # S = HPH' + R
+        S = self.H @ PHT + self.R
+        K = PHT @ np.linalg.inv(S)
+        self.x[slots] = x + (K @ y[:, :, None])[:, :, 0]
+        I_KH = self._I - K @ self.H
+        self.P[slots] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+
+    def predict(self, slots, clamp=True):
+        """
+        Predict the state of `slots` in one step.
+        :param slots: np.ndarray (N,)
+        :param clamp: the scale velocity of tracks which would get a non-positive area is reset to 0
+        """
+        self.flush()
+        if len(slots) == 0:
+            return
+        x = self.x[slots]
+        if clamp:
+            x[x[:, 6] + x[:, 2] <= 0, 6] *= 0.0
+        self.x[slots] = x @ self.F.T
+        self.P[slots] = self.F @ self.P[slots] @ self.F.T + self.Q
+
+    def state(self, slots):
+        """
+        :param slots: np.ndarray (N,)
+        :rtype x np.ndarray (N, 7), current state after the queued updates
+        """
+        self.flush()
+        return self.x[slots]
+
+    def tlbr(self, slots):
+        """
+        :param slots: np.ndarray (N,)
+        :rtype tlbrs np.ndarray (N, 4), x1y1x2y2 of the current state
+        """
+        x = self.state(slots)
+        w = np.sqrt(x[:, 2] * x[:, 3])
+        h = x[:, 2] / w
+        return np.stack(
+            (x[:, 0] - w / 2., x[:, 1] - h / 2., x[:, 0] + w / 2., x[:, 1] + h / 2.), axis=1
+        )
@@ -0,0 +1,107 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torchvision.ops import roi_align
+from torchvision.transforms.functional import normalize
+
+
+class ROICropper(object):
+    """Batched crop&resize of the square template/search regions used by MixFormer.
+
+    All regions of a frame are cropped with a single `roi_align` call. The geometry is the
+    same as `resized_crop` on a zero padded image: regions are centered at the box, have a
+    side of `ceil(sqrt(w * h) * search_area_factor)` and pixels outside the frame are 0.
+    Only the outermost output rows/columns may differ slightly, since `roi_align` samples
+    the neighbouring pixels instead of replicating the border of the crop.
+    """
+
+    def __init__(self, settings, mean, std):
+        """
+        :param settings: MixViT settings holding `search_area_factor` and `output_sz`
+        :param mean: normalization mean, cfg.DATA.MEAN
+        :param std: normalization std, cfg.DATA.STD
+        """
+        self.search_area_factor = settings.search_area_factor
+        self.output_sz = settings.output_sz
+        self.mean = mean
+        self.std = std
+
+    def regions(self, boxes, s):
+        """
+        Compute the crop region of every box.
+        :param boxes: np.ndarray (N, 4), tlwh
+        :param s: 'template' or 'search'
+
+        :rtype regions np.ndarray (N, 3), left, top and side length of every region.
+            The side length is 0 for degenerate boxes, which have no valid region.
+        """
+        boxes = np.asarray(boxes).reshape(-1, 4).astype(np.int).astype(np.float64)
+        x, y, w, h = boxes.T
+        valid = (w > 0) & (h > 0)
+        crop_sz = np.ceil(np.sqrt(np.where(valid, w * h, 0)) * self.search_area_factor[s])
+        # x:left, y:top
+        left = np.round(x + 0.5 * w - crop_sz * 0.5)
+        top = np.round(y + 0.5 * h - crop_sz * 0.5)
+        return np.stack((left, top, crop_sz), axis=1)
+
+    def transform(self, annos, regions, s):
+        """
+        Transform boxes to the coordinates of every resized region.
+        :param annos: np.ndarray (M, 4), tlwh
+        :param regions: np.ndarray (N, 3) from `regions`
+        :param s: 'template' or 'search'
+
+        :rtype coords np.ndarray (N, M, 4), tlwh inside every region. Boxes are moved
+            outside of degenerate regions so they never fall inside the crop.
+        """
+        annos = np.asarray(annos, dtype=np.float64).reshape(-1, 4)
+        coords = np.repeat(annos[None], len(regions), axis=0)
+        valid = regions[:, 2] > 0
+        scale = np.where(valid, regions[:, 2], 1) / self.output_sz[s]
+        # (origin_x - x, origin_y - y, origin_w, origin_h)/factor
+        coords[:, :, 0:2] -= regions[:, None, 0:2]
+        coords /= scale[:, None, None]
+        coords[~valid] = -1
+        return coords
+
+    @torch.no_grad()
+    def crop(self, img, boxes, s, annos=None):
+        """
+        Crop&resize the regions of all `boxes` in one call and normalize them for the network.
+        :param img: torch.Tensor (3, H, W), uint8
+        :param boxes: np.ndarray (N, 4), tlwh, the centers of the regions
+        :param s: 'template' or 'search'
+        :param annos: np.ndarray (M, 4), optional boxes to be transformed to every region
+
+        :rtype crops torch.Tensor (N, 3, output_sz, output_sz) on the device of `img`,
+            regions np.ndarray (N, 3) from `regions`, degenerate boxes get a blank crop,
+            and coords np.ndarray (N, M, 4) if `annos` is given
+        """
+        output_sz = self.output_sz[s]
+        regions = self.regions(boxes, s)
+        valid = regions[:, 2] > 0
+
+        crops = torch.zeros(
+            (len(regions), 3, output_sz, output_sz), dtype=torch.float, device=img.device
+        )
+        if valid.any():
+            # pad by one pixel, so that bilinear samples at the border blend with zeros
+            # exactly as resized_crop does on the zero padded crop
+            padded = F.pad(img.float().unsqueeze(0), (1, 1, 1, 1))
+            left, top, crop_sz = regions[valid].T + np.array([[1], [1], [0]])
+            rois = np.stack(
+                (np.zeros_like(left), left, top, left + crop_sz, top + crop_sz), axis=1
+            )
+            crops[torch.from_numpy(valid).to(img.device)] = roi_align(
+                padded,
+                torch.from_numpy(rois).float().to(img.device),
+                output_size=output_sz,
+                spatial_scale=1.0,
+                sampling_ratio=1,
+                aligned=True,
+            )
+        crops = normalize(crops.div(255), self.mean, self.std)
+
+        if annos is None:
+            return crops, regions
+        return crops, regions, self.transform(annos, regions, s)
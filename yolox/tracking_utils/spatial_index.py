@@ -0,0 +1,226 @@
+import numpy as np
+
+from cython_bbox import bbox_overlaps as bbox_ious
+
+# queries with up to this many query x indexed box pairs use the all-pairs matrix, which is
+# cheaper than the grid for the few dozen boxes of a typical frame
+DENSE_PAIRS = 1 << 16
+
+
+class BoxIndex(object):
+    """Uniform grid over tlbr boxes for overlap queries without all-pairs matrices.
+
+    Every box is registered in the grid cells its extent touches and a query only tests the
+    boxes sharing a cell with it, so frames with hundreds of boxes cost O(N + overlapping
+    pairs) instead of O(N^2). Small queries use the all-pairs matrix instead. Overlaps follow
+    `cython_bbox`, i.e. `matching.ious`: a box covers the pixels x1..x2 and y1..y2 inclusive,
+    and the IoUs are bit-identical to the dense ones. Boxes with non-finite coordinates
+    overlap nothing.
+    """
+
+    def __init__(self, tlbrs, cell_size=None):
+        """
+        :param tlbrs: np.ndarray (N, 4) | list[tlbr], boxes to index
+        :param cell_size: side of the grid cells, the mean box side if None
+        """
+        self.boxes = np.asarray(tlbrs, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = cell_size
+        # the grid is built by the first query too large for the all-pairs matrix
+        self.keys = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _build(self):
+        valid = np.isfinite(self.boxes).all(axis=1)
+        finite = self.boxes[valid]
+        self.origin = finite[:, :2].min(axis=0) if len(finite) > 0 else np.zeros(2)
+        cell_size = self.cell_size
+        if cell_size is None:
+            sides = np.maximum(finite[:, 2] - finite[:, 0], finite[:, 3] - finite[:, 1]) + 1
+            cell_size = max(float(sides.mean()), 1.0) if len(sides) > 0 else 1.0
+        # a few huge boxes must not blow up the number of entries
+        while True:
+            self.cell_size = cell_size
+            lo, hi = self._cells(self.boxes)
+            span = np.maximum(hi - lo + 1, 0)
+            if span[:, 0] @ span[:, 1] <= 4 * len(self.boxes) + 16:
+                break
+            cell_size *= 2
+        self.lo = lo
+        self.rows = int(hi[:, 1].max()) + 1 if len(finite) > 0 else 1
+        self.cols = int(hi[:, 0].max()) + 1 if len(finite) > 0 else 1
+
+        ids, keys = self._entries(lo, hi)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.ids = ids[order]
+
+    def _cells(self, boxes):
+        """
+        First & last (column, row) cell covered by every box, the last one is before the
+        first one for boxes with non-finite coordinates.
+        """
+        valid = np.isfinite(boxes).all(axis=1)
+        boxes = np.where(valid[:, None], boxes, 0.0)
+        lo = np.floor((boxes[:, :2] - self.origin) / self.cell_size).astype(np.int64)
+        hi = np.floor((boxes[:, 2:] + 1 - self.origin) / self.cell_size).astype(np.int64)
+        hi[~valid] = lo[~valid] - 1
+        return lo, hi
+
+    def _entries(self, lo, hi):
+        """(box, cell key) of every cell covered by every box"""
+        span = np.maximum(hi - lo + 1, 0)
+        counts = span[:, 0] * span[:, 1]
+        box = np.repeat(np.arange(len(lo)), counts)
+        rank = np.arange(len(box)) - np.repeat(np.cumsum(counts) - counts, counts)
+        rows = span[box, 1]
+        keys = (lo[box, 0] + rank // rows) * self.rows + lo[box, 1] + rank % rows
+        return box, keys
+
+    def _grid_ious(self, boxes):
+        if self.keys is None:
+            self._build()
+        lo, hi = self._cells(boxes)
+        # cells outside of the grid hold no boxes
+        lo = np.maximum(lo, 0)
+        hi = np.minimum(hi, (self.cols - 1, self.rows - 1))
+        qbox, keys = self._entries(lo, hi)
+
+        # candidates: the indexed boxes sharing a cell with a query box
+        start = np.searchsorted(self.keys, keys, side="left")
+        found = np.searchsorted(self.keys, keys, side="right") - start
+        qi = np.repeat(qbox, found)
+        bi = self.ids[np.arange(len(qi)) + np.repeat(start - np.cumsum(found) + found, found)]
+        keys = np.repeat(keys, found)
+
+        # same operations as cython_bbox, for identical rounding
+        a, b = boxes.T, self.boxes.T
+        iw = np.minimum(a[2][qi], b[2][bi]) - np.maximum(a[0][qi], b[0][bi]) + 1
+        ih = np.minimum(a[3][qi], b[3][bi]) - np.maximum(a[1][qi], b[1][bi]) + 1
+        overlap = (iw > 0) & (ih > 0)
+        qi, bi, keys, iw, ih = qi[overlap], bi[overlap], keys[overlap], iw[overlap], ih[overlap]
+
+        # a pair shares several cells, keep it only in the one holding the top left corner
+        # of the intersection, which is the last of the first cells of the two boxes
+        lo_a, lo_b = lo.T, self.lo.T
+        first = keys == (
+            np.maximum(lo_a[0][qi], lo_b[0][bi]) * self.rows + np.maximum(lo_a[1][qi], lo_b[1][bi])
+        )
+        qi, bi, inter = qi[first], bi[first], iw[first] * ih[first]
+
+        area_a = (a[2][qi] - a[0][qi] + 1) * (a[3][qi] - a[1][qi] + 1)
+        area_b = (b[2][bi] - b[0][bi] + 1) * (b[3][bi] - b[1][bi] + 1)
+        order = np.lexsort((bi, qi))
+        ious = inter / (area_a + area_b - inter)
+        return qi[order], bi[order], ious[order]
+
+    def ious(self, tlbrs):
+        """
+        Sparse `matching.ious(tlbrs, indexed boxes)`, only the overlapping pairs.
+        :param tlbrs: np.ndarray (M, 4) | list[tlbr], query boxes
+
+        :rtype qi np.ndarray (P,), bi np.ndarray (P,), indices of the query & indexed box of
+            every overlapping pair in row-major order, like `np.nonzero` on the IoU matrix,
+            ious np.ndarray (P,) > 0
+        """
+        boxes = np.asarray(tlbrs, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) * len(self.boxes) > DENSE_PAIRS:
+            return self._grid_ious(boxes)
+        ious = np.zeros((len(boxes), len(self.boxes)), dtype=np.float64)
+        if ious.size > 0:
+            ious = bbox_ious(np.ascontiguousarray(boxes), np.ascontiguousarray(self.boxes))
+        qi, bi = np.nonzero(ious > 0)
+        return qi, bi, ious[qi, bi]
+
+    def query(self, tlbrs):
+        """
+        Find the pairs of query & indexed boxes that overlap.
+        :param tlbrs: np.ndarray (M, 4) | list[tlbr], query boxes
+
+        :rtype qi np.ndarray (P,), bi np.ndarray (P,), see `ious`
+        """
+        qi, bi, _ = self.ious(tlbrs)
+        return qi, bi
+
+    def max_iou(self):
+        """
+        Max IoU of every indexed box with any other indexed box, 0 without overlaps.
+        :rtype max_iou np.ndarray (N,)
+        """
+        qi, bi, ious = self.ious(self.boxes)
+        other = qi != bi
+        max_iou = np.zeros(len(self.boxes), dtype=np.float64)
+        np.maximum.at(max_iou, qi[other], ious[other])
+        return max_iou
+
+    def covered_area(self):
+        """
+        Fraction of every indexed box covered by the union of the other boxes. The boxes must
+        be integer, a box covers the pixels x1 <= x < x2 and y1 <= y < y2. The union is
+        computed exactly on the box edges, the result is the same as counting the pixels.
+        :rtype covered np.ndarray (N,), nan for empty boxes
+        """
+        qi, bi = self.query(self.boxes)
+        other = qi != bi
+        qi, bi = qi[other], bi[other]
+        boxes = self.boxes.astype(np.int64)
+        area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+        # the other boxes clipped to every box they overlap
+        rects = np.clip(boxes[bi], np.tile(boxes[qi, :2], 2), np.tile(boxes[qi, 2:], 2))
+        keep = (rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])
+        qi, rects = qi[keep], rects[keep]
+
+        # boxes are grouped by their number of rects rounded up to a power of two, every group
+        # is padded with empty rects at the corner of the box
+        counts = np.bincount(qi, minlength=len(boxes))
+        rank = np.arange(len(qi)) - (np.cumsum(counts) - counts)[qi]
+        width = 1 << np.ceil(np.log2(np.maximum(counts, 1))).astype(np.int64)
+        union = np.zeros(len(boxes), dtype=np.int64)
+        for m in np.unique(width[counts > 0]):
+            group = np.nonzero((width == m) & (counts > 0))[0]
+            row = np.full(len(boxes), -1)
+            row[group] = np.arange(len(group))
+            padded = np.tile(boxes[group, None, :2], (1, m, 2))
+            sel = row[qi] >= 0
+            padded[row[qi[sel]], rank[sel]] = rects[sel]
+            union[group] = union_area(padded)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return 1 - (area - union) / area
+
+
+def union_area(rects):
+    """
+    Exact area of the union of every group of rectangles, by coordinate compression: the
+    edges split the plane into cells, a cell is covered if any rectangle contains it.
+    :param rects: np.ndarray (B, M, 4), integer x1y1x2y2, x2 >= x1 and y2 >= y1
+
+    :rtype area np.ndarray (B,)
+    """
+    B, M = rects.shape[:2]
+    batch = np.arange(B)[:, None]
+
+    def compress(lo, hi):
+        # sorted edges, their gaps & the position of every edge, ties of equal edges only
+        # produce cells of zero size
+        edges = np.concatenate((lo, hi), axis=1)
+        order = np.argsort(edges, axis=1, kind="stable")
+        rank = np.empty_like(order)
+        rank[batch, order] = np.arange(2 * M)
+        gaps = np.diff(np.take_along_axis(edges, order, axis=1), axis=1)
+        return gaps, rank[:, :M], rank[:, M:]
+
+    dx, x1, x2 = compress(rects[..., 0], rects[..., 2])
+    dy, y1, y2 = compress(rects[..., 1], rects[..., 3])
+
+    # every rectangle adds 1 to the cells it covers, via a 2D difference array
+    size = 2 * M
+    base = batch * size * size
+    x1, x2 = base + x1 * size, base + x2 * size
+    index = np.concatenate((x1 + y1, x2 + y1, x1 + y2, x2 + y2), axis=1)
+    weights = np.repeat(np.array([1, -1, -1, 1]), M)[None].repeat(B, axis=0)
+    diff = np.bincount(index.ravel(), weights.ravel(), minlength=B * size * size)
+    cover = diff.reshape(B, size, size).cumsum(axis=1).cumsum(axis=2)[:, :-1, :-1]
+    return ((cover > 0.5) * dx[:, :, None] * dy[:, None, :]).sum(axis=(1, 2))
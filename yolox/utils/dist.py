@@ -27,6 +27,7 @@ __all__ = [
     "get_local_rank",
     "get_local_size",
     "time_synchronized",
+    "stream_synchronized",
     "gather",
     "all_gather",
 ]
@@ -253,3 +254,13 @@ def time_synchronized():
     if torch.cuda.is_available():
         torch.cuda.synchronize()
     return time.time()
+
+
+def stream_synchronized(device=None):
+    """
+    pytorch-accurate time of the work queued on the current cuda stream of `device`, unlike
+    `time_synchronized` the other streams keep running
+    """
+    if device is not None and device.type == "cuda":
+        torch.cuda.current_stream(device).synchronize()
+    return time.time()
@@ -3,11 +3,12 @@
 # Copyright (c) 2014-2021 Megvii Inc. All rights reserved.
 
 import cv2
+import torch
 
 import os
 import subprocess
 
-__all__ = ["configure_nccl", "configure_module"]
+__all__ = ["configure_nccl", "configure_module", "get_device", "configure_cpu"]
 
 
 def configure_nccl():
@@ -49,3 +50,30 @@ def configure_module(ulimit_value=8192):
     except Exception:
         # cv2 version mismatch might rasie exceptions.
         pass
+
+
+def get_device(args):
+    """
+    Device to run tracking on.
+
+    Args:
+        args: arguments with `device` ("gpu" or "cpu") and `local_rank`.
+
+    Returns:
+        torch.device
+    """
+    if args.device == "cpu":
+        return torch.device("cpu")
+    return torch.device("cuda:{}".format(args.local_rank))
+
+
+def configure_cpu(num_threads=None):
+    """
+    Configure pytorch for inference on cpu.
+
+    Args:
+        num_threads(int): number of intra-op threads, pytorch's default (one per
+            physical core) is kept if None. Default value: None.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)